@@ -0,0 +1,445 @@
+#!/usr/bin/env python
+# Copyright (C) 2013  Johannes Dewender
+# This benchmark is free. You can redistribute and/or modify it at will.
+"""Benchmarks for the calculation of disc IDs and the Disc objects
+
+All benchmarks use synthetic TOCs, so no drive is needed,
+reading a disc is simulated by putting a TOC into the libdiscid handle.
+The benchmarks needing libdiscid are skipped when it is not available.
+The results can be saved as JSON, one file per version,
+and compared to an earlier run to make regressions visible.
+"""
+
+import gc
+import os
+import sys
+import json
+import time
+import random
+import timeit
+import argparse
+import platform
+import subprocess
+import tracemalloc
+
+import discid
+
+DISC_PROPERTIES = ["id", "freedb_id", "submission_url", "toc_string",
+                   "first_track_num", "last_track_num", "sectors", "seconds",
+                   "cddb_query_string"]
+TRACK_PROPERTIES = ["number", "offset", "sectors", "seconds"]
+
+
+def synthetic_tocs(count, seed=0, tracks=None):
+    """Generate plausible TOCs as (first, last, sectors, offsets)
+
+    The number of tracks is random unless `tracks` is given.
+    """
+    rand = random.Random(seed)
+    tocs = []
+    for _ in range(count):
+        last = tracks or rand.randint(1, 99)
+        offsets = [150]
+        for _ in range(last - 1):
+            offsets.append(offsets[-1] + rand.randint(1, 3500))
+        sectors = offsets[-1] + rand.randint(1, 30000)
+        tocs.append((1, last, sectors, offsets))
+    return tocs
+
+def _best(function, repeat):
+    return min(timeit.repeat(function, number=1, repeat=repeat))
+
+def _per_access(statement, namespace, number=2000, repeat=5):
+    """Best time per execution of `statement` in nanoseconds
+    """
+    timer = timeit.Timer(statement, globals=namespace)
+    return min(timer.repeat(number=number, repeat=repeat)) / number * 1e9
+
+
+def bench_put(tocs, engine, repeat=3):
+    """Time per TOC in microseconds for put and reading the IDs
+    """
+    def run():
+        for first, last, sectors, offsets in tocs:
+            disc = discid.put(first, last, sectors, offsets, engine=engine)
+            disc.id
+            disc.freedb_id
+            disc.toc_string
+    return {"us/TOC": _best(run, repeat) / len(tocs) * 1e6}
+
+def bench_put_many(tocs, engine=None, repeat=3):
+    """Time per TOC in microseconds for :func:`discid.put_many`
+    """
+    columns = list(zip(*tocs))
+    return {"us/TOC": _best(lambda: discid.put_many(*columns), repeat)
+            / len(tocs) * 1e6}
+
+def bench_disc_properties(tocs, engine):
+    """Time per access in nanoseconds for every property of a Disc
+    """
+    disc = discid.put(*tocs[0], engine=engine)
+    return dict(("%s ns" % name, _per_access("disc.%s" % name,
+                                             {"disc": disc}))
+                for name in DISC_PROPERTIES)
+
+def bench_track_properties(tocs, engine):
+    """Time per access in nanoseconds for every property of a Track
+    """
+    track = discid.put(*tocs[0], engine=engine).tracks[0]
+    return dict(("%s ns" % name, _per_access("track.%s" % name,
+                                             {"track": track}))
+                for name in TRACK_PROPERTIES)
+
+def bench_read(tocs, engine=None, count=2000, repeat=3):
+    """Time per read in microseconds for :func:`discid.read`
+    and reading the IDs, also with a `timeout` and as a snapshot.
+
+    No drive is needed, the synthetic TOCs are put into the handle
+    where libdiscid would read the disc.
+    """
+    from discid.disc import Disc, _c_offsets
+    from discid.libdiscid import _LIB
+    tocs = tocs[:count]
+    prepared = [(first, last, _c_offsets(first, sectors, offsets))
+                for first, last, sectors, offsets in tocs]
+    position = [0]
+    def simulated_read(handle, device, c_features):
+        first, last, c_offsets = prepared[position[0] % len(prepared)]
+        position[0] += 1
+        return _LIB.discid_put(handle, first, last, c_offsets) == 1
+    read_handle = Disc._read_handle
+    Disc._read_handle = staticmethod(simulated_read)
+    try:
+        results = {}
+        for name, kwargs in [("us/read", {}),
+                             ("us/read timeout", {"timeout": 10}),
+                             ("us/read snapshot", {"snapshot": True})]:
+            def run():
+                for _ in tocs:
+                    disc = discid.read("simulated", **kwargs)
+                    disc.id
+                    disc.freedb_id
+            results[name] = _best(run, repeat) / len(tocs) * 1e6
+        return results
+    finally:
+        Disc._read_handle = read_handle
+
+def bench_99_tracks(tocs, engine):
+    """Time in microseconds for the track list
+    and the CDDB query string of a disc with 99 tracks
+    """
+    disc = discid.put(*synthetic_tocs(1, tracks=99)[0], engine=engine)
+    namespace = {"disc": disc}
+    return {"tracks us": _per_access("disc.tracks", namespace, 200) / 1e3,
+            "cddb_query_string us":
+                _per_access("disc.cddb_query_string", namespace, 200) / 1e3}
+
+def bench_pool(tocs, engine=None, repeat=3):
+    """Time per TOC in microseconds for :meth:`discid.HandlePool.put`
+    and reading the IDs, in one and in four threads
+    """
+    import threading
+    def work(pool, tocs):
+        for first, last, sectors, offsets in tocs:
+            disc = pool.put(first, last, sectors, offsets)
+            disc.id
+            disc.freedb_id
+    def threaded(pool):
+        threads = [threading.Thread(target=work, args=(pool, tocs[i::4]))
+                   for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    with discid.HandlePool(maxsize=4) as pool:
+        return {"us/TOC": _best(lambda: work(pool, tocs), repeat)
+                          / len(tocs) * 1e6,
+                "us/TOC 4 threads": _best(lambda: threaded(pool), repeat)
+                                    / len(tocs) * 1e6}
+
+def bench_memory(tocs, engine, count=1000):
+    """Python heap in bytes per live Disc, measured with tracemalloc.
+
+    Memory allocated by libdiscid itself is not included.
+    """
+    tocs = (tocs * (count // len(tocs) + 1))[:count]
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        discs = [discid.put(*toc, engine=engine) for toc in tocs]
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    del discs
+    return {"bytes/Disc": float(after - before) / count}
+
+def bench_import(tocs=None, engine=None, repeat=5):
+    """Time in milliseconds for `import discid` in a new interpreter,
+    without the start of the interpreter itself
+    """
+    # import the same discid as this script, wherever it is run from
+    directory = os.path.dirname(os.path.dirname(os.path.abspath(
+        discid.__file__)))
+    def run(code):
+        return _best(lambda: subprocess.check_call([sys.executable, "-c",
+                                                     code], cwd=directory),
+                     repeat)
+    return {"ms": (run("import discid") - run("pass")) * 1e3}
+
+def bench_lookup(tocs, engine=None, count=200):
+    """Milliseconds per lookup with the local stub server,
+    without a rate limit, over one and four connections
+    """
+    from discid.lookup import StubServer
+    discs = [discid.put(*toc, engine="python") for toc in tocs[:count]]
+    results = {}
+    with StubServer(latency=0.005) as stub:
+        for disc in discs[::2]:
+            stub.add(disc)
+        for connections in (1, 4):
+            with discid.LookupClient(stub.url, rate=None,
+                                     connections=connections) as client:
+                elapsed = _best(lambda: list(client.lookup_many(discs)), 1)
+            results["ms/lookup %d connections" % connections] = \
+                elapsed / len(discs) * 1e3
+    return results
+
+def bench_cddb(tocs, engine=None, count=1000):
+    """Milliseconds per query with the local fake CDDB server
+    answering with a latency of 1 ms,
+    over CDDBP with and without pipelining and over HTTP
+    """
+    from discid.cddb import FakeCDDBServer
+    discs = [discid.put(*toc, engine="python") for toc in tocs[:count]]
+    results = {}
+    with FakeCDDBServer(latency=0.001) as server:
+        for disc in discs[::2]:
+            server.add(disc)
+        for name, url, pipeline in [("cddbp", server.cddbp_url, 1),
+                                    ("cddbp pipelined", server.cddbp_url,
+                                     100),
+                                    ("http", server.http_url, 1)]:
+            with discid.CDDBClient(url, pipeline=pipeline) as client:
+                elapsed = _best(lambda: list(client.query_many(discs)), 1)
+            results["ms/query %s" % name] = elapsed / len(discs) * 1e3
+    return results
+
+def bench_scan(tocs, engine=None, count=2000):
+    """Microseconds per rip file read by :func:`discid.scan_rips`
+    from EAC logs in a temporary directory, in one and in all processes
+    """
+    import shutil
+    import tempfile
+    directory = tempfile.mkdtemp(prefix="discid-bench-")
+    try:
+        for number, (first, last, sectors, offsets) in \
+                enumerate(tocs[:count]):
+            rows = [" %d | 0:00.00 | 0:00.00 | %d | %d"
+                    % (track, offset - 150, end - 151)
+                    for track, (offset, end)
+                    in enumerate(zip(offsets, offsets[1:] + [sectors]),
+                                 first)]
+            path = os.path.join(directory, "%03d" % (number // 100),
+                                "%05d.log" % number)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, "w") as stream:
+                stream.write("TOC of the extracted CD\n\n%s\n"
+                             % "\n".join(rows))
+        results = {}
+        for name, workers in [("1 process", 1), ("all processes", None)]:
+            elapsed = _best(lambda: list(discid.scan_rips(directory,
+                                                          workers)), 1)
+            results["us/file %s" % name] = \
+                elapsed / min(count, len(tocs)) * 1e6
+        return results
+    finally:
+        shutil.rmtree(directory)
+
+def bench_store(tocs, engine=None, repeat=3):
+    """Time per TOC in microseconds for writing a file
+    with :class:`discid.TOCWriter` and reading it with
+    :class:`discid.TOCReader`, record by record and as columns
+    """
+    import shutil
+    import tempfile
+    directory = tempfile.mkdtemp(prefix="discid-bench-")
+    path = os.path.join(directory, "tocs")
+    def write():
+        if os.path.exists(path):
+            os.remove(path)
+        with discid.TOCWriter(path, ids=True) as writer:
+            writer.write_many(tocs)
+    def read():
+        with discid.TOCReader(path) as reader:
+            for record in reader:
+                list(record.offsets)
+                record.id
+    def columns():
+        with discid.TOCReader(path) as reader:
+            reader.columns()
+    try:
+        return {"us/TOC write": _best(write, repeat) / len(tocs) * 1e6,
+                "us/TOC read": _best(read, repeat) / len(tocs) * 1e6,
+                "us/TOC columns": _best(columns, repeat) / len(tocs) * 1e6}
+    finally:
+        shutil.rmtree(directory)
+
+def bench_index(tocs, engine=None, count=1000):
+    """Time in microseconds per TOC for building a :class:`discid.TOCIndex`
+    and a :class:`discid.FreeDBIndex` and per TOC looked up in them
+    """
+    import shutil
+    import tempfile
+    directory = tempfile.mkdtemp(prefix="discid-bench-")
+    lookups = tocs[:count]
+    index = discid.TOCIndex()
+    def build():
+        for toc in tocs:
+            index.add(*toc)
+    results = {"us/TOC TOCIndex.add": _best(build, 1) / len(tocs) * 1e6}
+    # every bucket is sorted on its first lookup, which only slows down
+    # the first of the repeats
+    results["us/find TOCIndex"] = _best(
+        lambda: [index.find_toc(*toc) for toc in lookups], 3) \
+        / len(lookups) * 1e6
+    path = os.path.join(directory, "freedb")
+    try:
+        results["us/TOC FreeDBIndex.build"] = _best(
+            lambda: discid.FreeDBIndex.build(path, tocs).close(), 1) \
+            / len(tocs) * 1e6
+        with discid.FreeDBIndex(path) as freedb:
+            results["us/find FreeDBIndex"] = _best(
+                lambda: [freedb.find_toc(*toc) for toc in lookups], 3) \
+                / len(lookups) * 1e6
+    finally:
+        shutil.rmtree(directory)
+    return results
+
+def bench_util(tocs, engine=None, repeat=3):
+    """Time per TOC in microseconds for the helpers converting sectors,
+    applied to the offsets of all TOCs in one column
+    """
+    from array import array
+    offsets = array("i")
+    index = []
+    sectors = []
+    for first, last, disc_sectors, track_offsets in tocs:
+        index.append(len(offsets))
+        offsets.extend(track_offsets)
+        sectors.append(disc_sectors)
+    results = {}
+    for name, function in [
+            ("sectors_to_seconds",
+             lambda: discid.sectors_to_seconds(offsets)),
+            ("sectors_to_msf", lambda: discid.sectors_to_msf(offsets)),
+            ("format_msf", lambda: discid.format_msf(offsets)),
+            ("track_lengths",
+             lambda: discid.track_lengths(offsets, sectors, index))]:
+        results["us/TOC %s" % name] = _best(function, repeat) \
+            / len(tocs) * 1e6
+    return results
+
+# name, function, whether it is run for every engine
+BENCHMARKS = [
+    ("put", bench_put, True),
+    ("put_many", bench_put_many, False),
+    ("disc_properties", bench_disc_properties, True),
+    ("track_properties", bench_track_properties, True),
+    ("99_tracks", bench_99_tracks, True),
+    ("read", bench_read, False),
+    ("pool", bench_pool, False),
+    ("memory", bench_memory, True),
+    ("import", bench_import, False),
+    ("lookup", bench_lookup, False),
+    ("cddb", bench_cddb, False),
+    ("scan", bench_scan, False),
+    ("store", bench_store, False),
+    ("index", bench_index, False),
+    ("util", bench_util, False),
+]
+
+
+def run(count=10000, only=None):
+    """Run the benchmarks and return the results
+    as a dictionary of benchmark name to measurements
+    """
+    tocs = synthetic_tocs(count)
+    results = {}
+    for name, function, per_engine in BENCHMARKS:
+        if only and not [part for part in only if part in name]:
+            continue
+        for engine in (discid.ENGINES if per_engine else [None]):
+            key = name if engine is None else "%s.%s" % (name, engine)
+            try:
+                results[key] = function(tocs, engine)
+            except OSError as exc:
+                print("%-30s skipped: %s" % (key, exc))
+                continue
+            for unit, value in sorted(results[key].items()):
+                print("%-30s %12.1f %s" % (key, value, unit))
+    return results
+
+def save(results, directory):
+    """Save the results as `<version>.json` in `directory`
+    and return the path
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    path = os.path.join(directory, "%s.json" % discid.__version__)
+    data = {"version": discid.__version__,
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "results": results}
+    with open(path, "w") as result_file:
+        json.dump(data, result_file, indent=1, sort_keys=True)
+    return path
+
+def compare(results, path, threshold=0.1):
+    """Print the change to the results in `path`
+    and return the number of regressions larger than `threshold`.
+
+    All measurements are costs, so larger numbers are regressions.
+    """
+    with open(path) as result_file:
+        data = json.load(result_file)
+    print("compared to %s (python %s)" % (data["version"], data["python"]))
+    regressions = 0
+    for key in sorted(results):
+        for unit, value in sorted(results[key].items()):
+            old = data["results"].get(key, {}).get(unit)
+            if not old:
+                continue
+            change = (value - old) / old
+            mark = ""
+            if change > threshold:
+                mark = "  REGRESSION"
+                regressions += 1
+            print("%-30s %12s %+7.1f%%%s"
+                  % (key, unit, change * 100, mark))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("count", type=int, nargs="?", default=10000,
+                        help="number of synthetic TOCs")
+    parser.add_argument("--only", action="append",
+                        help="only run benchmarks with this in the name")
+    parser.add_argument("--save", metavar="DIRECTORY",
+                        help="save the results as <version>.json")
+    parser.add_argument("--compare", metavar="FILE",
+                        help="compare to saved results")
+    args = parser.parse_args(argv)
+    results = run(args.count, args.only)
+    if args.save:
+        print("saved to %s" % save(results, args.save))
+    if args.compare:
+        return 1 if compare(results, args.compare) else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
+
+# vim:set shiftwidth=4 smarttab expandtab:
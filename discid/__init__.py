@@ -23,35 +23,94 @@ This module provides a python-like API for that functionality.
 The user is expected to create a :class:`Disc` object
 using :func:`read` or :func:`put` and extract the generated information.
 
-Importing this module will open libdiscid at the same time
-and will raise :exc:`OSError` when libdiscid is not found.
+Libdiscid is opened when it is used the first time,
+which will raise :exc:`OSError` when libdiscid is not found.
+See :func:`configure` to set where libdiscid is found.
 """
 
-from discid.disc import read, put, Disc, DiscError, TOCError
+import sys
+import importlib
+
+from discid.disc import read, put, Disc, DiscError, DiscTimeoutError
+from discid.disc import TOCError
 from discid.track import Track
-from discid.libdiscid import get_default_device
+from discid.snapshot import DiscSnapshot, TrackSnapshot
+from discid.libdiscid import get_default_device, configure
+from discid.engine import set_engine, get_engine
+# these functions have the names of their modules,
+# which would hide them once the module is imported
+from discid.instrument import instrument, stats, set_stats_hook
+from discid.dedupe import dedupe
+from discid.util import sectors_to_seconds, sectors_to_msf, format_msf
+from discid.util import track_lengths
 import discid.libdiscid
 import discid.disc
+import discid.engine
+
+# the rest is imported on first use, most programs only read a disc
+_LAZY = {
+    "discid.batch": ["put_many", "BatchResult", "disc_ids_many", "DiscIDs"],
+    "discid.pool": ["HandlePool"],
+    "discid.devices": ["get_devices", "read_all"],
+    "discid.parse": ["from_toc_string", "from_cddb_query", "CDDBQuery",
+                     "parse_toc_strings", "parse_cddb_queries",
+                     "ParseResult"],
+    "discid.index": ["TOCIndex", "Candidate", "FreeDBIndex", "FreeDBEntry"],
+    "discid.store": ["TOCWriter", "TOCReader", "TOCRecord"],
+    "discid.lookup": ["LookupClient", "RateLimiter", "WebServiceError"],
+    "discid.cache": ["LookupCache"],
+    "discid.cddb": ["CDDBClient", "CDDBMatch", "CDDBEntry", "CDDBError"],
+    "discid.rips": ["parse_cue", "parse_log", "parse_cdrdao_toc", "read_rip",
+                    "scan_rips", "RipResult"],
+}
+if sys.version_info >= (3, 7):
+    # async generators are a syntax error before 3.6,
+    # asyncio.get_running_loop is new in 3.7
+    _LAZY["discid.aio"] = ["aread", "aput", "aput_many", "AsyncLookupClient"]
+_LAZY_NAMES = dict((name, module) for module, names in _LAZY.items()
+                   for name in names)
 
-__version__ = "1.2.0"
+__version__ = "1.3.0"
 
 
 # these contants are defined here so sphinx can catch the "docstrings"
+# LIBDISCID_VERSION_STRING and FEATURES are documented in doc/api.rst,
+# since they are only available once libdiscid is loaded
 
-LIBDISCID_VERSION_STRING = discid.libdiscid.LIBDISCID_VERSION_STRING
-"""The version string of the loaded libdiscid in the form `libdiscid x.y.z`.
-For old versions the string is `libdiscid < 0.4.0`.
-"""
+def __getattr__(name):
+    """Provide the constants, which loads libdiscid on first access,
+    and the names and modules that are imported on first use
+    """
+    if name in ("LIBDISCID_VERSION_STRING", "FEATURES"):
+        return getattr(discid.libdiscid, name)
+    if name in _LAZY_NAMES:
+        module = importlib.import_module(_LAZY_NAMES[name])
+        value = getattr(module, name)
+        globals()[name] = value
+        return value
+    if "discid." + name in _LAZY:
+        # importing the module sets it as attribute of the package
+        return importlib.import_module("discid." + name)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
 
-FEATURES = discid.libdiscid.FEATURES
-"""The features libdiscid supports for the platform as a list of strings.
-Some Functions can raise :exc:`NotImplementedError` when a feature
-is not available.
-Some features might not be implemented in this python module,
-see :data:`FEATURES_IMPLEMENTED`.
-"""
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_NAMES)
+                  | set(module.split(".")[1] for module in _LAZY))
+
+if sys.version_info < (3, 7):
+    # no module level __getattr__ (PEP 562), libdiscid is loaded already
+    LIBDISCID_VERSION_STRING = discid.libdiscid.LIBDISCID_VERSION_STRING
+    FEATURES = discid.libdiscid.FEATURES
+    for _name in _LAZY_NAMES:
+        globals()[_name] = __getattr__(_name)
 
 FEATURES_IMPLEMENTED = discid.disc.FEATURES_IMPLEMENTED
 """The features implemented in this python module as a list of strings.
 Some might not be available for your platform, see :data:`FEATURES`.
 """
+
+ENGINES = discid.engine.ENGINES
+"""The engines available to calculate IDs with :func:`put`
+as a list of strings.
+`"libdiscid"` uses libdiscid, `"python"` calculates the IDs in Python.
+"""
@@ -0,0 +1,29 @@
+# Copyright (C) 2013  Johannes Dewender
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Please submit bug reports to GitHub:
+# https://github.com/JonnyJD/python-discid/issues
+"""Entry point for `python -m discid`
+"""
+
+import sys
+
+from discid.cli import main
+
+if __name__ == "__main__":
+    sys.exit(main())
+
+
+# vim:set shiftwidth=4 smarttab expandtab:
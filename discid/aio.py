@@ -0,0 +1,247 @@
+# Copyright (C) 2013  Johannes Dewender
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Please submit bug reports to GitHub:
+# https://github.com/JonnyJD/python-discid/issues
+"""Coroutine versions of read and put for asyncio
+
+The blocking calls run on a dedicated executor.
+asyncio and concurrent.futures are only imported when these are used,
+since both are slow to import.
+"""
+
+import threading
+import weakref
+
+from discid.disc import read, put
+from discid.util import _encode
+
+_DEFAULT_MAX_WORKERS = 4
+
+_executor = None
+_executor_lock = threading.Lock()
+# event loop -> {device: asyncio.Lock}
+_device_locks = weakref.WeakKeyDictionary()
+
+
+def set_executor(executor):
+    """Set the :class:`concurrent.futures.Executor`
+    used by the coroutines in this module.
+
+    The default is a :class:`~concurrent.futures.ThreadPoolExecutor`
+    with 4 threads, created on first use.
+    """
+    global _executor
+    with _executor_lock:
+        _executor = executor
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            from concurrent.futures import ThreadPoolExecutor
+            _executor = ThreadPoolExecutor(
+                max_workers=_DEFAULT_MAX_WORKERS, thread_name_prefix="discid")
+        return _executor
+
+def _device_lock(loop, device):
+    """The lock serializing the access to a device within an event loop
+    """
+    import asyncio
+    locks = _device_locks.setdefault(loop, {})
+    key = _encode(device)
+    if key not in locks:
+        locks[key] = asyncio.Lock()
+    return locks[key]
+
+async def _run(function, *args, **kwargs):
+    """Run a function on the executor and wait for the result.
+
+    When the waiting task is cancelled, the call is cancelled
+    unless it is already running.
+    """
+    import asyncio
+    future = _get_executor().submit(function, *args, **kwargs)
+    return await asyncio.wrap_future(future)
+
+async def _run_locked(lock, function, *args, **kwargs):
+    """Like :func:`_run`, but hold the `lock` until the call is done,
+    even when the waiting task is cancelled while the call is running.
+    """
+    import asyncio
+    loop = asyncio.get_running_loop()
+    await lock.acquire()
+    try:
+        future = _get_executor().submit(function, *args, **kwargs)
+    except:
+        lock.release()
+        raise
+    future.add_done_callback(
+        lambda _: loop.call_soon_threadsafe(lock.release))
+    return await asyncio.wrap_future(future)
+
+
+async def aread(device=None, features=[], snapshot=False, deferred=False,
+                callback=None, timeout=None):
+    """Coroutine version of :func:`read`.
+
+    Reads on the same device are serialized,
+    reads on different devices run in parallel.
+    Cancelling a read that is already running on the device
+    keeps the device locked until libdiscid is done with it.
+    With `deferred` the device is unlocked once the TOC is read.
+    """
+    import asyncio
+    lock = _device_lock(asyncio.get_running_loop(), device)
+    return await _run_locked(lock, read, device, features, snapshot=snapshot,
+                             deferred=deferred, callback=callback,
+                             timeout=timeout)
+
+async def aput(first, last, disc_sectors, track_offsets, engine=None,
+               snapshot=False):
+    """Coroutine version of :func:`put`.
+    """
+    return await _run(put, first, last, disc_sectors, track_offsets,
+                      engine=engine, snapshot=snapshot)
+
+def _put_chunk(tocs, engine, snapshot):
+    return [put(first, last, disc_sectors, track_offsets, engine=engine,
+                snapshot=snapshot)
+            for first, last, disc_sectors, track_offsets in tocs]
+
+async def aput_many(tocs, chunksize=256, engine=None, snapshot=False):
+    """Asynchronous iterator calling :func:`put` for many TOCs.
+
+    `tocs` is an iterable or asynchronous iterable
+    of `(first, last, disc_sectors, track_offsets)` tuples.
+    The TOCs are processed on the executor in chunks of `chunksize`
+    and the resulting discs are yielded in order.
+    A :exc:`TOCError` for an invalid TOC ends the iteration.
+    """
+    if hasattr(tocs, "__aiter__"):
+        chunk = []
+        async for toc in tocs:
+            chunk.append(toc)
+            if len(chunk) >= chunksize:
+                for disc in await _run(_put_chunk, chunk, engine, snapshot):
+                    yield disc
+                chunk = []
+    else:
+        iterator = iter(tocs)
+        while True:
+            chunk = [toc for _, toc in zip(range(chunksize), iterator)]
+            if len(chunk) < chunksize:
+                break
+            for disc in await _run(_put_chunk, chunk, engine, snapshot):
+                yield disc
+    if chunk:
+        for disc in await _run(_put_chunk, chunk, engine, snapshot):
+            yield disc
+
+
+
+class AsyncLookupClient(object):
+    """Coroutine version of :class:`~discid.lookup.LookupClient`,
+    taking the same arguments.
+
+    The requests run on the executor,
+    waiting for a free slot of the rate limit is done in the event loop.
+    """
+
+    def __init__(self, *args, **kwargs):
+        from discid.lookup import LookupClient
+        self._client = LookupClient(*args, **kwargs)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def close(self):
+        """Closes the open connections.
+        """
+        await _run(self._client.close)
+
+    async def _lookup_path(self, path):
+        import asyncio
+        from discid.lookup import _Retry
+        client = self._client
+        attempt = 0
+        while True:
+            delay = client._limiter.reserve()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            response = await _run(client._fetch, path)
+            try:
+                return client._result(path, response, attempt)
+            except _Retry:
+                attempt += 1
+
+    async def lookup(self, disc, fuzzy=True, includes=None):
+        """Coroutine version of :meth:`~discid.lookup.LookupClient.lookup`.
+        """
+        return await self._lookup_path(self._client._path(disc, fuzzy,
+                                                          includes))
+
+    async def lookup_many(self, discs, fuzzy=True, includes=None,
+                          return_exceptions=False):
+        """Asynchronous iterator version of
+        :meth:`~discid.lookup.LookupClient.lookup_many`.
+
+        `discs` can also be an asynchronous iterable.
+        """
+        import asyncio
+        from collections import deque
+        window = self._client._connections
+        pending = deque()
+        if hasattr(discs, "__aiter__"):
+            iterator = discs.__aiter__()
+            async def next_disc():
+                try:
+                    return True, await iterator.__anext__()
+                except StopAsyncIteration:
+                    return False, None
+        else:
+            iterator = iter(discs)
+            async def next_disc():
+                for disc in iterator:
+                    return True, disc
+                return False, None
+        exhausted = False
+        try:
+            while True:
+                while not exhausted and len(pending) < window:
+                    more, disc = await next_disc()
+                    if not more:
+                        exhausted = True
+                        break
+                    pending.append(asyncio.ensure_future(
+                        self.lookup(disc, fuzzy, includes)))
+                if not pending:
+                    return
+                try:
+                    result = await pending.popleft()
+                except Exception as exc:
+                    if not return_exceptions:
+                        raise
+                    result = exc
+                yield result
+        finally:
+            for task in pending:
+                task.cancel()
+
+
+# vim:set shiftwidth=4 smarttab expandtab:
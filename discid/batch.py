@@ -0,0 +1,168 @@
+# Copyright (C) 2013  Johannes Dewender
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Please submit bug reports to GitHub:
+# https://github.com/JonnyJD/python-discid/issues
+"""Calculation of IDs for many TOCs at once
+"""
+
+import hashlib
+from collections import namedtuple
+
+from discid.disc import TOCError
+from discid.engine import _check_toc, _hash_input, _encode_digest
+from discid.engine import _CDDB_SUMS, _accuraterip_sums, _ctdb_hash_input
+
+
+BatchResult = namedtuple("BatchResult", ["ids", "freedb_ids", "toc_strings"])
+DiscIDs = namedtuple("DiscIDs", ["ids", "freedb_ids", "accuraterip_ids",
+                                 "ctdb_ids"])
+
+
+def _as_list(column):
+    """Convert a column (list, :mod:`array` or NumPy array) to a list.
+    """
+    try:
+        # array.array and numpy arrays convert in C
+        return column.tolist()
+    except AttributeError:
+        return list(column)
+
+def _rows(count, track_offsets, index):
+    """Split the offsets into one list per TOC.
+    """
+    if index is None:
+        # padded, one row per TOC
+        rows = _as_list(track_offsets)
+        if len(rows) != count:
+            raise ValueError("%d rows of offsets for %d TOCs"
+                             % (len(rows), count))
+        return rows, True
+    flat = _as_list(track_offsets)
+    starts = _as_list(index)
+    if len(starts) == count:
+        ends = starts[1:] + [len(flat)]
+    elif len(starts) == count + 1:
+        starts, ends = starts[:-1], starts[1:]
+    else:
+        raise ValueError("%d index entries for %d TOCs" % (len(starts), count))
+    return [flat[start:end] for start, end in zip(starts, ends)], False
+
+def _valid_tocs(first, last, disc_sectors, track_offsets, index, errors):
+    """The number of TOCs and an iterator over the valid ones,
+    as the number and the TOC with the offsets as a list.
+    """
+    if errors not in ("strict", "ignore"):
+        raise ValueError("unknown error handling: %s" % errors)
+    firsts = _as_list(first)
+    lasts = _as_list(last)
+    sectors = _as_list(disc_sectors)
+    count = len(firsts)
+    if len(lasts) != count or len(sectors) != count:
+        raise ValueError("columns differ in length")
+    rows, padded = _rows(count, track_offsets, index)
+
+    def valid():
+        for i in range(count):
+            first_track, last_track = firsts[i], lasts[i]
+            leadout = sectors[i]
+            track_count = last_track - first_track + 1
+            offsets = rows[i]
+            if padded:
+                offsets = list(offsets[:track_count])
+
+            if len(offsets) != track_count:
+                error = "Invalid number of track offsets"
+            else:
+                error = _check_toc(first_track, last_track, leadout, offsets)
+            if error is not None:
+                if errors == "strict":
+                    raise TOCError("TOC %d: %s" % (i, error))
+                continue
+            yield i, first_track, last_track, leadout, offsets
+    return count, valid()
+
+def _freedb_id(first_track, last_track, leadout, offsets):
+    checksum = sum([_CDDB_SUMS[offset // 75] for offset in offsets])
+    if first_track == 1:
+        seconds = leadout // 75 - offsets[0] // 75
+    else:
+        seconds = leadout // 75
+    return "%08x" % ((checksum % 0xff) << 24 | seconds << 8 | last_track)
+
+def put_many(first, last, disc_sectors, track_offsets, index=None,
+             errors="strict"):
+    """Calculates the IDs for many TOCs at once
+    and returns a :class:`BatchResult` of parallel lists.
+
+    `first`, `last` and `disc_sectors` are columns with one entry per TOC,
+    given as lists, :class:`array.array` or NumPy arrays.
+    The parameters have the same meaning as for :func:`put`.
+
+    Without an `index` `track_offsets` has one row per TOC.
+    Rows can be padded to a common length,
+    entries after the last track are ignored.
+    With an `index`, `track_offsets` is one flat column
+    with the offsets of all TOCs in sequence
+    and `index` contains the position of the first offset for every TOC,
+    optionally followed by the total number of offsets.
+
+    The IDs are always calculated with the `"python"` engine.
+    A :exc:`TOCError` is raised for the first invalid TOC.
+    With `errors` set to `"ignore"` invalid TOCs
+    get :obj:`None` as entries in the result instead.
+    """
+    count, tocs = _valid_tocs(first, last, disc_sectors, track_offsets,
+                              index, errors)
+    ids = [None] * count
+    freedb_ids = [None] * count
+    toc_strings = [None] * count
+    sha1 = hashlib.sha1
+    for i, first_track, last_track, leadout, offsets in tocs:
+        hash_input = _hash_input(first_track, last_track, leadout, offsets)
+        ids[i] = _encode_digest(sha1(hash_input.encode("ascii")).digest())
+        freedb_ids[i] = _freedb_id(first_track, last_track, leadout, offsets)
+        offsets[0:0] = [first_track, last_track, leadout]
+        toc_strings[i] = " ".join(map(str, offsets))
+    return BatchResult(ids, freedb_ids, toc_strings)
+
+def disc_ids_many(first, last, disc_sectors, track_offsets, index=None,
+                  errors="strict"):
+    """Calculates the MusicBrainz, FreeDB, AccurateRip and CTDB IDs
+    for many TOCs at once and returns a :class:`DiscIDs`
+    of parallel lists.
+
+    The parameters are the same as for :func:`put_many`.
+    Every TOC is converted and checked once for all IDs.
+    """
+    count, tocs = _valid_tocs(first, last, disc_sectors, track_offsets,
+                              index, errors)
+    ids = [None] * count
+    freedb_ids = [None] * count
+    accuraterip_ids = [None] * count
+    ctdb_ids = [None] * count
+    sha1 = hashlib.sha1
+    for i, first_track, last_track, leadout, offsets in tocs:
+        hash_input = _hash_input(first_track, last_track, leadout, offsets)
+        ids[i] = _encode_digest(sha1(hash_input.encode("ascii")).digest())
+        freedb_ids[i] = _freedb_id(first_track, last_track, leadout, offsets)
+        sum1, sum2 = _accuraterip_sums(leadout, offsets)
+        accuraterip_ids[i] = "%03d-%08x-%08x-%s" % (len(offsets), sum1, sum2,
+                                                    freedb_ids[i])
+        hash_input = _ctdb_hash_input(leadout, offsets)
+        ctdb_ids[i] = _encode_digest(sha1(hash_input.encode("ascii")).digest())
+    return DiscIDs(ids, freedb_ids, accuraterip_ids, ctdb_ids)
+
+# vim:set shiftwidth=4 smarttab expandtab:
@@ -0,0 +1,320 @@
+# Copyright (C) 2013  Johannes Dewender
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Please submit bug reports to GitHub:
+# https://github.com/JonnyJD/python-discid/issues
+"""A persistent cache for lookup results
+
+The results are stored as JSON in an SQLite database in WAL mode,
+so several processes can use the same cache file.
+sqlite3 and json are only imported when a cache is opened,
+since they are slow to import.
+"""
+
+import time
+import threading
+import functools
+
+# the last use of an entry is only updated after this many seconds
+_TOUCH_INTERVAL = 60.0
+# stores between the checks of the number of entries
+_EVICT_CHECK = 256
+# part of the entries evicted on top, so the check isn't needed every time
+_EVICT_SLACK = 0.1
+
+_SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, toc TEXT,"
+    " value TEXT, expires REAL, used REAL NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS results_toc ON results (toc)",
+    "CREATE INDEX IF NOT EXISTS results_used ON results (used)",
+]
+
+
+def _keys(disc):
+    """The key and the TOC string for a disc, disc ID or TOC string,
+    the TOC string is :obj:`None` for disc IDs
+    """
+    if hasattr(disc, "toc_string"):
+        return disc.id, disc.toc_string
+    # TOC strings are numbers separated by spaces or "+", disc IDs are not
+    if " " in disc or "+" in disc:
+        toc_string = " ".join(disc.replace("+", " ").split())
+        return toc_string, toc_string
+    return disc, None
+
+
+class LookupCache(object):
+    """A cache for the results of lookups, stored in the file `path`.
+
+    Results are stored as JSON by disc ID and TOC string,
+    so they have to be JSON serializable.
+    When the disc ID is not in the cache,
+    a result stored for the same TOC string is used.
+
+    The cache holds up to `max_entries` entries,
+    the ones that weren't used for the longest time are removed first.
+    Entries expire after `ttl` seconds,
+    results of :obj:`None` (nothing found) after `negative_ttl` seconds.
+    A `ttl` of :obj:`None` keeps entries until they are removed.
+
+    Several threads and processes can use the same file at once,
+    `timeout` is the number of seconds to wait for a lock on it.
+    """
+
+    def __init__(self, path, max_entries=100000, ttl=30 * 24 * 3600,
+                 negative_ttl=24 * 3600, timeout=30.0):
+        self._path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._timeout = timeout
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        self._counts = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+        self._stores_since_check = 0
+        connection = self._connection()
+        with connection:
+            for statement in _SCHEMA:
+                connection.execute(statement)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _connection(self):
+        """The connection of the current thread
+        """
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            # imported here, since sqlite3 is slow to import
+            import sqlite3
+            connection = sqlite3.connect(self._path, timeout=self._timeout,
+                                         check_same_thread=False)
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.execute("PRAGMA synchronous = NORMAL")
+            self._local.connection = connection
+            with self._lock:
+                self._connections.append(connection)
+        return connection
+
+    def close(self):
+        """Closes the database connections of all threads.
+        """
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for connection in connections:
+            connection.close()
+        self._local = threading.local()
+
+    def _count(self, name, number=1):
+        with self._lock:
+            self._counts[name] += number
+
+    def _get(self, disc):
+        """Whether the disc is cached and the result
+        """
+        import json
+        connection = self._connection()
+        now = time.time()
+        key, toc_string = _keys(disc)
+        queries = [("SELECT key, value, expires, used FROM results"
+                    " WHERE key = ?", (key, ))]
+        if toc_string is not None:
+            # stored for a disc or TOC string with the same TOC
+            queries.append(("SELECT key, value, expires, used FROM results"
+                            " WHERE toc = ? AND (expires IS NULL"
+                            " OR expires > ?) ORDER BY used DESC LIMIT 1",
+                            (toc_string, now)))
+        for query, parameters in queries:
+            row = connection.execute(query, parameters).fetchone()
+            if row is None:
+                continue
+            key, value, expires, used = row
+            if expires is not None and expires <= now:
+                with connection:
+                    connection.execute("DELETE FROM results"
+                                       " WHERE key = ? AND expires <= ?",
+                                       (key, now))
+                continue
+            if now - used > _TOUCH_INTERVAL:
+                with connection:
+                    connection.execute(
+                        "UPDATE results SET used = ? WHERE key = ?",
+                        (now, key))
+            self._count("hits")
+            return True, json.loads(value)
+        self._count("misses")
+        return False, None
+
+    def get(self, disc, default=None):
+        """The cached result for a :class:`Disc`, a :class:`DiscSnapshot`,
+        a disc ID or a TOC string, or `default` when there is none.
+        """
+        found, value = self._get(disc)
+        return value if found else default
+
+    def __getitem__(self, disc):
+        found, value = self._get(disc)
+        if not found:
+            raise KeyError(disc)
+        return value
+
+    def __contains__(self, disc):
+        return self._get(disc)[0]
+
+    def __setitem__(self, disc, value):
+        self.put(disc, value)
+
+    def __delitem__(self, disc):
+        connection = self._connection()
+        with connection:
+            deleted = connection.execute(
+                "DELETE FROM results WHERE key = ? OR toc = ?",
+                _keys(disc)).rowcount
+        if not deleted:
+            raise KeyError(disc)
+
+    def __len__(self):
+        return self._connection().execute(
+            "SELECT count(*) FROM results").fetchone()[0]
+
+    def put(self, disc, value):
+        """Stores the result for a disc, disc ID or TOC string.
+        Discs are stored by their disc ID along with their TOC string.
+        """
+        self.put_many([(disc, value)])
+
+    def put_many(self, items):
+        """Stores many `(disc, value)` pairs in one transaction.
+        """
+        import json
+        now = time.time()
+        rows = []
+        for disc, value in items:
+            ttl = self.ttl if value is not None else self.negative_ttl
+            key, toc_string = _keys(disc)
+            rows.append((key, toc_string, json.dumps(value),
+                         now + ttl if ttl is not None else None, now))
+        connection = self._connection()
+        with connection:
+            connection.executemany("INSERT OR REPLACE INTO results"
+                                   " VALUES (?, ?, ?, ?, ?)", rows)
+        self._count("stores", len(rows))
+        with self._lock:
+            self._stores_since_check += len(rows)
+            check = self._stores_since_check >= _EVICT_CHECK
+            if check:
+                self._stores_since_check = 0
+        if check:
+            self.evict()
+
+    def evict(self):
+        """Removes the least recently used entries
+        when there are more than `max_entries`.
+
+        This is done automatically while storing results.
+        """
+        connection = self._connection()
+        with connection:
+            count = connection.execute(
+                "SELECT count(*) FROM results").fetchone()[0]
+            if count <= self.max_entries:
+                return 0
+            excess = count - self.max_entries
+            excess += int(self.max_entries * _EVICT_SLACK)
+            evicted = connection.execute(
+                "DELETE FROM results WHERE key IN"
+                " (SELECT key FROM results ORDER BY used LIMIT ?)",
+                (excess, )).rowcount
+        self._count("evictions", evicted)
+        return evicted
+
+    def expire(self):
+        """Removes all expired entries and returns their number.
+        """
+        connection = self._connection()
+        with connection:
+            return connection.execute(
+                "DELETE FROM results WHERE expires <= ?",
+                (time.time(), )).rowcount
+
+    def clear(self):
+        """Removes all entries.
+        """
+        connection = self._connection()
+        with connection:
+            connection.execute("DELETE FROM results")
+
+    def stats(self, reset=False):
+        """The number of `hits`, `misses`, `stores` and `evictions`
+        of this cache object and the number of `entries` in the file,
+        as a dictionary.
+
+        With `reset` the counters are set to zero afterwards.
+        """
+        with self._lock:
+            result = dict(self._counts)
+            if reset:
+                for name in self._counts:
+                    self._counts[name] = 0
+        result["entries"] = len(self)
+        return result
+
+    def cached(self, function):
+        """Wraps a lookup function, like :meth:`LookupClient.lookup`,
+        so it is only called for discs that aren't in the cache.
+
+        The wrapper takes the disc and further arguments,
+        which are passed on but are not part of the cache key.
+        """
+        @functools.wraps(function)
+        def lookup(disc, *args, **kwargs):
+            found, value = self._get(disc)
+            if found:
+                return value
+            value = function(disc, *args, **kwargs)
+            self.put(disc, value)
+            return value
+        return lookup
+
+    def lookup_many(self, discs, function, chunksize=100):
+        """Yields the results for many discs in order,
+        calling `function`, like :meth:`LookupClient.lookup_many`,
+        with the discs that aren't in the cache.
+
+        The discs are processed in chunks of `chunksize`,
+        so `function` is called once per chunk with a list of discs
+        and has to return an iterable of results in the same order.
+        """
+        iterator = iter(discs)
+        while True:
+            chunk = [disc for _, disc in zip(range(chunksize), iterator)]
+            if not chunk:
+                return
+            results = [self._get(disc) for disc in chunk]
+            missing = [disc for disc, (found, _) in zip(chunk, results)
+                       if not found]
+            if missing:
+                fetched = list(function(missing))
+                self.put_many(zip(missing, fetched))
+                fetched = iter(fetched)
+            for found, value in results:
+                yield value if found else next(fetched)
+
+
+# vim:set shiftwidth=4 smarttab expandtab:
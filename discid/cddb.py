@@ -0,0 +1,619 @@
+# Copyright (C) 2013  Johannes Dewender
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Please submit bug reports to GitHub:
+# https://github.com/JonnyJD/python-discid/issues
+"""A client for CDDB servers like gnudb
+
+Both the CDDBP protocol on its own port and CDDB over HTTP are supported.
+With CDDBP many commands are sent at once on a persistent connection
+and the responses are parsed as they arrive.
+
+.. seealso:: `CDDB Server Protocol <http://ftp.freedb.org/pub/freedb/latest/CDDBPROTO>`_
+"""
+
+import time
+import threading
+from collections import namedtuple, deque
+
+DEFAULT_SERVER = "cddbp://gnudb.gnudb.org:8880"
+_DEFAULT_PORTS = {"cddbp": 8880, "http": 80}
+_PROTOCOL_LEVEL = 6
+_ENCODING = "utf-8"
+# how often the fake server checks whether it should stop
+_POLL_INTERVAL = 0.05
+
+CDDBMatch = namedtuple("CDDBMatch", ["category", "freedb_id", "title",
+                                     "exact"])
+CDDBEntry = namedtuple("CDDBEntry", ["category", "freedb_id", "title",
+                                     "tracks", "fields"])
+_Response = namedtuple("_Response", ["code", "text", "lines"])
+
+
+class CDDBError(IOError):
+    """The CDDB server answered with an error.
+
+    `code` is the CDDB response code or :obj:`None`
+    when the answer was no valid CDDB response.
+    """
+
+    def __init__(self, message, code=None):
+        IOError.__init__(self, message)
+        self.code = code
+
+
+class _ResponseParser(object):
+    """Splits the data received from a CDDB server into responses.
+
+    Data can be fed in pieces of any size,
+    complete responses are returned as soon as they are available.
+    """
+
+    def __init__(self):
+        self._buffer = b""
+        self._response = None
+
+    def feed(self, data):
+        """Adds received data and returns the completed responses
+        """
+        responses = []
+        lines = (self._buffer + data).split(b"\n")
+        self._buffer = lines.pop()
+        for line in lines:
+            line = line.rstrip(b"\r").decode(_ENCODING, "replace")
+            if self._response is None:
+                if not line:
+                    continue
+                try:
+                    code = int(line[:3])
+                except ValueError:
+                    raise CDDBError("invalid response: %r" % line)
+                # an x1x code means more lines follow up to a "."
+                if line[1:2] == "1":
+                    self._response = _Response(code, line[4:], [])
+                else:
+                    responses.append(_Response(code, line[4:], None))
+            elif line == ".":
+                responses.append(self._response)
+                self._response = None
+            else:
+                if line.startswith(".."):
+                    line = line[1:]
+                self._response.lines.append(line)
+        return responses
+
+    def pending(self):
+        """Whether a response is incomplete
+        """
+        return bool(self._buffer) or self._response is not None
+
+
+def _query_command(disc):
+    """The `cddb query` command for a disc, a query string
+    or a :class:`CDDBQuery`
+    """
+    if hasattr(disc, "cddb_query_string"):
+        query = disc.cddb_query_string
+    elif hasattr(disc, "offsets"):
+        query = "%s %d %s %d" % (disc.freedb_id, disc.track_count,
+                                 " ".join(str(offset)
+                                          for offset in disc.offsets),
+                                 disc.seconds)
+    else:
+        query = disc.strip()
+        if query.startswith("cddb query "):
+            query = query[len("cddb query "):]
+    return "cddb query " + query
+
+def _matches(response):
+    """The matches of a `cddb query` response
+    """
+    if response.code == 200:
+        category, freedb_id, title = (response.text.split(" ", 2) + [""])[:3]
+        return [CDDBMatch(category, freedb_id, title, True)]
+    if response.code in (210, 211):
+        matches = []
+        for line in response.lines:
+            category, freedb_id, title = (line.split(" ", 2) + [""])[:3]
+            matches.append(CDDBMatch(category, freedb_id, title,
+                                     response.code == 210))
+        return matches
+    if response.code == 202:
+        return []
+    raise CDDBError("query failed: %d %s" % (response.code, response.text),
+                    response.code)
+
+def _unescape(value):
+    return value.replace("\\\\", "\0").replace("\\n", "\n") \
+        .replace("\\t", "\t").replace("\0", "\\")
+
+def parse_xmcd(lines, category=None, freedb_id=None):
+    """Parses the lines of a CDDB database entry in the xmcd format
+    and returns a :class:`CDDBEntry`.
+
+    Values split over several lines are joined.
+    """
+    fields = {}
+    for line in lines:
+        if line.startswith("#") or "=" not in line:
+            continue
+        key, value = line.split("=", 1)
+        fields[key] = fields.get(key, "") + _unescape(value)
+    tracks = []
+    while "TTITLE%d" % len(tracks) in fields:
+        tracks.append(fields["TTITLE%d" % len(tracks)])
+    if freedb_id is None:
+        freedb_id = fields.get("DISCID", "").split(",")[0]
+    return CDDBEntry(category, freedb_id, fields.get("DTITLE"), tracks,
+                     fields)
+
+def _entry(response, category, freedb_id):
+    """The entry of a `cddb read` response
+    """
+    if response.code == 210:
+        return parse_xmcd(response.lines, category, freedb_id)
+    if response.code == 401:
+        return None
+    raise CDDBError("read failed: %d %s" % (response.code, response.text),
+                    response.code)
+
+
+class _CDDBPConnection(object):
+    """A CDDBP connection sending commands in batches
+    """
+
+    def __init__(self, host, port, timeout, hello):
+        # imported here, since socket is slow to import
+        import socket
+        self._socket = socket.create_connection((host, port), timeout)
+        self._parser = _ResponseParser()
+        self._pending = []
+        banner = self._receive(1)[0]
+        if banner.code not in (200, 201):
+            self.close()
+            raise CDDBError("server refused the connection: %d %s"
+                            % (banner.code, banner.text), banner.code)
+        hello_response = self.execute(
+            [hello, "proto %d" % _PROTOCOL_LEVEL])[0]
+        if hello_response.code not in (200, 402):
+            self.close()
+            raise CDDBError("handshake failed: %d %s"
+                            % (hello_response.code, hello_response.text),
+                            hello_response.code)
+
+    def _receive(self, count):
+        responses = self._pending
+        while len(responses) < count:
+            data = self._socket.recv(1 << 16)
+            if not data:
+                raise EOFError("the CDDB server closed the connection")
+            responses.extend(self._parser.feed(data))
+        self._pending = responses[count:]
+        return responses[:count]
+
+    def execute(self, commands):
+        """Sends all commands at once and returns their responses
+        """
+        data = "".join(command + "\r\n" for command in commands)
+        self._socket.sendall(data.encode(_ENCODING))
+        return self._receive(len(commands))
+
+    def close(self):
+        try:
+            self._socket.sendall(b"quit\r\n")
+        except OSError:
+            pass
+        self._socket.close()
+
+
+class CDDBClient(object):
+    """A client for a CDDB server, given by `url`.
+
+    `cddbp://host:port` uses the CDDBP protocol,
+    which sends up to `pipeline` commands at once
+    on one persistent connection.
+    `http://host/path` uses CDDB over HTTP,
+    with one command per request on a keep-alive connection.
+
+    `user` and `host` identify you to the server
+    in the handshake, together with `client_name` and `client_version`.
+    The client can be used from several threads,
+    which then share the connection.
+    """
+
+    def __init__(self, url=DEFAULT_SERVER, user="anonymous",
+                 host="localhost", client_name="python-discid",
+                 client_version=None, timeout=30.0, pipeline=100):
+        # imported here, since urllib.parse is slow to import
+        from urllib.parse import urlsplit
+        parts = urlsplit(url)
+        if parts.scheme not in _DEFAULT_PORTS or not parts.hostname:
+            raise ValueError("unsupported CDDB server URL: %s" % url)
+        if client_version is None:
+            import discid
+            client_version = discid.__version__
+        self._hello = "%s %s %s %s" % (user, host, client_name,
+                                       client_version)
+        self._timeout = timeout
+        self.pipeline = pipeline
+        self._lock = threading.Lock()
+        self._connection = None
+        self._pool = None
+        if parts.scheme == "cddbp":
+            self._address = (parts.hostname,
+                             parts.port or _DEFAULT_PORTS["cddbp"])
+        else:
+            from discid.lookup import _ConnectionPool
+            self._pool = _ConnectionPool(url, 1, timeout)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Ends the connection to the server.
+        """
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+        if self._pool is not None:
+            self._pool.close()
+
+    def _execute_cddbp(self, commands):
+        with self._lock:
+            for attempt in (0, 1):
+                if self._connection is None:
+                    self._connection = _CDDBPConnection(
+                        self._address[0], self._address[1], self._timeout,
+                        "cddb hello " + self._hello)
+                try:
+                    return self._connection.execute(commands)
+                except (OSError, EOFError):
+                    # servers close idle connections, try a new one once
+                    self._connection.close()
+                    self._connection = None
+                    if attempt:
+                        raise
+
+    def _execute_http(self, command):
+        from urllib.parse import quote_plus
+        path = "%s?cmd=%s&hello=%s&proto=%d" % (
+            self._pool.prefix, quote_plus(command), quote_plus(self._hello),
+            _PROTOCOL_LEVEL)
+        status, _, body = self._pool.request(path, {})
+        if status != 200:
+            raise CDDBError("HTTP %d for %s" % (status, path))
+        parser = _ResponseParser()
+        responses = parser.feed(body if body.endswith(b"\n")
+                                else body + b"\n")
+        if len(responses) != 1 or parser.pending():
+            raise CDDBError("invalid response for %s" % command)
+        return responses[0]
+
+    def _execute_many(self, commands):
+        """Yields the responses to the commands in order
+        """
+        if self._pool is not None:
+            for command in commands:
+                yield self._execute_http(command)
+            return
+        iterator = iter(commands)
+        while True:
+            chunk = [command for _, command
+                     in zip(range(self.pipeline), iterator)]
+            if not chunk:
+                return
+            for response in self._execute_cddbp(chunk):
+                yield response
+
+    def query(self, disc):
+        """Queries the server for a :class:`Disc`, a :class:`DiscSnapshot`,
+        a :class:`CDDBQuery` or a query string
+        as given by :attr:`Disc.cddb_query_string`.
+
+        Returns a list of :class:`CDDBMatch`, which is empty
+        when nothing was found.
+        A :exc:`CDDBError` is raised when the server answers with an error.
+        """
+        return next(self.query_many([disc]))
+
+    def query_many(self, discs):
+        """Yields the results of :meth:`query` for many discs in order.
+        """
+        for response in self._execute_many(_query_command(disc)
+                                           for disc in discs):
+            yield _matches(response)
+
+    def read(self, category, freedb_id=None):
+        """Reads the database entry of a disc as a :class:`CDDBEntry`,
+        which is :obj:`None` when there is no such entry.
+
+        A :class:`CDDBMatch` can be given as `category` alone.
+        """
+        return next(self.read_many([(category, freedb_id)
+                                    if freedb_id is not None
+                                    else category]))
+
+    def read_many(self, matches):
+        """Yields the results of :meth:`read` in order
+        for many `(category, freedb_id)` pairs or :class:`CDDBMatch`.
+        """
+        pending = deque()
+        def commands():
+            for match in matches:
+                category, freedb_id = match[:2]
+                pending.append((category, freedb_id))
+                yield "cddb read %s %s" % (category, freedb_id)
+        for response in self._execute_many(commands()):
+            category, freedb_id = pending.popleft()
+            yield _entry(response, category, freedb_id)
+
+
+def _xmcd_lines(freedb_id, title, tracks, offsets, seconds):
+    """The lines of a database entry for :class:`FakeCDDBServer`
+    """
+    lines = ["# xmcd", "#", "# Track frame offsets:"]
+    lines.extend("#\t%d" % offset for offset in offsets)
+    lines.extend(["#", "# Disc length: %d seconds" % seconds, "#",
+                  "DISCID=%s" % freedb_id, "DTITLE=%s" % title,
+                  "DYEAR=", "DGENRE="])
+    lines.extend("TTITLE%d=%s" % (number, track_title)
+                 for number, track_title in enumerate(tracks))
+    lines.append("EXTD=")
+    lines.extend("EXTT%d=" % number for number in range(len(tracks)))
+    lines.append("PLAYORDER=")
+    return lines
+
+
+class _FakeDatabase(object):
+    """The entries and the command handling of :class:`FakeCDDBServer`
+    """
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.entries = {}
+        # FreeDB ID -> categories
+        self.categories = {}
+        self.commands = 0
+        self.connections = 0
+        self.lock = threading.Lock()
+
+    def execute(self, line, state):
+        """The response lines for a command
+        """
+        with self.lock:
+            self.commands += 1
+        words = line.split()
+        command = " ".join(words[:2]).lower()
+        if command == "cddb hello":
+            if state.get("hello"):
+                return ["402 Already shook hands"]
+            if len(words) != 6:
+                return ["431 Handshake not successful, closing connection"]
+            state["hello"] = True
+            return ["200 Hello and welcome %s@%s running %s %s."
+                    % tuple(words[2:6])]
+        if words[:1] == ["proto"]:
+            return ["201 OK, CDDB protocol level now: %s" % words[1]]
+        if words[:1] == ["quit"]:
+            return ["230 Closing connection.  Goodbye."]
+        if command not in ("cddb query", "cddb read"):
+            return ["500 Unrecognized command."]
+        if not state.get("hello"):
+            return ["409 No handshake"]
+        if command == "cddb read":
+            if len(words) != 4:
+                return ["500 Command syntax error."]
+            entry = self.entries.get((words[2], words[3].lower()))
+            if entry is None:
+                return ["401 %s %s No such CD entry in database."
+                        % (words[2], words[3])]
+            return (["210 %s %s CD database entry follows (until terminating"
+                     " `.')" % (words[2], words[3])]
+                    + [".%s" % line if line.startswith(".") else line
+                       for line in entry[1]] + ["."])
+        try:
+            freedb_id = words[2].lower()
+            offsets = [int(word) for word in words[4:-1]]
+        except (IndexError, ValueError):
+            return ["500 Command syntax error."]
+        found = []
+        for category in sorted(self.categories.get(freedb_id, ())):
+            title, _, entry_offsets = self.entries[(category, freedb_id)]
+            found.append((category, title, entry_offsets == offsets))
+        if not found:
+            return ["202 No match for disc ID %s." % freedb_id]
+        if len(found) == 1 and found[0][2]:
+            return ["200 %s %s %s" % (found[0][0], freedb_id, found[0][1])]
+        code = 210 if all(exact for _, _, exact in found) else 211
+        return (["%d Found matches, list follows (until terminating `.')"
+                 % code]
+                + ["%s %s %s" % (category, freedb_id, title)
+                   for category, title, _ in found] + ["."])
+
+
+def _fake_handlers():
+    """The request handler classes of :class:`FakeCDDBServer`
+    """
+    # imported here, since these are slow to import
+    import socketserver
+    from http.server import BaseHTTPRequestHandler
+    from urllib.parse import urlsplit, parse_qs
+
+    class CDDBPHandler(socketserver.BaseRequestHandler):
+
+        def handle(self):
+            database = self.server.database
+            with database.lock:
+                database.connections += 1
+            state = {}
+            self.request.sendall(b"201 localhost CDDBP server v1.5 ready\r\n")
+            buffered = b""
+            while True:
+                data = self.request.recv(1 << 16)
+                if not data:
+                    return
+                # the commands received together are answered together,
+                # after the time the data would take over the network
+                if database.latency:
+                    time.sleep(database.latency)
+                lines = (buffered + data).split(b"\n")
+                buffered = lines.pop()
+                output = []
+                for line in lines:
+                    line = line.decode(_ENCODING, "replace").strip()
+                    if not line:
+                        continue
+                    response = database.execute(line, state)
+                    output.extend(response_line + "\r\n"
+                                  for response_line in response)
+                    if response[0][:3] in ("230", "431"):
+                        self.request.sendall("".join(output)
+                                             .encode(_ENCODING))
+                        return
+                self.request.sendall("".join(output).encode(_ENCODING))
+
+    class HTTPHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def setup(self):
+            BaseHTTPRequestHandler.setup(self)
+            with self.server.database.lock:
+                self.server.database.connections += 1
+
+        def do_GET(self):
+            if self.server.database.latency:
+                time.sleep(self.server.database.latency)
+            query = parse_qs(urlsplit(self.path).query)
+            state = {}
+            if "hello" in query:
+                self.server.database.execute(
+                    "cddb hello " + query["hello"][0], state)
+            response = self.server.database.execute(
+                query.get("cmd", [""])[0], state)
+            body = "".join(line + "\r\n" for line in response)
+            body = body.encode(_ENCODING)
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return CDDBPHandler, HTTPHandler
+
+
+class FakeCDDBServer(object):
+    """A local CDDB server for tests and benchmarks,
+    speaking CDDBP and CDDB over HTTP.
+
+    Entries are added with :meth:`add`.
+    Answers are delayed by `latency` seconds, like a network would,
+    so commands sent together with CDDBP are delayed once.
+    The server runs in background threads
+    while in a `with` block or between :meth:`start` and :meth:`stop`,
+    the URLs for :class:`CDDBClient` are then in `cddbp_url` and `http_url`.
+    `commands` and `connections` count what the server received.
+    """
+
+    def __init__(self, latency=0.0):
+        self._database = _FakeDatabase(latency)
+        self.cddbp_url = None
+        self.http_url = None
+        self._servers = []
+        self._threads = []
+
+    @property
+    def commands(self):
+        return self._database.commands
+
+    @property
+    def connections(self):
+        return self._database.connections
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def add(self, disc, category="misc", title=None, tracks=None):
+        """Adds an entry for a :class:`Disc` or :class:`DiscSnapshot`
+        in `category`, with the disc `title` as `"Artist / Title"`
+        and a list of track titles.
+        """
+        offsets = [track.offset for track in disc.tracks]
+        if title is None:
+            title = "Artist / Disc %s" % disc.freedb_id
+        if tracks is None:
+            tracks = ["Track %d" % track.number for track in disc.tracks]
+        lines = _xmcd_lines(disc.freedb_id, title, tracks, offsets,
+                            disc.seconds)
+        self._database.entries[(category, disc.freedb_id)] = (title, lines,
+                                                              offsets)
+        self._database.categories.setdefault(disc.freedb_id,
+                                             set()).add(category)
+
+    def start(self):
+        """Starts serving on free ports of the loopback interface.
+        """
+        import socketserver
+        from http.server import HTTPServer
+        cddbp_handler, http_handler = _fake_handlers()
+
+        class CDDBPServer(socketserver.ThreadingMixIn,
+                          socketserver.TCPServer):
+            daemon_threads = True
+            allow_reuse_address = True
+
+        class HTTPCDDBServer(socketserver.ThreadingMixIn, HTTPServer):
+            daemon_threads = True
+
+        cddbp_server = CDDBPServer(("127.0.0.1", 0), cddbp_handler)
+        http_server = HTTPCDDBServer(("127.0.0.1", 0), http_handler)
+        for server in (cddbp_server, http_server):
+            server.database = self._database
+            thread = threading.Thread(target=server.serve_forever,
+                                      args=(_POLL_INTERVAL, ),
+                                      name="discid-fake-cddb")
+            thread.daemon = True
+            thread.start()
+            self._servers.append(server)
+            self._threads.append(thread)
+        self.cddbp_url = "cddbp://127.0.0.1:%d" % \
+            cddbp_server.server_address[1]
+        self.http_url = "http://127.0.0.1:%d/~cddb/cddb.cgi" % \
+            http_server.server_address[1]
+
+    def stop(self):
+        """Stops the server.
+        """
+        for server in self._servers:
+            server.shutdown()
+            server.server_close()
+        for thread in self._threads:
+            thread.join()
+        self._servers = []
+        self._threads = []
+
+
+# vim:set shiftwidth=4 smarttab expandtab:
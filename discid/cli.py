@@ -0,0 +1,305 @@
+# Copyright (C) 2013  Johannes Dewender
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Please submit bug reports to GitHub:
+# https://github.com/JonnyJD/python-discid/issues
+"""Command line interface, used by `python -m discid`
+"""
+
+import sys
+import json
+import time
+import argparse
+
+import discid
+from discid.disc import TOCError, DiscError
+from discid.parse import from_toc_string
+from discid.util import _imap_bounded
+
+
+def _disc_record(disc):
+    return {"id": disc.id, "freedb_id": disc.freedb_id,
+            "toc_string": disc.toc_string}
+
+def _format_record(record, output_format, key=None):
+    """Format a result record as one line of output
+    """
+    if output_format == "jsonl":
+        return json.dumps(record, sort_keys=True)
+    columns = [] if key is None else [key]
+    if "error" in record:
+        columns += ["error", record["error"]]
+    else:
+        columns += [record["id"], record["freedb_id"], record["toc_string"]]
+    return "\t".join(columns)
+
+def _process_line(line, input_format, output_format):
+    """Calculate the IDs for one input line.
+
+    Returns the output line and whether it is an error
+    or :obj:`None` for empty lines.
+    """
+    line = line.strip()
+    if not line:
+        return None
+    key = None
+    record = {}
+    try:
+        if input_format == "jsonl":
+            record = json.loads(line)
+            if "toc" in record:
+                disc = from_toc_string(record["toc"], engine="python")
+            else:
+                disc = discid.put(record["first"], record["last"],
+                                  record["sectors"], record["offsets"],
+                                  engine="python")
+        else:
+            if "\t" in line:
+                key, line = line.rsplit("\t", 1)
+                record["key"] = key
+            disc = from_toc_string(line, engine="python")
+    except (TOCError, ValueError, KeyError, TypeError) as exc:
+        if not isinstance(record, dict):
+            record = {}
+        record["error"] = "%s: %s" % (type(exc).__name__, exc)
+        return _format_record(record, output_format, key), True
+    record.update(_disc_record(disc))
+    return _format_record(record, output_format, key), False
+
+def _process_chunk(args):
+    """Process a chunk of lines, this runs in the worker processes
+    """
+    lines, input_format, output_format = args
+    results = []
+    errors = 0
+    for line in lines:
+        result = _process_line(line, input_format, output_format)
+        if result is not None:
+            results.append(result[0])
+            errors += result[1]
+    return results, errors
+
+def _chunks(lines, chunksize, input_format, output_format):
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) >= chunksize:
+            yield chunk, input_format, output_format
+            chunk = []
+    if chunk:
+        yield chunk, input_format, output_format
+
+
+class _Progress(object):
+    """Report the throughput to stderr from time to time
+    """
+
+    def __init__(self, stream, interval=1.0):
+        self._stream = stream
+        self._interval = interval
+        self._start = time.time()
+        self._last = self._start
+        self.count = 0
+        self.errors = 0
+
+    def update(self, count, errors, force=False):
+        self.count += count
+        self.errors += errors
+        now = time.time()
+        if self._stream is not None and (force
+                                         or now - self._last >= self._interval):
+            self._last = now
+            elapsed = max(now - self._start, 1e-9)
+            self._stream.write("%d TOCs, %d errors, %.0f TOCs/s\n"
+                               % (self.count, self.errors,
+                                  self.count / elapsed))
+            self._stream.flush()
+
+
+def _batch(args, stdin, stdout, stderr):
+    """Stream TOC records from stdin to stdout
+    """
+    chunks = _chunks(stdin, args.chunksize, args.input_format,
+                     args.output_format)
+    progress = _Progress(stderr if args.progress else None)
+    if args.workers == 1:
+        pool = None
+        results = map(_process_chunk, chunks)
+    else:
+        import multiprocessing
+        pool = multiprocessing.Pool(args.workers)
+        results = _imap_bounded(pool, _process_chunk, chunks,
+                                2 * args.workers, not args.unordered)
+    try:
+        for lines, errors in results:
+            for line in lines:
+                stdout.write(line + "\n")
+            progress.update(len(lines), errors)
+    finally:
+        if pool is not None:
+            pool.terminate()
+    progress.update(0, 0, force=True)
+    return 0
+
+def _scan(args, stdout, stderr):
+    """Calculate the IDs for the rips below a directory
+    """
+    from discid.engine import toc_string
+    from discid.rips import scan_rips
+    progress = _Progress(stderr if args.progress else None)
+    results = scan_rips(args.directory, args.workers, args.checkpoint,
+                        chunksize=args.chunksize)
+    try:
+        for result in results:
+            if result.error is None:
+                record = {"id": result.id, "freedb_id": result.freedb_id,
+                          "toc_string": toc_string(*result.toc)}
+            else:
+                record = {"error": result.error}
+            record["path"] = result.path
+            stdout.write(_format_record(record, args.output_format,
+                                        result.path) + "\n")
+            progress.update(1, result.error is not None)
+    finally:
+        results.close()
+    progress.update(0, 0, force=True)
+    return 0
+
+def _put(args, stdout):
+    """Calculate the IDs for the TOCs given as arguments
+    """
+    status = 0
+    for toc_string in args.tocs:
+        try:
+            disc = from_toc_string(toc_string, engine=args.engine)
+        except TOCError as exc:
+            record = {"toc_string": toc_string, "error": str(exc)}
+            status = 1
+        else:
+            record = _disc_record(disc)
+        stdout.write(_format_record(record, args.output_format) + "\n")
+    return status
+
+def _read(args, stdout):
+    """Read the devices given or all devices found
+    """
+    if args.devices:
+        devices = args.devices
+    elif args.all:
+        devices = None
+    else:
+        devices = [discid.get_default_device()]
+    status = 0
+    for device, result in discid.read_all(devices, args.features):
+        if isinstance(result, DiscError):
+            record = {"error": str(result)}
+            status = 1
+        else:
+            record = _disc_record(result)
+            record["submission_url"] = result.submission_url
+            if "mcn" in args.features:
+                record["mcn"] = result.mcn
+            if "isrc" in args.features:
+                record["isrcs"] = [track.isrc for track in result.tracks]
+        record["device"] = device
+        stdout.write(_format_record(record, args.output_format, device)
+                     + "\n")
+        stdout.flush()
+    return status
+
+def _positive_int(value):
+    """An argparse type for counts that must be at least 1
+    """
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError("not a number: %s" % value)
+    if number < 1:
+        raise argparse.ArgumentTypeError("must be at least 1: %s" % value)
+    return number
+
+def _parser():
+    parser = argparse.ArgumentParser(
+        prog="python -m discid",
+        description="Calculate MusicBrainz and FreeDB disc IDs")
+    parser.add_argument("--output-format", choices=["jsonl", "tsv"],
+                        default="jsonl", help="format of the output lines")
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+
+    read = commands.add_parser("read", help="read discs in drives")
+    read.add_argument("devices", nargs="*", help="devices to read")
+    read.add_argument("--all", action="store_true",
+                      help="read all drives found")
+    read.add_argument("--features", type=lambda value: value.split(","),
+                      default=[], help="comma separated list of features")
+
+    put = commands.add_parser("put", help="calculate IDs for TOC strings")
+    put.add_argument("tocs", nargs="+", metavar="TOC",
+                     help='TOC string like "1 2 1000 150 500"')
+    put.add_argument("--engine", choices=discid.ENGINES, default="python")
+
+    batch = commands.add_parser(
+        "batch", help="calculate IDs for TOC records from stdin")
+    batch.add_argument("--input-format", choices=["jsonl", "tsv"],
+                       default="tsv",
+                       help="JSON objects with first, last, sectors "
+                       "and offsets or a toc string, "
+                       "or TOC strings optionally preceded by a key and a tab")
+    batch.add_argument("--workers", type=_positive_int, default=None,
+                       help="number of processes (default: CPU count)")
+    batch.add_argument("--chunksize", type=_positive_int, default=1000,
+                       help="number of lines per task")
+    batch.add_argument("--unordered", action="store_true",
+                       help="output results as soon as they are done")
+    batch.add_argument("--progress", action="store_true",
+                       help="report the throughput on stderr")
+
+    scan = commands.add_parser(
+        "scan", help="calculate IDs for the CUE sheets, EAC and XLD logs "
+        "and cdrdao TOC files below a directory")
+    scan.add_argument("directory", help="directory with rips")
+    scan.add_argument("--workers", type=_positive_int, default=None,
+                      help="number of processes (default: CPU count)")
+    scan.add_argument("--chunksize", type=_positive_int, default=100,
+                      help="number of files per task")
+    scan.add_argument("--checkpoint",
+                      help="file to save the progress in "
+                      "and continue from when it exists")
+    scan.add_argument("--progress", action="store_true",
+                      help="report the throughput on stderr")
+    return parser
+
+def main(argv=None, stdin=None, stdout=None, stderr=None):
+    """Run the command line interface and return the exit status
+    """
+    stdin = sys.stdin if stdin is None else stdin
+    stdout = sys.stdout if stdout is None else stdout
+    stderr = sys.stderr if stderr is None else stderr
+    args = _parser().parse_args(argv)
+    if args.command == "batch":
+        if args.workers is None:
+            import multiprocessing
+            args.workers = multiprocessing.cpu_count()
+        return _batch(args, stdin, stdout, stderr)
+    elif args.command == "scan":
+        return _scan(args, stdout, stderr)
+    elif args.command == "put":
+        return _put(args, stdout)
+    else:
+        return _read(args, stdout)
+
+
+# vim:set shiftwidth=4 smarttab expandtab:
@@ -0,0 +1,96 @@
+# Copyright (C) 2013  Johannes Dewender
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Please submit bug reports to GitHub:
+# https://github.com/JonnyJD/python-discid/issues
+"""Removing duplicate TOCs from large numbers of discs
+"""
+
+import os
+import struct
+
+
+def _packed_key(disc):
+    """The TOC of a disc packed into bytes, which is smaller than the tuple
+    """
+    first, last, disc_sectors, track_offsets = disc._toc_key()
+    return struct.pack("<BBI%dI" % len(track_offsets),
+                       first, last, disc_sectors, *track_offsets)
+
+
+class _SpilledKeys(object):
+    """A set of keys in an SQLite database
+    """
+
+    def __init__(self, directory):
+        # imported here, since these are slow to import
+        import sqlite3
+        import tempfile
+        self._directory = tempfile.mkdtemp(prefix="discid-dedupe-",
+                                           dir=directory)
+        self._connection = sqlite3.connect(
+            os.path.join(self._directory, "keys.sqlite"))
+        self._connection.execute("PRAGMA journal_mode = OFF")
+        self._connection.execute("PRAGMA synchronous = OFF")
+        self._connection.execute(
+            "CREATE TABLE keys (key BLOB PRIMARY KEY) WITHOUT ROWID")
+
+    def __contains__(self, key):
+        cursor = self._connection.execute(
+            "SELECT 1 FROM keys WHERE key = ?", (key, ))
+        return cursor.fetchone() is not None
+
+    def update(self, keys):
+        with self._connection:
+            self._connection.executemany(
+                "INSERT OR IGNORE INTO keys VALUES (?)",
+                ((key, ) for key in keys))
+
+    def close(self):
+        import shutil
+        self._connection.close()
+        shutil.rmtree(self._directory, ignore_errors=True)
+
+
+def dedupe(discs, max_keys=1000000, directory=None):
+    """Yields every :class:`Disc` or :class:`DiscSnapshot` in `discs`
+    that doesn't have the same TOC as one yielded before.
+
+    The TOCs seen are kept in memory, packed into a few bytes each.
+    When there are more than `max_keys` of them,
+    they are moved to a temporary SQLite database in `directory`,
+    which defaults to the system's temporary directory.
+    The database is removed when the generator is done or closed.
+    """
+    recent = set()
+    spilled = None
+    try:
+        for disc in discs:
+            key = _packed_key(disc)
+            if key in recent or (spilled is not None and key in spilled):
+                continue
+            recent.add(key)
+            if len(recent) >= max_keys:
+                if spilled is None:
+                    spilled = _SpilledKeys(directory)
+                spilled.update(recent)
+                recent = set()
+            yield disc
+    finally:
+        if spilled is not None:
+            spilled.close()
+
+
+# vim:set shiftwidth=4 smarttab expandtab:
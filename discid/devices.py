@@ -0,0 +1,85 @@
+# Copyright (C) 2013  Johannes Dewender
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Please submit bug reports to GitHub:
+# https://github.com/JonnyJD/python-discid/issues
+"""Enumeration of drives and reading from several drives at once
+"""
+
+import os
+
+from discid.disc import read, DiscError
+from discid.libdiscid import get_default_device
+
+
+def get_devices(proc_root="/proc"):
+    """The CD drives available on this system as a list of device paths.
+
+    The drives are listed from :file:`/proc/sys/dev/cdrom/info`,
+    so this only finds drives on Linux.
+    An empty list is returned when no drives are found.
+    The `proc_root` can be set to read from another location than
+    :file:`/proc`.
+    """
+    info_path = os.path.join(proc_root, "sys", "dev", "cdrom", "info")
+    try:
+        with open(info_path) as info_file:
+            lines = info_file.readlines()
+    except (IOError, OSError):
+        return []
+    for line in lines:
+        if line.startswith("drive name:"):
+            names = line.split(":", 1)[1].split()
+            # the kernel lists the most recently registered drive first
+            return ["/dev/%s" % name for name in reversed(names)]
+    return []
+
+def read_all(devices=None, features=[], max_workers=None, proc_root="/proc"):
+    """Reads the TOC from several devices in parallel.
+
+    This is a generator yielding a tuple of the device
+    and either a :class:`Disc` or the :exc:`DiscError` for that device
+    as soon as reading a device is done.
+
+    Without `devices` all devices found by :func:`get_devices` are read,
+    or the default device when none are found.
+    The `features` are the same as for :func:`read`.
+    `max_workers` limits the number of devices read at the same time,
+    the default is to read all of them at once.
+    """
+    if devices is None:
+        devices = get_devices(proc_root) or [get_default_device()]
+    devices = list(devices)
+    if not devices:
+        return
+    if max_workers is None:
+        max_workers = len(devices)
+
+    # imported here, since concurrent.futures is slow to import
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+
+    # libdiscid is called through ctypes, which releases the GIL
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = dict((executor.submit(read, device, features), device)
+                       for device in devices)
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except DiscError as exc:
+                result = exc
+            yield futures[future], result
+
+
+# vim:set shiftwidth=4 smarttab expandtab:
@@ -18,12 +18,18 @@
 """Disc class
 """
 
-import re
-from ctypes import c_int, c_void_p, c_char_p, c_uint
+import time
+import struct
+import threading
+from ctypes import c_int, c_void_p, c_char_p, c_uint, sizeof
 
-from discid.libdiscid import _LIB, FEATURES
+from discid.libdiscid import _LIB
 from discid.util import _encode, _decode, _sectors_to_seconds
 from discid.track import Track
+from discid.snapshot import DiscSnapshot
+import discid.engine
+import discid.libdiscid
+from discid.engine import _check_engine, _check_toc, _MAX_TRACKS
 
 
 # our implementation of libdiscid's enum discid_feature
@@ -32,7 +38,67 @@ _FEATURE_MAPPING = {"read": 1 << 0, "mcn": 1 << 1, "isrc": 1 << 2}
 
 FEATURES_IMPLEMENTED = list(_FEATURE_MAPPING.keys())
 
-def read(device=None, features=[]):
+_timer = getattr(time, "monotonic", time.time)
+
+# the wire format of Disc.to_bytes()
+_WIRE_VERSION = 1
+_WIRE_HEADER = struct.Struct("<BBBBI")
+_WIRE_MCN = 1 << 0
+_WIRE_ISRC = 1 << 1
+
+# buffer formats that can be copied into a c_int array as they are
+_C_INT_FORMATS = ("i", "@i", "=i", "l", "@l", "=l")
+# memoryview.cast and c_contiguous are new in Python 3.3,
+# before that all offsets are converted
+_CAN_COPY_BUFFERS = hasattr(memoryview, "cast")
+
+# addresses of the handles still used by a read that timed out,
+# freed when the read returns (c_void_p itself is not hashable)
+_quarantine = set()
+_quarantine_lock = threading.Lock()
+
+def _max_offset(track_offsets):
+    """The highest track offset, without converting a NumPy array
+    """
+    if hasattr(track_offsets, "dtype"):
+        return track_offsets.max()
+    return max(track_offsets)
+
+def _offsets_tuple(track_offsets):
+    """The track offsets as a tuple of :obj:`int`
+    """
+    # array.array, memoryview and NumPy arrays convert in C
+    if hasattr(track_offsets, "tolist"):
+        return tuple(track_offsets.tolist())
+    return tuple(track_offsets)
+
+def _c_offsets(first, disc_sectors, track_offsets):
+    """The array of offsets for `discid_put`,
+    with the disc sectors as the first entry
+    and the offsets indexed by track number, starting with `first`
+    """
+    c_offsets = (c_int * (len(track_offsets) + first))()
+    c_offsets[0] = disc_sectors
+    view = None
+    if _CAN_COPY_BUFFERS:
+        try:
+            view = memoryview(track_offsets)
+        except TypeError:
+            pass
+    if (view is not None and view.ndim == 1 and view.c_contiguous
+            and view.itemsize == sizeof(c_int)
+            and view.format in _C_INT_FORMATS):
+        # a plain copy of the memory, no Python integers are created
+        memoryview(c_offsets).cast("B")[first * sizeof(c_int):] = \
+            view.cast("B")
+    elif hasattr(track_offsets, "tolist"):
+        c_offsets[first:] = track_offsets.tolist()
+    else:
+        c_offsets[first:] = list(track_offsets)
+    return c_offsets
+
+def read(device=None, features=[], snapshot=False, deferred=False,
+         callback=None, timeout=None):
     """Reads the TOC from the device given as string
     and returns a :class:`Disc` object.
 
@@ -50,12 +116,35 @@ def read(device=None, features=[]):
     A :exc:`DiscError` exception is raised when the reading fails,
     and :exc:`NotImplementedError` when libdiscid doesn't support
     reading discs on the current platform.
+
+    With `snapshot` set a :class:`DiscSnapshot` is returned instead,
+    see :meth:`Disc.snapshot`.
+
+    Reading the MCN and ISRCs can take a long time.
+    With `deferred` set, only the TOC is read before returning
+    and the additional `features` are read in a background thread.
+    Accessing :attr:`Disc.mcn` or :attr:`Track.isrc` waits for that,
+    see also :attr:`Disc.features_future`.
+    The optional `callback` is called with the track number and the ISRC
+    for every track once the ISRCs are read.
+    `deferred` can't be combined with `snapshot`.
+
+    With a `timeout` in seconds, :exc:`DiscTimeoutError` is raised
+    when libdiscid doesn't finish reading in time.
+    For a deferred read the timeout applies to both phases.
+    See :attr:`Disc.timings` for how long reading took.
     """
-    disc = Disc()
-    disc.read(device, features)
+    if snapshot and deferred:
+        raise ValueError("snapshot can't be combined with deferred")
+    disc = Disc(engine="libdiscid")
+    disc.read(device, features, deferred=deferred, callback=callback,
+              timeout=timeout)
+    if snapshot:
+        return disc.snapshot()
     return disc
 
-def put(first, last, disc_sectors, track_offsets):
+def put(first, last, disc_sectors, track_offsets, engine=None,
+        snapshot=False):
     """Creates a TOC based on the information given
     and returns a :class:`Disc` object.
 
@@ -63,6 +152,9 @@ def put(first, last, disc_sectors, track_offsets):
     `disc_sectors` is the end of the last audio track,
     normally the total sector count of the disc.
     `track_offsets` is a list of all audio track offsets.
+    It can also be an :class:`array.array`, a :class:`memoryview`
+    or a NumPy array, 32 bit integers are passed to libdiscid
+    without a conversion.
 
     Depending on how you get the total sector count,
     you might have to substract 11400 (2:32 min.) for discs with data tracks.
@@ -70,10 +162,20 @@ def put(first, last, disc_sectors, track_offsets):
     A :exc:`TOCError` exception is raised when illegal parameters
     are provided.
 
+    The `engine` is one of :data:`ENGINES`.
+    With `"python"` the IDs are computed in Python without using libdiscid,
+    which is considerably faster when you only need the IDs.
+    The default is set with :func:`set_engine`.
+
+    With `snapshot` set a :class:`DiscSnapshot` is returned instead,
+    see :meth:`Disc.snapshot`.
+
     .. seealso:: :musicbrainz:`Disc ID Calculation`
     """
-    disc = Disc()
+    disc = Disc(engine)
     disc.put(first, last, disc_sectors, track_offsets)
+    if snapshot:
+        return disc.snapshot()
     return disc
 
 
@@ -82,6 +184,21 @@ class DiscError(IOError):
     """
     pass
 
+class DiscTimeoutError(DiscError):
+    """:func:`read` will raise this exception when reading takes longer
+    than the `timeout`.
+
+    The `device` and the `timeout` are available as attributes.
+    """
+    def __init__(self, device, timeout):
+        DiscError.__init__(self, "reading %s timed out after %s seconds"
+                           % (device, timeout))
+        self.device = device
+        self.timeout = timeout
+
+    def __reduce__(self):
+        return (DiscTimeoutError, (self.device, self.timeout))
+
 class TOCError(Exception):
     """:func:`put` will raise this exception when illegal paramaters
     are provided.
@@ -95,14 +212,52 @@ class Disc(object):
 
     _LIB.discid_new.argtypes = ()
     _LIB.discid_new.restype = c_void_p
-    def __init__(self):
+    def __init__(self, engine=None):
         """The initialization will reserve some memory
         for internal data structures.
+
+        No memory is reserved in libdiscid for the `"python"` engine.
         """
-        self._handle = c_void_p(_LIB.discid_new())
+        self._handle = None
+        self._engine = _check_engine(engine)
         self._success = False
         self._requested_features = []
-        assert self._handle.value is not None
+        # the TOC given to put, only used by the "python" engine
+        self._toc = None
+        # features read in the background, see read(deferred=True),
+        # or restored with from_bytes() when there is no handle
+        self._features_future = None
+        self._deferred_mcn = None
+        self._deferred_isrcs = {}
+        self._timings = {}
+        # the TOC as a tuple and its hash, set by read and put
+        self._key = None
+        self._hash = None
+        # first, last and the c_int array given to discid_put,
+        # turned into the key when it is needed
+        self._key_source = None
+        # the IDs of the current TOC, calculated once per read or put
+        self._ids = {}
+        if self._engine != "python":
+            self._handle = c_void_p(_LIB.discid_new())
+            assert self._handle.value is not None
+
+    @classmethod
+    def _from_handle(cls, handle):
+        """Create a :class:`Disc` using a handle owned by somebody else,
+        like a :class:`HandlePool`.
+        """
+        disc = cls(engine="python")
+        disc._engine = "libdiscid"
+        disc._handle = handle
+        return disc
+
+    def _detach(self):
+        """Stop using the handle without freeing it.
+        """
+        self._handle = None
+        self._success = False
+        self._ids = {}
 
     def __str__(self):
         assert self._success
@@ -124,16 +279,20 @@ class Disc(object):
         _LIB.discid_read_sparse.restype = c_int
     except AttributeError:
         pass
-    def read(self, device=None, features=[]):
+    def read(self, device=None, features=[], deferred=False, callback=None,
+             timeout=None):
         """Reads the TOC from the device given as string
 
         The user is supposed to use :func:`discid.read`.
         """
-        if "read" not in FEATURES:
+        if self._handle is None:
+            raise NotImplementedError("reading needs the libdiscid engine")
+        platform_features = discid.libdiscid.FEATURES
+        if "read" not in platform_features:
             raise NotImplementedError("discid_read not implemented on platform")
 
         # only use features implemented on this platform and in this module
-        self._requested_features = list(set(features) & set(FEATURES)
+        self._requested_features = list(set(features) & set(platform_features)
                                         & set(FEATURES_IMPLEMENTED))
 
         # create the bitmask for libdiscid
@@ -141,16 +300,125 @@ class Disc(object):
         for feature in features:
             c_features += _FEATURE_MAPPING.get(feature, 0)
 
-        # device = None will use the default device (internally)
+        self._features_future = None
+        self._timings = {}
+        self._ids = {}
+        if (deferred and set(self._requested_features) - set(["read"])
+                and _LIB._has("discid_read_sparse")):
+            # read the TOC now and the rest in the background
+            self._read(device, _FEATURE_MAPPING["read"], timeout, "toc")
+            self._start_deferred(device, c_features, callback, timeout)
+        else:
+            self._read(device, c_features, timeout, "read")
+        return self._success
+
+    def _read(self, device, c_features, timeout=None, phase="read"):
+        """Read from the device with the feature bitmask for libdiscid
+        and record how long that took as `phase` in :attr:`timings`.
+        """
+        start = _timer()
         try:
-            result = _LIB.discid_read_sparse(self._handle, _encode(device),
-                                             c_features) == 1
-        except AttributeError:
-            result = _LIB.discid_read(self._handle, _encode(device)) == 1
+            if timeout is None:
+                result = self._read_handle(self._handle, device, c_features)
+            else:
+                result = self._read_timeout(device, c_features, timeout)
+        finally:
+            self._timings[phase] = _timer() - start
         self._success = result
         if not self._success:
             raise DiscError(self._get_error_msg())
-        return self._success
+        self._set_key(self._get_first_track_num(),
+                      self._get_last_track_num(), self._get_sectors(),
+                      [track.offset for track in self.tracks])
+
+    @staticmethod
+    def _read_handle(handle, device, c_features):
+        """Read with the given handle, returns the success
+        """
+        # device = None will use the default device (internally)
+        try:
+            return _LIB.discid_read_sparse(handle, _encode(device),
+                                           c_features) == 1
+        except AttributeError:
+            return _LIB.discid_read(handle, _encode(device)) == 1
+
+    def _read_timeout(self, device, c_features, timeout):
+        """Read in a worker thread and give up after `timeout` seconds.
+
+        The handle of a read that timed out is quarantined
+        until libdiscid returns and the disc gets a new handle.
+        """
+        handle = self._handle
+        state = {"done": False, "quarantined": False}
+        finished = threading.Event()
+        def work():
+            try:
+                state["result"] = Disc._read_handle(handle, device, c_features)
+            except Exception as exc:
+                state["error"] = exc
+            with _quarantine_lock:
+                state["done"] = True
+                quarantined = state["quarantined"]
+                _quarantine.discard(handle.value)
+            finished.set()
+            if quarantined:
+                _LIB.discid_free(handle)
+
+        thread = threading.Thread(target=work, name="discid read")
+        thread.daemon = True
+        thread.start()
+        finished.wait(timeout)
+        with _quarantine_lock:
+            if not state["done"]:
+                # replace the handle before the worker may free it
+                self._handle = c_void_p(_LIB.discid_new())
+                _quarantine.add(handle.value)
+                state["quarantined"] = True
+        if state["quarantined"]:
+            self._success = False
+            raise DiscTimeoutError(device, timeout)
+        if "error" in state:
+            raise state["error"]
+        return state["result"]
+
+    def _start_deferred(self, device, c_features, callback, timeout):
+        """Start reading the features in a background thread
+        """
+        # imported here, since concurrent.futures is slow to import
+        from concurrent.futures import Future
+        future = Future()
+        future.set_running_or_notify_cancel()
+        self._features_future = future
+        thread = threading.Thread(target=self._read_deferred,
+                                  args=(device, c_features, callback, timeout,
+                                        future, self._get_id()))
+        thread.daemon = True
+        thread.start()
+
+    def _read_deferred(self, device, c_features, callback, timeout, future,
+                       disc_id):
+        """Read the features with a separate handle and copy them over
+        """
+        try:
+            other = Disc(engine="libdiscid")
+            other._requested_features = self._requested_features
+            try:
+                other._read(device, c_features, timeout, "features")
+            finally:
+                self._timings["features"] = other._timings["features"]
+            if other._get_id() != disc_id:
+                raise DiscError("disc changed while reading features")
+            self._deferred_mcn = other._get_mcn()
+            self._deferred_isrcs = dict((track.number, track._get_track_isrc())
+                                        for track in other.tracks)
+            other._free()
+        except Exception as exc:
+            future.set_exception(exc)
+            return
+        future.set_result(self)
+        if callback is not None:
+            for number in sorted(self._deferred_isrcs):
+                callback(number, self._deferred_isrcs[number])
 
     _LIB.discid_put.argtypes = (c_void_p, c_int, c_int, c_void_p)
     _LIB.discid_put.restype = c_int
@@ -160,22 +428,76 @@ class Disc(object):
         The user is supposed to use :func:`discid.put`.
         """
         # check for common usage errors
-        if len(track_offsets) != last - first + 1:
+        if first < 1 or first > last or last > _MAX_TRACKS:
+            # the offsets array for libdiscid is sized by these
+            raise TOCError("Illegal track limits")
+        elif len(track_offsets) != last - first + 1:
             raise TOCError("Invalid number of track offsets")
-        elif False in [disc_sectors >= off for off in track_offsets]:
+        elif len(track_offsets) and _max_offset(track_offsets) > disc_sectors:
             raise TOCError("Disc sector count too low")
 
         # only the "read" (= TOC) feature is supported by put
         self._requested_features = ["read"]
-
-        offsets = [disc_sectors] + track_offsets
-        c_offsets = (c_int * len(offsets))(*tuple(offsets))
+        self._ids = {}
+
+        if self._handle is None:
+            track_offsets = _offsets_tuple(track_offsets)
+            error = _check_toc(first, last, disc_sectors, track_offsets)
+            self._success = error is None
+            if not self._success:
+                raise TOCError(error)
+            self._toc = (first, last, disc_sectors, track_offsets)
+            self._key = self._toc
+            self._hash = hash(self._toc)
+            return self._success
+
+        c_offsets = _c_offsets(first, disc_sectors, track_offsets)
         result = _LIB.discid_put(self._handle, first, last, c_offsets) == 1
         self._success = result
         if not self._success:
             raise TOCError(self._get_error_msg())
+        self._key = self._hash = None
+        self._key_source = (first, last, c_offsets)
         return self._success
 
+    def _set_key(self, first, last, disc_sectors, track_offsets):
+        """Cache the TOC for comparisons and its hash
+        """
+        self._key = (first, last, disc_sectors, tuple(track_offsets))
+        self._hash = hash(self._key)
+        self._key_source = None
+
+    def _toc_key(self):
+        """The TOC as `(first, last, sectors, offsets)`
+        used for comparisons and hashing
+        """
+        if self._key_source is not None:
+            first, last, c_offsets = self._key_source
+            self._set_key(first, last, c_offsets[0], c_offsets[first:])
+        return self._key
+
+    def __eq__(self, other):
+        """Discs are equal when they have the same TOC,
+        also compared to a :class:`DiscSnapshot`.
+        """
+        if not isinstance(other, (Disc, DiscSnapshot)):
+            return NotImplemented
+        key = self._toc_key()
+        if key is None:
+            return self is other
+        return key == other._toc_key()
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    def __hash__(self):
+        if self._toc_key() is None:
+            return object.__hash__(self)
+        return self._hash
+
 
     _LIB.discid_get_id.argtypes = (c_void_p, )
     _LIB.discid_get_id.restype = c_char_p
@@ -183,6 +505,8 @@ class Disc(object):
         """Gets the current MusicBrainz disc ID
         """
         assert self._success
+        if self._handle is None:
+            return discid.engine.disc_id(*self._toc)
         result = _LIB.discid_get_id(self._handle)
         return _decode(result)
 
@@ -192,6 +516,8 @@ class Disc(object):
         """Gets the current FreeDB disc ID
         """
         assert self._success
+        if self._handle is None:
+            return discid.engine.freedb_id(*self._toc)
         result = _LIB.discid_get_freedb_id(self._handle)
         return _decode(result)
 
@@ -202,6 +528,8 @@ class Disc(object):
         as a new Disc ID to MusicBrainz.
         """
         assert self._success
+        if self._handle is None:
+            return discid.engine.submission_url(*self._toc)
         result = _LIB.discid_get_submission_url(self._handle)
         return _decode(result)
 
@@ -215,6 +543,8 @@ class Disc(object):
         when accessing the MusicBrainz Web Service.
         """
         assert self._success
+        if self._handle is None:
+            return discid.engine.toc_string(*self._toc)
         try:
             result = _LIB.discid_get_toc_string(self._handle)
         except AttributeError:
@@ -228,6 +558,8 @@ class Disc(object):
         """Gets the first track number
         """
         assert self._success
+        if self._handle is None:
+            return self._toc[0]
         return _LIB.discid_get_first_track_num(self._handle)
 
     _LIB.discid_get_last_track_num.argtypes = (c_void_p, )
@@ -236,6 +568,8 @@ class Disc(object):
         """Gets the last track number
         """
         assert self._success
+        if self._handle is None:
+            return self._toc[1]
         return _LIB.discid_get_last_track_num(self._handle)
 
     _LIB.discid_get_sectors.argtypes = (c_void_p, )
@@ -244,6 +578,8 @@ class Disc(object):
         """Gets the total number of sectors on the disc
         """
         assert self._success
+        if self._handle is None:
+            return self._toc[2]
         return _LIB.discid_get_sectors(self._handle)
 
     try:
@@ -256,6 +592,11 @@ class Disc(object):
         """
         assert self._success
         if "mcn" in self._requested_features:
+            if self._features_future is not None:
+                self._features_future.result()
+                return self._deferred_mcn
+            if self._handle is None:
+                return self._deferred_mcn
             try:
                 result = _LIB.discid_get_mcn(self._handle)
             except AttributeError:
@@ -266,19 +607,29 @@ class Disc(object):
             return None
 
 
+    def _cached(self, name, function):
+        """The result of `function` for the current TOC,
+        only called once per read or put
+        """
+        try:
+            return self._ids[name]
+        except KeyError:
+            value = self._ids[name] = function()
+            return value
+
     @property
     def id(self):
         """This is the MusicBrainz :musicbrainz:`Disc ID`,
         a :obj:`unicode` or :obj:`str <python:str>` object.
         """
-        return self._get_id()
+        return self._cached("id", self._get_id)
 
     @property
     def freedb_id(self):
         """This is the :musicbrainz:`FreeDB` Disc ID (without category),
         a :obj:`unicode` or :obj:`str <python:str>` object.
         """
-        return self._get_freedb_id()
+        return self._cached("freedb_id", self._get_freedb_id)
 
     @property
     def submission_url(self):
@@ -313,6 +664,7 @@ class Disc(object):
         if toc_string is None and self.submission_url:
             # probably an old version of libdiscid (< 0.6.0)
             # gather toc string from submission_url
+            import re
             match = re.search("toc=([0-9+]+)", self.submission_url)
             if match is None:
                 raise ValueError("can't get toc string from submission url")
@@ -354,9 +706,34 @@ class Disc(object):
         It is set after the `"mcn"` feature was requested on a read
         and supported by the platform or :obj:`None`.
         If set, this is a :obj:`unicode` or :obj:`str <python:str>` object.
+
+        For a deferred read this waits until the MCN is read.
         """
         return self._get_mcn()
 
+    @property
+    def timings(self):
+        """How long reading took in seconds as a :obj:`dict`
+
+        The key is `"read"` for a normal read.
+        A deferred read has `"toc"` for reading the TOC
+        and `"features"` for reading the MCN and ISRCs in the background,
+        once that is done.
+        This is empty for discs created with :func:`put`.
+        """
+        return dict(self._timings)
+
+    @property
+    def features_future(self):
+        """A :class:`concurrent.futures.Future` for a deferred read
+
+        The result is the :class:`Disc` itself,
+        once the MCN and ISRCs are read in the background.
+        A :exc:`DiscError` is set as exception when that fails.
+        This is :obj:`None` unless the read was deferred.
+        """
+        return self._features_future
+
     @property
     def tracks(self):
         """A list of :class:`Track` objects for this Disc.
@@ -377,6 +754,9 @@ class Disc(object):
 
         .. seealso:: `CDDB Server Protocol <http://ftp.freedb.org/pub/freedb/latest/CDDBPROTO>`_
         """
+        return self._cached("cddb_query_string", self._get_cddb_query_string)
+
+    def _get_cddb_query_string(self):
         cddb_query_string = "%s %s %s %s" % (
             self.freedb_id,
             self.last_track_num,
@@ -385,14 +765,153 @@ class Disc(object):
         )
         return cddb_query_string
 
+    @property
+    def accuraterip_id(self):
+        """The AccurateRip disc ID as
+        `"<tracks>-<disc ID 1>-<disc ID 2>-<FreeDB ID>"`,
+        a :obj:`unicode` or :obj:`str <python:str>` object.
+
+        Only audio tracks are included, so discs with a data track
+        don't get the ID AccurateRip uses for them.
+        """
+        key = self._toc_key()
+        if key is None:
+            return None
+        return discid.engine.accuraterip_id(*key, cddb_id=self.freedb_id)
+
+    @property
+    def accuraterip_url(self):
+        """The URL of the AccurateRip results for this disc.
+        """
+        key = self._toc_key()
+        if key is None:
+            return None
+        return discid.engine.accuraterip_url(*key)
+
+    @property
+    def ctdb_id(self):
+        """The TOC ID of the CUETools database (CTDB),
+        a :obj:`unicode` or :obj:`str <python:str>` object.
+        """
+        key = self._toc_key()
+        if key is None:
+            return None
+        return discid.engine.ctdb_id(*key)
+
+
+
+    def to_bytes(self):
+        """Encodes the TOC, the MCN and the ISRCs in a compact binary form,
+        which :meth:`from_bytes` turns into a :class:`Disc` again.
+
+        This is also used to pickle discs.
+        The MCN and ISRCs are only included when they were read.
+        """
+        if not self._success:
+            raise ValueError("the disc has no TOC")
+        first, last = self.first_track_num, self.last_track_num
+        tracks = self.tracks
+        flags = 0
+        if "mcn" in self._requested_features:
+            flags |= _WIRE_MCN
+        if "isrc" in self._requested_features:
+            flags |= _WIRE_ISRC
+        parts = [_WIRE_HEADER.pack(_WIRE_VERSION, first, last, flags,
+                                   self.sectors),
+                 struct.pack("<%dI" % len(tracks),
+                             *[track.offset for track in tracks])]
+        strings = []
+        if flags & _WIRE_MCN:
+            strings.append(self.mcn)
+        if flags & _WIRE_ISRC:
+            strings.extend(track.isrc for track in tracks)
+        for string in strings:
+            encoded = _encode(string or "")
+            parts.append(struct.pack("<B", len(encoded)))
+            parts.append(encoded)
+        return b"".join(parts)
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Creates a :class:`Disc` from the result of :meth:`to_bytes`.
+
+        The disc uses the `"python"` engine,
+        so this doesn't need libdiscid.
+        A :exc:`ValueError` is raised for invalid data.
+        """
+        try:
+            version, first, last, flags, disc_sectors \
+                    = _WIRE_HEADER.unpack_from(data)
+            if version != _WIRE_VERSION:
+                raise ValueError("unknown version %d" % version)
+            count = last - first + 1
+            position = _WIRE_HEADER.size
+            offsets = struct.unpack_from("<%dI" % count, data, position)
+            position += 4 * count
+            strings = []
+            while position < len(data):
+                length = struct.unpack_from("<B", data, position)[0]
+                position += 1
+                if position + length > len(data):
+                    raise ValueError("truncated string")
+                strings.append(_decode(data[position:position + length]))
+                position += length
+        except struct.error as exc:
+            raise ValueError("invalid disc data: %s" % exc)
+        expected = (bool(flags & _WIRE_MCN)
+                    + (count if flags & _WIRE_ISRC else 0))
+        if len(strings) != expected:
+            raise ValueError("invalid disc data: wrong number of strings")
+
+        disc = cls(engine="python")
+        disc.put(first, last, disc_sectors, list(offsets))
+        if flags & _WIRE_MCN:
+            disc._requested_features.append("mcn")
+            disc._deferred_mcn = strings.pop(0)
+        if flags & _WIRE_ISRC:
+            disc._requested_features.append("isrc")
+            disc._deferred_isrcs = dict(zip(range(first, last + 1),
+                                            strings))
+        return disc
+
+    def __reduce__(self):
+        return (_disc_from_bytes, (self.to_bytes(), ))
+
+    def _snapshot(self):
+        """Copy all data into a :class:`DiscSnapshot`.
+        """
+        assert self._success
+        tracks = self.tracks
+        return DiscSnapshot(self.first_track_num, self.last_track_num,
+                            self.sectors, [track.offset for track in tracks],
+                            self.id, self.freedb_id,
+                            submission_url=self.submission_url,
+                            toc_string=self.toc_string, mcn=self.mcn,
+                            isrcs=[track.isrc for track in tracks])
+
+    def snapshot(self):
+        """Copies all data into an immutable :class:`DiscSnapshot`
+        and frees the memory reserved in libdiscid right away.
+
+        The snapshot serves all attributes without calls into libdiscid.
+        A :class:`Disc` using libdiscid can't be used anymore afterwards.
+        """
+        snapshot = self._snapshot()
+        if self._handle is not None:
+            self._free()
+            self._success = False
+            self._ids = {}
+        return snapshot
+
 
     _LIB.discid_free.argtypes = (c_void_p, )
     _LIB.discid_free.restype = None
     def _free(self):
         """This will free the internal allocated memory for the object.
         """
-        _LIB.discid_free(self._handle)
-        self._handle = None
+        if self._handle is not None:
+            _LIB.discid_free(self._handle)
+            self._handle = None
 
     def __enter__(self):
         """deprecated :keyword:`with` usage"""
@@ -406,4 +925,10 @@ class Disc(object):
         self._free()
 
 
+def _disc_from_bytes(data):
+    """Unpickle a :class:`Disc`
+    """
+    return Disc.from_bytes(data)
+
+
 # vim:set shiftwidth=4 smarttab expandtab:
@@ -0,0 +1,217 @@
+# Copyright (C) 2013  Johannes Dewender
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Please submit bug reports to GitHub:
+# https://github.com/JonnyJD/python-discid/issues
+"""Pure Python calculation of disc IDs
+
+These functions compute the same values libdiscid computes
+for a TOC given to :func:`put`, without any calls into libdiscid.
+"""
+
+import hashlib
+import binascii
+
+ENGINES = ["libdiscid", "python"]
+
+_engine = "libdiscid"
+
+# libdiscid refuses discs longer than this (in sectors)
+_MAX_DISC_LENGTH = 99 * 60 * 75
+_MAX_TRACKS = 99
+_SUBMISSION_URL = "https://musicbrainz.org/cdtoc/attach"
+_ACCURATERIP_URL = "http://www.accuraterip.com/accuraterip/%s/%s/%s/dBAR-%s.bin"
+# the offset of the first sector, AccurateRip counts from there
+_LEAD_IN = 150
+
+# the base64 variant MusicBrainz uses for disc IDs
+_B64_TRANSLATION = bytes.maketrans(b"+/=", b"._-") \
+        if hasattr(bytes, "maketrans") else None
+
+
+def set_engine(engine):
+    """Set the engine used by :func:`put` when no `engine` is given.
+
+    `engine` is one of :data:`ENGINES`.
+    """
+    global _engine
+    _engine = _check_engine(engine)
+
+def get_engine():
+    """The engine used by :func:`put` when no `engine` is given.
+    """
+    return _engine
+
+def _check_engine(engine):
+    """Return the engine to use, falling back to the process-wide default.
+    """
+    if engine is None:
+        return _engine
+    elif engine not in ENGINES:
+        raise ValueError("unknown engine: %s" % engine)
+    else:
+        return engine
+
+
+def _check_toc(first, last, disc_sectors, track_offsets):
+    """Check the TOC like libdiscid does in `discid_put`.
+
+    Returns an error message or :obj:`None` when the TOC is fine.
+    """
+    if (first < 1 or first > _MAX_TRACKS or last < 1 or last > _MAX_TRACKS
+            or first > last):
+        return "Illegal track limits"
+    if disc_sectors < 0 or disc_sectors > _MAX_DISC_LENGTH:
+        return "Illegal disc length"
+    previous = 0
+    for offset in track_offsets:
+        if offset < previous or offset > disc_sectors:
+            return "Illegal track offset"
+        previous = offset
+    return None
+
+def _cddb_sum(number):
+    """The digit sum used in the FreeDB ID
+    """
+    result = 0
+    while number > 0:
+        result += number % 10
+        number //= 10
+    return result
+
+# lookup tables for the hot loops, the TOC needs to be checked beforehand
+_CDDB_SUMS = [0]
+for _seconds in range(1, _MAX_DISC_LENGTH // 75 + 1):
+    _CDDB_SUMS.append(_CDDB_SUMS[_seconds // 10] + _seconds % 10)
+del _seconds
+_PADDING = ["00000000" * count for count in range(_MAX_TRACKS + 1)]
+_OFFSET_FORMATS = ["%08X" * count for count in range(_MAX_TRACKS + 1)]
+
+def _hash_input(first, last, disc_sectors, track_offsets):
+    """The string hashed for the MusicBrainz disc ID.
+    """
+    # the hash always covers track numbers 1 to 99, unused ones are 0
+    return "".join(("%02X%02X%08X" % (first, last, disc_sectors),
+                    _PADDING[first - 1],
+                    _OFFSET_FORMATS[len(track_offsets)] % tuple(track_offsets),
+                    _PADDING[_MAX_TRACKS - last]))
+
+def _encode_digest(digest):
+    """Encode a SHA-1 digest with the base64 variant of MusicBrainz.
+    """
+    # binascii rather than base64 which is slow to import
+    encoded = binascii.b2a_base64(digest)[:-1]
+    if _B64_TRANSLATION is not None:
+        encoded = encoded.translate(_B64_TRANSLATION)
+    else:
+        encoded = encoded.replace(b"+", b".").replace(b"/", b"_")
+        encoded = encoded.replace(b"=", b"-")
+    return encoded.decode("ascii")
+
+
+def disc_id(first, last, disc_sectors, track_offsets):
+    """The MusicBrainz :musicbrainz:`Disc ID` for the TOC.
+
+    The parameters are the same as for :func:`put`.
+    """
+    hash_input = _hash_input(first, last, disc_sectors, track_offsets)
+    return _encode_digest(hashlib.sha1(hash_input.encode("ascii")).digest())
+
+def freedb_id(first, last, disc_sectors, track_offsets):
+    """The :musicbrainz:`FreeDB` Disc ID for the TOC.
+
+    The parameters are the same as for :func:`put`.
+    """
+    # libdiscid sums over track numbers 1 to last,
+    # tracks before the first track have offset 0
+    try:
+        checksum = sum([_CDDB_SUMS[offset // 75] for offset in track_offsets])
+    except IndexError:
+        # longer than libdiscid allows, only without a checked TOC
+        checksum = sum([_cddb_sum(offset // 75) for offset in track_offsets])
+    if first == 1:
+        first_offset = track_offsets[0]
+    else:
+        first_offset = 0
+    seconds = disc_sectors // 75 - first_offset // 75
+    return "%08x" % ((checksum % 0xff) << 24 | seconds << 8 | last)
+
+def toc_string(first, last, disc_sectors, track_offsets):
+    """The TOC as used for the `toc` parameter of the web service.
+    """
+    return " ".join(map(str, [first, last, disc_sectors] + list(track_offsets)))
+
+def submission_url(first, last, disc_sectors, track_offsets):
+    """The URL to submit the TOC to MusicBrainz.
+    """
+    return "%s?id=%s&tracks=%d&toc=%s" % (
+        _SUBMISSION_URL, disc_id(first, last, disc_sectors, track_offsets),
+        last, toc_string(first, last, disc_sectors,
+                         track_offsets).replace(" ", "+"))
+
+
+def _accuraterip_sums(disc_sectors, track_offsets):
+    """The AccurateRip disc IDs 1 and 2 as integers
+    """
+    # the track numbers count from 1 regardless of the first track
+    sum1 = 0
+    sum2 = 0
+    for number, offset in enumerate(track_offsets, 1):
+        offset -= _LEAD_IN
+        sum1 += offset
+        sum2 += (offset if offset > 0 else 1) * number
+    leadout = disc_sectors - _LEAD_IN
+    sum1 += leadout
+    sum2 += leadout * (len(track_offsets) + 1)
+    return sum1 & 0xffffffff, sum2 & 0xffffffff
+
+def accuraterip_id(first, last, disc_sectors, track_offsets, cddb_id=None):
+    """The AccurateRip disc ID for the TOC as
+    `"<tracks>-<disc ID 1>-<disc ID 2>-<FreeDB ID>"`.
+
+    The `cddb_id` is calculated unless it is given.
+    """
+    if cddb_id is None:
+        cddb_id = freedb_id(first, last, disc_sectors, track_offsets)
+    sum1, sum2 = _accuraterip_sums(disc_sectors, track_offsets)
+    return "%03d-%08x-%08x-%s" % (len(track_offsets), sum1, sum2, cddb_id)
+
+def accuraterip_url(first, last, disc_sectors, track_offsets):
+    """The URL of the AccurateRip results for the TOC.
+    """
+    ar_id = accuraterip_id(first, last, disc_sectors, track_offsets)
+    # the directories are the last three digits of disc ID 1
+    sum1 = ar_id[4:12]
+    return _ACCURATERIP_URL % (sum1[-1], sum1[-2], sum1[-3], ar_id)
+
+def _ctdb_hash_input(disc_sectors, track_offsets):
+    """The string hashed for the CTDB TOC ID.
+    """
+    # the offsets relative to the first track, the lead-out last,
+    # always padded to 100 entries
+    start = track_offsets[0]
+    relative = [offset - start for offset in track_offsets[1:]]
+    relative.append(disc_sectors - start)
+    return "".join((_OFFSET_FORMATS[len(relative)] % tuple(relative),
+                    _PADDING[_MAX_TRACKS + 1 - len(relative)]))
+
+def ctdb_id(first, last, disc_sectors, track_offsets):
+    """The CUETools database (CTDB) TOC ID for the TOC.
+    """
+    hash_input = _ctdb_hash_input(disc_sectors, track_offsets)
+    return _encode_digest(hashlib.sha1(hash_input.encode("ascii")).digest())
+
+
+# vim:set shiftwidth=4 smarttab expandtab:
@@ -0,0 +1,501 @@
+# Copyright (C) 2013  Johannes Dewender
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Please submit bug reports to GitHub:
+# https://github.com/JonnyJD/python-discid/issues
+"""Local indexes to look up TOCs without a web service
+"""
+
+import os
+import sys
+import mmap
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+
+from discid.disc import TOCError
+from discid.engine import _check_toc, freedb_id as _freedb_id
+
+
+Candidate = namedtuple("Candidate", ["number", "distance", "first", "last",
+                                     "sectors", "offsets"])
+
+FreeDBEntry = namedtuple("FreeDBEntry", ["number", "freedb_id", "first",
+                                         "last", "sectors", "offsets"])
+
+_MAGIC = b"DISCIDX2"
+_FREEDB_MAGIC = {"little": b"DISCIDFl", "big": b"DISCIDFb"}
+
+
+def _disc_toc(disc):
+    """The TOC of a :class:`Disc` or :class:`DiscSnapshot`
+    as `(first, last, sectors, offsets)`
+    """
+    return (disc.first_track_num, disc.last_track_num, disc.sectors,
+            [track.offset for track in disc.tracks])
+
+def _track_lengths(disc_sectors, track_offsets):
+    """The lengths of the tracks in sectors, the last one ends at the lead-out
+    """
+    ends = list(track_offsets[1:]) + [disc_sectors]
+    return [end - offset for offset, end in zip(track_offsets, ends)]
+
+def _write_header(index_file, values):
+    header = array("q", values)
+    if sys.byteorder != "little":
+        header.byteswap()
+    header.tofile(index_file)
+
+def _read_header(index_file, count):
+    header = array("q")
+    header.fromfile(index_file, count)
+    if sys.byteorder != "little":
+        header.byteswap()
+    return header
+
+def _write_array(index_file, values):
+    if sys.byteorder != "little":
+        values = array(values.typecode, values)
+        values.byteswap()
+    values.tofile(index_file)
+
+def _read_array(index_file, typecode, count):
+    values = array(typecode)
+    values.fromfile(index_file, count)
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values
+
+
+class _Bucket(object):
+    """The TOCs with the same number of tracks,
+    sorted by the length of the audio tracks
+    """
+
+    def __init__(self, track_count):
+        self.track_count = track_count
+        # from the first track offset to the lead-out, the sort key
+        self.lengths = array("i")
+        self.sectors = array("i")
+        self.numbers = array("i")
+        self.firsts = array("B")
+        self.offsets = array("i")
+        self.sorted = True
+
+    def __len__(self):
+        return len(self.sectors)
+
+    def add(self, number, first, disc_sectors, track_offsets):
+        self.lengths.append(disc_sectors - track_offsets[0])
+        self.sectors.append(disc_sectors)
+        self.numbers.append(number)
+        self.firsts.append(first)
+        self.offsets.extend(track_offsets)
+        self.sorted = False
+
+    def sort(self):
+        if self.sorted:
+            return
+        count = self.track_count
+        order = sorted(range(len(self.lengths)),
+                       key=self.lengths.__getitem__)
+        offsets = self.offsets
+        self.lengths = array("i", [self.lengths[i] for i in order])
+        self.sectors = array("i", [self.sectors[i] for i in order])
+        self.numbers = array("i", [self.numbers[i] for i in order])
+        self.firsts = array("B", [self.firsts[i] for i in order])
+        self.offsets = array("i")
+        for i in order:
+            self.offsets.extend(offsets[i * count:(i + 1) * count])
+        self.sorted = True
+
+    def find(self, first, disc_sectors, track_offsets, tolerance):
+        self.sort()
+        count = self.track_count
+        lengths = self.lengths
+        sectors = self.sectors
+        offsets = self.offsets
+        length = disc_sectors - track_offsets[0]
+        track_lengths = _track_lengths(disc_sectors, track_offsets)
+        start = bisect_left(lengths, length - tolerance)
+        end = bisect_right(lengths, length + tolerance, start)
+        for i in range(start, end):
+            if self.firsts[i] != first:
+                continue
+            distance = abs(lengths[i] - length)
+            base = i * count
+            for j, track_length in enumerate(track_lengths):
+                if j + 1 < count:
+                    track_end = offsets[base + j + 1]
+                else:
+                    track_end = sectors[i]
+                difference = abs(track_end - offsets[base + j]
+                                 - track_length)
+                if difference > distance:
+                    if difference > tolerance:
+                        break
+                    distance = difference
+            else:
+                yield Candidate(self.numbers[i], distance, first,
+                                first + count - 1, sectors[i],
+                                tuple(offsets[base:base + count]))
+
+
+class TOCIndex(object):
+    """An in-memory index of TOCs for fuzzy lookups.
+
+    The TOCs are bucketed by the number of tracks
+    and sorted by the length of the audio tracks within every bucket,
+    so a lookup only compares the track lengths of TOCs
+    with the same number of tracks and a similar length.
+    Since the track lengths are compared rather than the offsets,
+    pressings with a different offset of the first track are found.
+    Every TOC is stored as a few machine integers.
+    """
+
+    def __init__(self):
+        self._buckets = {}
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def add(self, first, last, disc_sectors, track_offsets):
+        """Adds a TOC to the index and returns its number.
+
+        The parameters are the same as for :func:`put`.
+        The TOCs are numbered in the order they are added, starting at 0,
+        so you can keep your own data for them in a list.
+        A :exc:`TOCError` is raised for invalid TOCs.
+        """
+        track_offsets = list(track_offsets)
+        if len(track_offsets) != last - first + 1:
+            raise TOCError("Invalid number of track offsets")
+        error = _check_toc(first, last, disc_sectors, track_offsets)
+        if error is not None:
+            raise TOCError(error)
+        track_count = last - first + 1
+        bucket = self._buckets.get(track_count)
+        if bucket is None:
+            bucket = self._buckets[track_count] = _Bucket(track_count)
+        number = self._count
+        bucket.add(number, first, disc_sectors, track_offsets)
+        self._count += 1
+        return number
+
+    def add_disc(self, disc):
+        """Adds the TOC of a :class:`Disc` or :class:`DiscSnapshot`
+        like :meth:`add`.
+        """
+        return self.add(*_disc_toc(disc))
+
+    def find(self, disc, tolerance=300):
+        """Returns the TOCs similar to the TOC of `disc`
+        as a list of :class:`Candidate` sorted by distance.
+
+        `disc` is a :class:`Disc` or a :class:`DiscSnapshot`.
+        Candidates have the same track numbers and differ in the
+        length of every track, the last one ending at the lead-out,
+        and in the length of all tracks by at most `tolerance` sectors.
+        The `distance` of a candidate is the largest of these differences,
+        0 means the TOC is the same.
+        """
+        return self.find_toc(*_disc_toc(disc), tolerance=tolerance)
+
+    def find_toc(self, first, last, disc_sectors, track_offsets,
+                 tolerance=300):
+        """Like :meth:`find`, but with the parameters of :func:`put`.
+        """
+        bucket = self._buckets.get(last - first + 1)
+        if bucket is None:
+            return []
+        candidates = list(bucket.find(first, disc_sectors, track_offsets,
+                                      tolerance))
+        candidates.sort(key=lambda candidate: (candidate.distance,
+                                               candidate.number))
+        return candidates
+
+    def save(self, path):
+        """Writes the index to the file at `path`.
+        """
+        buckets = [self._buckets[count] for count in sorted(self._buckets)]
+        with open(path, "wb") as index_file:
+            index_file.write(_MAGIC)
+            _write_header(index_file, [len(buckets), self._count])
+            for bucket in buckets:
+                bucket.sort()
+                _write_header(index_file, [bucket.track_count, len(bucket)])
+                _write_array(index_file, bucket.lengths)
+                _write_array(index_file, bucket.sectors)
+                _write_array(index_file, bucket.numbers)
+                _write_array(index_file, bucket.firsts)
+                _write_array(index_file, bucket.offsets)
+
+    @classmethod
+    def load(cls, path):
+        """Reads an index written with :meth:`save`.
+        """
+        index = cls()
+        with open(path, "rb") as index_file:
+            if index_file.read(len(_MAGIC)) != _MAGIC:
+                raise ValueError("%s is not a TOC index" % path)
+            bucket_count, index._count = _read_header(index_file, 2)
+            for _ in range(bucket_count):
+                track_count, length = _read_header(index_file, 2)
+                bucket = _Bucket(track_count)
+                bucket.lengths = _read_array(index_file, "i", length)
+                bucket.sectors = _read_array(index_file, "i", length)
+                bucket.numbers = _read_array(index_file, "i", length)
+                bucket.firsts = _read_array(index_file, "B", length)
+                bucket.offsets = _read_array(index_file, "i",
+                                             length * track_count)
+                index._buckets[track_count] = bucket
+        return index
+
+
+def _sort_key(freedb_id):
+    """Rotate the FreeDB ID so the track count comes first,
+    followed by the seconds and then the checksum
+    """
+    return ((freedb_id & 0xff) << 24 | (freedb_id & 0xffff00)
+            | freedb_id >> 24)
+
+def _freedb_id_from_key(key):
+    return (key & 0xff) << 24 | (key & 0xffff00) | key >> 24
+
+def _slot(freedb_id, table_size):
+    return ((freedb_id * 2654435761) & 0xffffffff) & (table_size - 1)
+
+def _as_int(freedb_id):
+    if isinstance(freedb_id, int):
+        return freedb_id
+    return int(freedb_id, 16)
+
+
+class FreeDBIndex(object):
+    """A read-only index of TOCs by FreeDB ID in a memory-mapped file.
+
+    The file is created with :meth:`build`.
+    Several processes can open the same file
+    and share the pages from the operating system's cache
+    instead of loading the index into memory.
+    The TOCs are sorted by track count, disc length and checksum,
+    the fields of the FreeDB ID, and a hash table
+    maps every FreeDB ID to its TOCs.
+
+    The file uses the byte order of the machine it was built on.
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as index_file:
+            self._mmap = mmap.mmap(index_file.fileno(), 0,
+                                   access=mmap.ACCESS_READ)
+        try:
+            self._open(path)
+        except:
+            self._mmap.close()
+            raise
+
+    def _open(self, path):
+        size = len(_MAGIC)
+        if self._mmap[:size] != _FREEDB_MAGIC[sys.byteorder]:
+            if self._mmap[:size] in _FREEDB_MAGIC.values():
+                raise ValueError("%s was built with another byte order"
+                                 % path)
+            raise ValueError("%s is not a FreeDB index" % path)
+        if len(self._mmap) < size + 24:
+            raise ValueError("%s is truncated" % path)
+        view = memoryview(self._mmap)
+        self._views = []
+        try:
+            header = view[size:size + 24].cast("q")
+            self._count, self._table_size, pool_length = header
+            header.release()
+            sections = [("_starts", "Q", self._count + 1),
+                        ("_keys", "I", self._count),
+                        ("_numbers", "I", self._count),
+                        ("_table", "I", 3 * self._table_size),
+                        ("_pool", "i", pool_length)]
+            position = size + 24
+            for name, typecode, length in sections:
+                end = position + length * array(typecode).itemsize
+                if length < 0 or end > len(view):
+                    raise ValueError("%s is truncated or corrupt" % path)
+                section = view[position:end].cast(typecode)
+                setattr(self, name, section)
+                self._views.append(section)
+                position = end
+        except:
+            # the mmap can't be closed while views into it exist
+            for section in self._views:
+                section.release()
+            self._views = []
+            raise
+        finally:
+            view.release()
+
+    @classmethod
+    def build(cls, path, tocs):
+        """Writes an index file for `tocs` and opens it.
+
+        `tocs` is an iterable of `(first, last, disc_sectors, track_offsets)`
+        tuples. The TOCs are numbered in this order, starting at 0.
+        A :exc:`TOCError` is raised for invalid TOCs.
+        The file is written to a temporary file first,
+        so processes using an older version of the file are not disturbed.
+        """
+        keys = array("I")
+        starts = array("Q", [0])
+        pool = array("i")
+        for first, last, disc_sectors, track_offsets in tocs:
+            track_offsets = list(track_offsets)
+            if len(track_offsets) != last - first + 1:
+                raise TOCError("Invalid number of track offsets")
+            error = _check_toc(first, last, disc_sectors, track_offsets)
+            if error is not None:
+                raise TOCError(error)
+            keys.append(_sort_key(int(_freedb_id(first, last, disc_sectors,
+                                                 track_offsets), 16)))
+            pool.append(first)
+            pool.append(last)
+            pool.append(disc_sectors)
+            pool.extend(track_offsets)
+            starts.append(len(pool))
+
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+        sorted_keys = array("I", [keys[i] for i in order])
+        sorted_starts = array("Q", [0])
+        sorted_pool = array("i")
+        for i in order:
+            sorted_pool.extend(pool[starts[i]:starts[i + 1]])
+            sorted_starts.append(len(sorted_pool))
+        del keys, starts, pool
+
+        # open addressing with a load factor of at most 1/2
+        ids = []
+        for i, key in enumerate(sorted_keys):
+            if i == 0 or key != sorted_keys[i - 1]:
+                ids.append([_freedb_id_from_key(key), i, 0])
+            ids[-1][2] += 1
+        table_size = 1
+        while table_size < 2 * len(ids):
+            table_size *= 2
+        table = array("I", [0] * (3 * table_size))
+        for freedb_id, start, count in ids:
+            slot = _slot(freedb_id, table_size)
+            while table[3 * slot + 2]:
+                slot = (slot + 1) & (table_size - 1)
+            table[3 * slot:3 * slot + 3] = array("I", [freedb_id, start,
+                                                       count])
+
+        temporary = "%s.%d.tmp" % (path, os.getpid())
+        with open(temporary, "wb") as index_file:
+            index_file.write(_FREEDB_MAGIC[sys.byteorder])
+            array("q", [len(sorted_keys), table_size,
+                        len(sorted_pool)]).tofile(index_file)
+            sorted_starts.tofile(index_file)
+            sorted_keys.tofile(index_file)
+            array("I", order).tofile(index_file)
+            table.tofile(index_file)
+            sorted_pool.tofile(index_file)
+        os.rename(temporary, path)
+        return cls(path)
+
+    def __len__(self):
+        return self._count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Unmaps the file. The index can't be used afterwards.
+        """
+        for view in self._views:
+            view.release()
+        self._views = []
+        self._mmap.close()
+
+    def _entry(self, i):
+        start, end = self._starts[i], self._starts[i + 1]
+        first, last, disc_sectors = self._pool[start:start + 3]
+        return FreeDBEntry(self._numbers[i],
+                           "%08x" % _freedb_id_from_key(self._keys[i]),
+                           first, last, disc_sectors,
+                           tuple(self._pool[start + 3:end]))
+
+    def _range(self, freedb_id):
+        table = self._table
+        mask = self._table_size - 1
+        slot = _slot(freedb_id, self._table_size)
+        while table[3 * slot + 2]:
+            if table[3 * slot] == freedb_id:
+                start = table[3 * slot + 1]
+                return start, start + table[3 * slot + 2]
+            slot = (slot + 1) & mask
+        return 0, 0
+
+    def candidates(self, freedb_id):
+        """All TOCs with the FreeDB ID as a list of :class:`FreeDBEntry`.
+
+        `freedb_id` is a string like :attr:`Disc.freedb_id` or an integer.
+        """
+        start, end = self._range(_as_int(freedb_id))
+        return [self._entry(i) for i in range(start, end)]
+
+    def find(self, disc):
+        """The TOCs that are the same as the TOC of `disc`
+        as a list of :class:`FreeDBEntry`.
+
+        `disc` is a :class:`Disc` or a :class:`DiscSnapshot`.
+        The TOCs with the same FreeDB ID are compared with all offsets,
+        so other discs colliding on the FreeDB ID are not returned.
+        """
+        return self.find_toc(*_disc_toc(disc))
+
+    def find_toc(self, first, last, disc_sectors, track_offsets):
+        """Like :meth:`find`, but with the parameters of :func:`put`.
+        """
+        track_offsets = tuple(track_offsets)
+        freedb_id = int(_freedb_id(first, last, disc_sectors,
+                                   track_offsets), 16)
+        start, end = self._range(freedb_id)
+        toc = array("i", (first, last, disc_sectors) + track_offsets)
+        pool = self._pool
+        starts = self._starts
+        return [self._entry(i) for i in range(start, end)
+                if pool[starts[i]:starts[i + 1]] == toc]
+
+    def by_length(self, track_count, min_seconds, max_seconds):
+        """Yields a :class:`FreeDBEntry` for every TOC
+        with the track count and a length from `min_seconds`
+        to `max_seconds` as encoded in the FreeDB ID.
+        Like libdiscid the FreeDB ID uses the number of the last track
+        as the track count.
+
+        The entries are ordered by length.
+        """
+        low = track_count << 24 | max(min_seconds, 0) << 8
+        high = track_count << 24 | min(max_seconds, 0xffff) << 8 | 0xff
+        keys = self._keys
+        start = bisect_left(keys, low)
+        end = bisect_right(keys, high, start)
+        for i in range(start, end):
+            yield self._entry(i)
+
+
+# vim:set shiftwidth=4 smarttab expandtab:
@@ -0,0 +1,176 @@
+# Copyright (C) 2013  Johannes Dewender
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Please submit bug reports to GitHub:
+# https://github.com/JonnyJD/python-discid/issues
+"""Opt-in counters for the calls into libdiscid
+
+While instrumentation is off, the functions on :data:`_LIB`
+are the ctypes functions themselves, so there is no overhead.
+"""
+
+import atexit
+import threading
+from timeit import default_timer
+
+from discid.libdiscid import _LIB
+
+# the histogram has buckets for calls faster than 1, 2, 4, ... microseconds
+_BUCKETS = 32
+# results of libdiscid functions that signal an error
+_FAILURES = {"discid_read": 0, "discid_read_sparse": 0, "discid_put": 0}
+
+_hook = {"function": None, "stop": None}
+_hook_lock = threading.Lock()
+
+
+class _Counter(object):
+    """Calls, errors and latencies of one libdiscid function
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._clear()
+
+    def _clear(self):
+        self.calls = 0
+        self.errors = 0
+        self.total = 0.0
+        self.minimum = None
+        self.maximum = 0.0
+        self.histogram = [0] * _BUCKETS
+
+    def record(self, elapsed, failed):
+        bucket = min(int(elapsed * 1e6).bit_length(), _BUCKETS - 1)
+        with self.lock:
+            self.calls += 1
+            self.errors += failed
+            self.total += elapsed
+            if self.minimum is None or elapsed < self.minimum:
+                self.minimum = elapsed
+            if elapsed > self.maximum:
+                self.maximum = elapsed
+            self.histogram[bucket] += 1
+
+    def reset(self):
+        with self.lock:
+            self._clear()
+
+    def snapshot(self):
+        with self.lock:
+            return {"calls": self.calls, "errors": self.errors,
+                    "total": self.total,
+                    "mean": self.total / self.calls if self.calls else 0.0,
+                    "min": self.minimum or 0.0, "max": self.maximum,
+                    "histogram": [((1 << bucket) * 1e-6, count)
+                                  for bucket, count
+                                  in enumerate(self.histogram) if count]}
+
+
+def _instrumented(name, function, counters):
+    """Wrap a ctypes function to count its calls in `counters`
+    """
+    counter = counters.get(name)
+    if counter is None:
+        counter = counters.setdefault(name, _Counter())
+    failure = _FAILURES.get(name, object())
+
+    def call(*args):
+        start = default_timer()
+        try:
+            result = function(*args)
+        except Exception:
+            counter.record(default_timer() - start, True)
+            raise
+        counter.record(default_timer() - start, result == failure)
+        return result
+    call.__name__ = name
+    return call
+
+def _stats(library, reset):
+    counters = library._counters
+    if counters is None:
+        return {}
+    result = dict((name, counter.snapshot())
+                  for name, counter in list(counters.items()))
+    if reset:
+        for counter in list(counters.values()):
+            counter.reset()
+    return result
+
+
+def instrument(enabled=True):
+    """Switch counting the calls into libdiscid on or off.
+
+    Switching it off discards the counters.
+    This can be done at any time, also before libdiscid is loaded.
+    """
+    _LIB._instrument(enabled)
+
+def stats(reset=False):
+    """The counters for the calls into libdiscid since :func:`instrument`
+    was called, as a dictionary of function name to a dictionary with
+    the number of `calls` and `errors`,
+    the `total`, `mean`, `min` and `max` time in seconds
+    and a `histogram` as a list of `(upper bound, count)` tuples,
+    with upper bounds of 1, 2, 4, ... microseconds given in seconds.
+
+    A call is an error when it raises an exception
+    or returns the value libdiscid uses for failures.
+    The dictionary is empty when instrumentation is off.
+    With `reset` the counters are set to zero afterwards.
+    """
+    return _stats(_LIB, reset)
+
+def _push_stats(stop, interval):
+    while not stop.wait(interval):
+        with _hook_lock:
+            if _hook["stop"] is not stop:
+                return
+            function = _hook["function"]
+        function(stats())
+
+def _push_at_exit():
+    function = _hook["function"]
+    if function is not None:
+        function(stats())
+
+def set_stats_hook(function, interval=60.0):
+    """Call `function` with the result of :func:`stats`
+    every `interval` seconds and when the interpreter exits,
+    to push the counters to a metrics system.
+
+    The function is called from a background thread.
+    Setting the hook to :obj:`None` removes it.
+    This does not switch on the instrumentation, see :func:`instrument`.
+    """
+    with _hook_lock:
+        if _hook["stop"] is not None:
+            _hook["stop"].set()
+        _hook["function"] = function
+        _hook["stop"] = None
+        if function is not None:
+            stop = threading.Event()
+            thread = threading.Thread(target=_push_stats,
+                                      args=(stop, interval),
+                                      name="discid-stats")
+            thread.daemon = True
+            _hook["stop"] = stop
+            thread.start()
+
+atexit.register(_push_at_exit)
+
+
+# vim:set shiftwidth=4 smarttab expandtab:
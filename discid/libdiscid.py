@@ -18,23 +18,36 @@
 """libdiscid dynamic loading code and constants
 
 The code that works with Disc objects is in disc.py
+
+Libdiscid is only loaded when it is used the first time.
+The function prototypes are declared on :data:`_LIB` right away
+and applied when the library is loaded.
 """
 
 import os
 import sys
 import ctypes
+import threading
 from ctypes import c_void_p, c_char_p
-from ctypes.util import find_library
 
 from discid.util import _encode, _decode
 
 _LIB_BASE_NAME = "discid"
 _LIB_MAJOR_VERSION = 0
 
+# environment variables used when configure() wasn't called
+_LIBRARY_ENV = "DISCID_LIBRARY"
+_CACHE_ENV = "DISCID_CACHE"
+
+_config = {"library": None, "cache": None}
+
 
 def _find_library(name, version=0):
     """Find a library by base-name and major version
     """
+    # imported here, since ctypes.util is slow to import
+    from ctypes.util import find_library
+
     windows_names = ["%s.dll" % name, "lib%s.dll" % name,
                      "lib%s-%d.dll" % (name, version)]
 
@@ -104,9 +117,194 @@ def _open_library(lib_name):
         else:
             raise
 
-_LIB_NAME = _find_library(_LIB_BASE_NAME, _LIB_MAJOR_VERSION)
-_LIB = _open_library(_LIB_NAME)
 
+class _Prototype(object):
+    """A libdiscid function that is not resolved yet.
+
+    `argtypes`, `restype` and `errcheck` set on the prototype
+    are set on the actual function when it is resolved.
+    Calling the prototype loads the library.
+    """
+
+    def __init__(self, library, name):
+        self._library = library
+        self._name = name
+
+    def __call__(self, *args):
+        return self._library._resolve(self._name)(*args)
+
+
+class _Library(object):
+    """Stand-in for the libdiscid :class:`ctypes.CDLL`, loaded on first use.
+
+    Resolved functions are stored as attributes,
+    so later calls go to the ctypes function directly.
+    Functions missing in libdiscid raise :exc:`AttributeError`
+    when they are called, like the :class:`ctypes.CDLL` would on access.
+    """
+
+    def __init__(self):
+        self._cdll = None
+        self._name = None
+        self._prototypes = {}
+        self._functions = {}
+        # name -> counter while instrumented, see discid.instrument
+        self._counters = None
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        if self._cdll is not None:
+            return self._resolve(name)
+        prototype = self._prototypes.get(name)
+        if prototype is None:
+            prototype = _Prototype(self, name)
+            self._prototypes[name] = prototype
+        return prototype
+
+    def _load(self):
+        """Load libdiscid unless it is loaded already
+        and return the :class:`ctypes.CDLL`.
+        """
+        if self._cdll is None:
+            with self._lock:
+                if self._cdll is None:
+                    self._name, self._cdll = _load_library()
+        return self._cdll
+
+    def _resolve(self, name):
+        """Get a function from libdiscid and apply the declared prototype.
+        """
+        function = getattr(self._load(), name)
+        prototype = self._prototypes.get(name)
+        if prototype is not None:
+            for attribute in ("argtypes", "restype", "errcheck"):
+                if attribute in vars(prototype):
+                    setattr(function, attribute, getattr(prototype, attribute))
+        self._functions[name] = function
+        function = self._wrap(name, function)
+        setattr(self, name, function)
+        return function
+
+    def _wrap(self, name, function):
+        """The function to call for `name`,
+        which is the ctypes function itself unless instrumented
+        """
+        counters = self._counters
+        if counters is None:
+            return function
+        from discid.instrument import _instrumented
+        return _instrumented(name, function, counters)
+
+    def _instrument(self, enabled):
+        """Switch the instrumentation of all functions on or off
+        """
+        with self._lock:
+            if not enabled:
+                self._counters = None
+            elif self._counters is None:
+                self._counters = {}
+            for name, function in list(self._functions.items()):
+                setattr(self, name, self._wrap(name, function))
+
+    def _has(self, name):
+        """Test if libdiscid has a function
+        """
+        return hasattr(self._load(), name)
+
+
+def configure(library=None, cache=None):
+    """Configure how libdiscid is found and loaded.
+
+    `library` is a file name or path of libdiscid to use
+    instead of searching for it.
+    This can also be set with the environment variable `DISCID_LIBRARY`.
+
+    `cache` is the path of a file used to cache the location,
+    version and features of libdiscid across processes,
+    which saves searching for the library on every start.
+    This can also be set with the environment variable `DISCID_CACHE`.
+
+    This has to be called before libdiscid is used the first time,
+    otherwise a :exc:`RuntimeError` is raised.
+    """
+    if _LIB._cdll is not None:
+        raise RuntimeError("libdiscid is already loaded")
+    _config["library"] = library
+    _config["cache"] = cache
+
+def _get_config(key, env):
+    value = _config[key]
+    if value is None:
+        value = os.environ.get(env) or None
+    return value
+
+def _cache_key(library):
+    """Identify the situation a cache entry is valid for
+    """
+    return "%s %s %s" % (sys.platform, sys.executable, library or "")
+
+def _read_cache(path, key):
+    """Read the cache file, returns :obj:`None` when it is missing or stale
+    """
+    import json
+    try:
+        with open(path) as cache_file:
+            cache = json.load(cache_file)
+    except (IOError, OSError, ValueError):
+        return None
+    if not isinstance(cache, dict) or cache.get("key") != key:
+        return None
+    return cache
+
+def _write_cache(path, cache):
+    """Write the cache file, errors are ignored since the cache is optional
+    """
+    import json
+    temp_path = "%s.%d.tmp" % (path, os.getpid())
+    try:
+        with open(temp_path, "w") as cache_file:
+            json.dump(cache, cache_file)
+        os.rename(temp_path, path)
+    except (IOError, OSError):
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+
+def _load_library():
+    """Find and open libdiscid, using the cache when configured.
+
+    Returns the name of the library and the :class:`ctypes.CDLL`.
+    """
+    library = _get_config("library", _LIBRARY_ENV)
+    cache_path = _get_config("cache", _CACHE_ENV)
+    key = _cache_key(library)
+    cache = None
+    if cache_path is not None:
+        cache = _read_cache(cache_path, key)
+    if cache is not None:
+        try:
+            return cache["library"], _open_library(cache["library"])
+        except OSError:
+            # libdiscid moved, search again
+            cache = None
+
+    if library is not None:
+        lib_name = library
+    else:
+        lib_name = _find_library(_LIB_BASE_NAME, _LIB_MAJOR_VERSION)
+    if os.path.dirname(lib_name):
+        # found in current folder or given as path
+        lib_name = os.path.abspath(lib_name)
+    cdll = _open_library(lib_name)
+    if cache_path is not None:
+        _write_cache(cache_path, {"key": key, "library": lib_name})
+    return lib_name, cdll
+
+_LIB = _Library()
+"""The lazily loaded libdiscid, see :class:`_Library`."""
 
 
 try:
@@ -133,18 +331,13 @@ def get_default_device():
     device = _LIB.discid_get_default_device()
     return _decode(device)
 
-try:
-    _LIB.discid_get_feature_list.argtypes = (c_void_p, )
-    _LIB.discid_get_feature_list.restype = None
-except AttributeError:
-    _features_available = False
-else:
-    _features_available = True
+_LIB.discid_get_feature_list.argtypes = (c_void_p, )
+_LIB.discid_get_feature_list.restype = None
 def _get_features():
     """Get the supported features for the platform.
     """
     features = []
-    if _features_available:
+    if _LIB._has("discid_get_feature_list"):
         c_features = (c_char_p * 32)()
         _LIB.discid_get_feature_list(c_features)
         for feature in c_features:
@@ -153,12 +346,7 @@ def _get_features():
     else:
         # libdiscid <= 0.4.0
         features = ["read"]     # no generic platform yet
-        try:
-            # test for ISRC/MCN API (introduced 0.3.0)
-            _LIB.discid_get_mcn
-        except AttributeError:
-            pass
-        else:
+        if _LIB._has("discid_get_mcn"):
             # ISRC/MCN API found -> libdiscid = 0.3.x
             if (sys.platform.startswith("linux") and
                     not os.path.isfile("/usr/lib/libdiscid.so.0.3.0")
@@ -169,9 +357,39 @@ def _get_features():
 
     return features
 
-LIBDISCID_VERSION_STRING = _get_version_string()
+def _get_constants():
+    """Get the version string and features of libdiscid,
+    from the cache if possible.
+    """
+    cache_path = _get_config("cache", _CACHE_ENV)
+    key = _cache_key(_get_config("library", _LIBRARY_ENV))
+    cache = None
+    if cache_path is not None:
+        cache = _read_cache(cache_path, key)
+    if cache is not None and "features" in cache:
+        return cache["version_string"], cache["features"]
+
+    version_string = _get_version_string()
+    features = _get_features()
+    if cache_path is not None:
+        _write_cache(cache_path, {"key": key, "library": _LIB._name,
+                                  "version_string": version_string,
+                                  "features": features})
+    return version_string, features
+
+def __getattr__(name):
+    """Provide the constants, which loads libdiscid on first access
+    """
+    if name in ("LIBDISCID_VERSION_STRING", "FEATURES"):
+        version_string, features = _get_constants()
+        globals()["LIBDISCID_VERSION_STRING"] = version_string
+        globals()["FEATURES"] = features
+        return globals()[name]
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
 
-FEATURES = _get_features()
+if sys.version_info < (3, 7):
+    # no module level __getattr__ (PEP 562), load right away
+    LIBDISCID_VERSION_STRING, FEATURES = _get_constants()
 
 
 # vim:set shiftwidth=4 smarttab expandtab:
@@ -0,0 +1,488 @@
+# Copyright (C) 2013  Johannes Dewender
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Please submit bug reports to GitHub:
+# https://github.com/JonnyJD/python-discid/issues
+"""Disc ID lookups with the MusicBrainz web service
+
+The client keeps its connections open between requests
+and spaces the requests to stay within the rate limit of the server.
+http.client, json and the other modules needed for requests
+are only imported when they are used, since they are slow to import.
+"""
+
+import time
+import threading
+from collections import deque
+
+DEFAULT_SERVER = "https://musicbrainz.org"
+_API_PATH = "/ws/2/discid/"
+# requests queued per connection by lookup_many
+_WINDOW_PER_CONNECTION = 2
+
+# how often the stub server checks whether it should stop
+_POLL_INTERVAL = 0.05
+
+_timer = getattr(time, "monotonic", time.time)
+
+
+class WebServiceError(IOError):
+    """The web service answered with an error.
+
+    `status` is the HTTP status code or :obj:`None`
+    when the answer was no valid HTTP.
+    """
+
+    def __init__(self, message, status=None):
+        IOError.__init__(self, message)
+        self.status = status
+
+
+class _Retry(Exception):
+    """The request should be repeated in the next free slot
+    """
+
+
+class RateLimiter(object):
+    """Hands out time slots for requests, at most `rate` per second.
+
+    The limiter is shared by all threads and coroutines using it,
+    so requests started while others are still running
+    use the slots in between and the rate is kept
+    even when a single request takes longer than a slot.
+    With a `rate` of :obj:`None` there is no limit.
+    """
+
+    def __init__(self, rate=1.0):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Reserves the next free slot
+        and returns the seconds until it starts.
+        """
+        with self._lock:
+            now = _timer()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+            return slot - now
+
+    def wait(self):
+        """Reserves the next free slot and sleeps until it starts.
+        """
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    def hold_off(self, delay):
+        """No slots start in the next `delay` seconds.
+        """
+        with self._lock:
+            self._next = max(self._next, _timer() + delay)
+
+
+class _ConnectionPool(object):
+    """Keep-alive HTTP connections to one server
+    """
+
+    def __init__(self, url, size, timeout):
+        # imported here, since urllib.parse is slow to import
+        from urllib.parse import urlsplit
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            raise ValueError("unsupported server URL: %s" % url)
+        self._https = parts.scheme == "https"
+        self._host = parts.hostname
+        self._port = parts.port
+        self.prefix = parts.path.rstrip("/")
+        self._size = size
+        self._timeout = timeout
+        self._idle = []
+        self._lock = threading.Lock()
+        self.opened = 0
+
+    def _connect(self):
+        import http.client
+        if self._https:
+            connection_class = http.client.HTTPSConnection
+        else:
+            connection_class = http.client.HTTPConnection
+        with self._lock:
+            self.opened += 1
+        return connection_class(self._host, self._port,
+                                timeout=self._timeout)
+
+    def request(self, path, headers):
+        """Sends a GET request on an idle or a new connection
+        and returns the status, the `Retry-After` header and the body.
+        """
+        import http.client
+        with self._lock:
+            connection = self._idle.pop() if self._idle else None
+        reused = connection is not None
+        if connection is None:
+            connection = self._connect()
+        try:
+            connection.request("GET", path, headers=headers)
+            response = connection.getresponse()
+            body = response.read()
+        except (http.client.HTTPException, OSError):
+            connection.close()
+            if not reused:
+                raise
+            # the server closed the idle connection in the meantime
+            return self.request(path, headers)
+        if response.will_close:
+            connection.close()
+        else:
+            with self._lock:
+                if len(self._idle) < self._size:
+                    self._idle.append(connection)
+                    connection = None
+            if connection is not None:
+                connection.close()
+        return response.status, response.getheader("Retry-After"), body
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            connection.close()
+
+
+def _default_user_agent():
+    import discid
+    return ("python-discid/%s ( https://github.com/JonnyJD/python-discid )"
+            % discid.__version__)
+
+def _retry_delay(retry_after, interval):
+    """The seconds to wait after a 503 answer
+    """
+    try:
+        return max(float(retry_after), interval)
+    except (TypeError, ValueError):
+        return max(interval, 1.0)
+
+
+class LookupClient(object):
+    """A client for disc ID lookups with the MusicBrainz web service.
+
+    `server` is the base URL of the server, which can be a mirror.
+    Up to `connections` connections are kept open and reused,
+    which is also the number of requests :meth:`lookup_many`
+    has running at the same time.
+    Requests are spaced to stay below `rate` requests per second,
+    the limit of musicbrainz.org.
+    Use a `rate` of :obj:`None` for servers without a limit,
+    or share a :class:`RateLimiter` between clients with `limiter`.
+    When the server answers with 503 (Service Unavailable),
+    the request is repeated up to `retries` times.
+
+    Set a `user_agent` naming your application,
+    as asked for by MusicBrainz.
+    The client can be used from several threads at once
+    and should be closed, for example with a `with` block.
+    """
+
+    def __init__(self, server=DEFAULT_SERVER, user_agent=None, rate=1.0,
+                 connections=2, timeout=30.0, retries=3, limiter=None):
+        self._pool = _ConnectionPool(server, connections, timeout)
+        self._limiter = limiter if limiter is not None else RateLimiter(rate)
+        self._connections = connections
+        self._retries = retries
+        self._headers = {"User-Agent": user_agent or _default_user_agent(),
+                         "Accept": "application/json"}
+        self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Closes the open connections.
+        """
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        self._pool.close()
+
+    def _path(self, disc, fuzzy, includes):
+        """The request path for a disc or disc ID
+        """
+        if hasattr(disc, "toc_string"):
+            disc_id = disc.id
+            toc = disc.toc_string if fuzzy else None
+        else:
+            disc_id, toc = disc, None
+        query = ["fmt=json"]
+        if toc:
+            query.append("toc=" + "+".join(toc.split()))
+        if includes:
+            query.append("inc=" + "+".join(includes))
+        return "%s%s%s?%s" % (self._pool.prefix, _API_PATH, disc_id,
+                              "&".join(query))
+
+    def _fetch(self, path):
+        import http.client
+        try:
+            return self._pool.request(path, self._headers)
+        except http.client.HTTPException as exc:
+            raise WebServiceError("invalid answer for %s: %r" % (path, exc))
+
+    def _result(self, path, response, attempt):
+        """The parsed answer or :obj:`None` for unknown discs.
+
+        :exc:`_Retry` is raised when the request should be repeated.
+        """
+        status, retry_after, body = response
+        if status == 200:
+            import json
+            return json.loads(body.decode("utf-8"))
+        if status == 404:
+            return None
+        if status in (429, 503) and attempt < self._retries:
+            self._limiter.hold_off(_retry_delay(retry_after,
+                                                self._limiter.interval))
+            raise _Retry()
+        raise WebServiceError("HTTP %d for %s" % (status, path), status)
+
+    def _lookup_path(self, path):
+        attempt = 0
+        while True:
+            self._limiter.wait()
+            try:
+                return self._result(path, self._fetch(path), attempt)
+            except _Retry:
+                attempt += 1
+
+    def lookup(self, disc, fuzzy=True, includes=None):
+        """Looks up a :class:`Disc`, a :class:`DiscSnapshot` or a disc ID
+        and returns the parsed JSON answer as a dictionary.
+
+        For discs the TOC is sent as well, unless `fuzzy` is unset.
+        When the disc ID is unknown, the server then answers with
+        the releases having a similar TOC instead,
+        so no second request is needed for the fallback.
+        `includes` is a list of additional data to include,
+        like `"recordings"` or `"artist-credits"`.
+        :obj:`None` is returned when nothing was found.
+
+        A :exc:`WebServiceError` is raised when the server
+        answers with an error.
+        """
+        return self._lookup_path(self._path(disc, fuzzy, includes))
+
+    def lookup_toc(self, toc_string, includes=None):
+        """Looks up the releases with a TOC similar to `toc_string`,
+        given as in :attr:`Disc.toc_string`.
+        """
+        query = ["fmt=json", "toc=" + "+".join(toc_string.split())]
+        if includes:
+            query.append("inc=" + "+".join(includes))
+        return self._lookup_path("%s%s-?%s" % (self._pool.prefix, _API_PATH,
+                                               "&".join(query)))
+
+    def lookup_many(self, discs, fuzzy=True, includes=None,
+                    return_exceptions=False):
+        """Looks up many discs or disc IDs
+        and yields the results of :meth:`lookup` in order.
+
+        Up to `connections` requests are running at the same time,
+        so the rate limit is reached even with slow answers.
+        Only a few discs are taken from `discs` ahead of the results,
+        so it can be a long iterator.
+        An exception ends the iteration,
+        with `return_exceptions` it is yielded instead.
+        """
+        if self._executor is None:
+            # imported here, since concurrent.futures is slow to import
+            from concurrent.futures import ThreadPoolExecutor
+            self._executor = ThreadPoolExecutor(
+                max_workers=self._connections,
+                thread_name_prefix="discid-lookup")
+        window = self._connections * _WINDOW_PER_CONNECTION
+        pending = deque()
+        iterator = iter(discs)
+        while True:
+            for disc in iterator:
+                pending.append(self._executor.submit(
+                    self.lookup, disc, fuzzy, includes))
+                if len(pending) >= window:
+                    break
+            if not pending:
+                return
+            future = pending.popleft()
+            try:
+                result = future.result()
+            except Exception as exc:
+                if not return_exceptions:
+                    for future in pending:
+                        future.cancel()
+                    raise
+                result = exc
+            yield result
+
+
+def _stub_handler():
+    """The request handler class of :class:`StubServer`
+    """
+    # imported here, since http.server is slow to import
+    from http.server import BaseHTTPRequestHandler
+
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # the headers and the body are written separately
+        disable_nagle_algorithm = True
+
+        def setup(self):
+            BaseHTTPRequestHandler.setup(self)
+            self.server.stub._count_connection()
+
+        def do_GET(self):
+            status, headers, body = self.server.stub._answer(self.path)
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in headers:
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return StubHandler
+
+
+class StubServer(object):
+    """A local stand-in for the disc ID lookups of the web service,
+    for tests and benchmarks.
+
+    Discs are made known with :meth:`add`.
+    Every answer is delayed by `latency` seconds.
+    With a `rate`, requests coming faster than that
+    are answered with 503 like musicbrainz.org does.
+    The server runs in a background thread
+    while in a `with` block or between :meth:`start` and :meth:`stop`,
+    the base URL for :class:`LookupClient` is then in `url`.
+    `requests` and `connections` count what the server received.
+    """
+
+    def __init__(self, latency=0.0, rate=None):
+        self.latency = latency
+        self.rate = rate
+        self.url = None
+        self.requests = 0
+        self.connections = 0
+        self._discs = {}
+        self._tocs = {}
+        self._last_request = None
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def add(self, disc, releases=()):
+        """Makes a :class:`Disc` or :class:`DiscSnapshot` known
+        with a list of release dictionaries.
+
+        The releases are also found by the TOC of the disc.
+        """
+        releases = list(releases)
+        self._discs[disc.id] = {
+            "id": disc.id, "sectors": disc.sectors,
+            "offset-count": len(disc.tracks),
+            "offsets": [track.offset for track in disc.tracks],
+            "releases": releases}
+        self._tocs[disc.toc_string] = releases
+
+    def start(self):
+        """Starts serving on a free port of the loopback interface.
+        """
+        # imported here, since these are slow to import
+        import socketserver
+        from http.server import HTTPServer
+
+        class Server(socketserver.ThreadingMixIn, HTTPServer):
+            daemon_threads = True
+
+        self._server = Server(("127.0.0.1", 0), _stub_handler())
+        self._server.stub = self
+        self.url = "http://127.0.0.1:%d" % self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        args=(_POLL_INTERVAL, ),
+                                        name="discid-stub-server")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stops the server.
+        """
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+        self._server = None
+
+    def _count_connection(self):
+        with self._lock:
+            self.connections += 1
+
+    def _answer(self, path):
+        """The status, additional headers and body for a request
+        """
+        import json
+        from urllib.parse import urlsplit, parse_qs
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.requests += 1
+            now = _timer()
+            too_fast = (self.rate and self._last_request is not None
+                        and now - self._last_request < 0.9 / self.rate)
+            if not too_fast:
+                self._last_request = now
+        if too_fast:
+            return 503, [("Retry-After", "%g" % (1.0 / self.rate))], \
+                json.dumps({"error": "rate limit exceeded"}).encode("utf-8")
+        parts = urlsplit(path)
+        query = parse_qs(parts.query)
+        if not parts.path.startswith(_API_PATH):
+            return 400, [], b'{"error": "unsupported request"}'
+        disc_id = parts.path[len(_API_PATH):]
+        if disc_id in self._discs:
+            answer = self._discs[disc_id]
+        elif "toc" in query:
+            # "+" is decoded as a space
+            toc = " ".join(query["toc"][0].split())
+            releases = self._tocs.get(toc, [])
+            answer = {"release-count": len(releases), "release-offset": 0,
+                      "releases": releases}
+        else:
+            return 404, [], b'{"error": "Not Found"}'
+        return 200, [], json.dumps(answer).encode("utf-8")
+
+
+# vim:set shiftwidth=4 smarttab expandtab:
@@ -0,0 +1,117 @@
+# Copyright (C) 2013  Johannes Dewender
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Please submit bug reports to GitHub:
+# https://github.com/JonnyJD/python-discid/issues
+"""Parsers for TOC strings and CDDB query strings
+"""
+
+from collections import namedtuple
+
+from discid.disc import put, TOCError
+
+
+CDDBQuery = namedtuple("CDDBQuery",
+                       ["freedb_id", "track_count", "offsets", "seconds"])
+
+ParseResult = namedtuple("ParseResult",
+                         ["line_number", "line", "value", "error"])
+
+
+def _split_numbers(string, what):
+    """Split a string into integers, raising :exc:`TOCError` on failure
+    """
+    try:
+        return [int(part) for part in string.split()]
+    except ValueError:
+        raise TOCError("malformed %s: %r" % (what, string))
+
+def from_toc_string(toc_string, engine=None):
+    """Creates a :class:`Disc` from a TOC string
+    as given by :attr:`Disc.toc_string`.
+
+    The `engine` is the same as for :func:`put`.
+    A :exc:`TOCError` is raised when the string is malformed.
+    """
+    numbers = _split_numbers(toc_string, "TOC string")
+    if len(numbers) < 4:
+        raise TOCError("malformed TOC string: %r" % toc_string)
+    first, last, disc_sectors = numbers[:3]
+    return put(first, last, disc_sectors, numbers[3:], engine=engine)
+
+def from_cddb_query(query):
+    """Parses a CDDB query string as given by :attr:`Disc.cddb_query_string`
+    and returns a :class:`CDDBQuery`.
+
+    A leading `cddb query` command is ignored.
+    The disc sectors are not part of the query,
+    so no :class:`Disc` can be created from it.
+    A :exc:`TOCError` is raised when the string is malformed.
+    """
+    parts = query.split()
+    if parts[:2] == ["cddb", "query"]:
+        parts = parts[2:]
+    if len(parts) < 4:
+        raise TOCError("malformed CDDB query: %r" % query)
+    freedb_id = parts[0].lower()
+    try:
+        if len(freedb_id) != 8:
+            raise ValueError(freedb_id)
+        int(freedb_id, 16)
+    except ValueError:
+        raise TOCError("malformed FreeDB ID in CDDB query: %r" % query)
+    numbers = _split_numbers(" ".join(parts[1:]), "CDDB query")
+    track_count, offsets, seconds = numbers[0], numbers[1:-1], numbers[-1]
+    if len(offsets) != track_count:
+        raise TOCError("Invalid number of track offsets in CDDB query: %r"
+                       % query)
+    return CDDBQuery(freedb_id, track_count, offsets, seconds)
+
+def _parse_lines(lines, parse):
+    """Apply `parse` to every non-empty line, yielding a :class:`ParseResult`
+    """
+    for line_number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            value = parse(line)
+        except TOCError as exc:
+            yield ParseResult(line_number, line, None, exc)
+        else:
+            yield ParseResult(line_number, line, value, None)
+
+def parse_toc_strings(lines, engine=None):
+    """Parses TOC strings line by line with :func:`from_toc_string`.
+
+    `lines` is any iterable of strings, like an open file.
+    This is a generator yielding a :class:`ParseResult` for every
+    non-empty line, so only one line is in memory at a time.
+    The `value` is a :class:`Disc` or :obj:`None`
+    when the line is malformed, with the :exc:`TOCError` as `error`.
+    """
+    return _parse_lines(lines,
+                        lambda line: from_toc_string(line, engine=engine))
+
+def parse_cddb_queries(lines):
+    """Parses CDDB query strings line by line with :func:`from_cddb_query`.
+
+    This works like :func:`parse_toc_strings`,
+    but the `value` is a :class:`CDDBQuery`.
+    """
+    return _parse_lines(lines, from_cddb_query)
+
+
+# vim:set shiftwidth=4 smarttab expandtab:
@@ -0,0 +1,141 @@
+# Copyright (C) 2013  Johannes Dewender
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Please submit bug reports to GitHub:
+# https://github.com/JonnyJD/python-discid/issues
+"""Pool of reusable libdiscid handles
+"""
+
+import threading
+from ctypes import c_void_p
+
+from discid.libdiscid import _LIB
+from discid.disc import Disc
+
+
+class HandlePool(object):
+    """A thread-safe pool of libdiscid handles reused by :meth:`put`.
+
+    At most `maxsize` handles exist at the same time.
+    When all of them are in use, :meth:`put` waits for a free one.
+    """
+
+    def __init__(self, maxsize=8):
+        self._maxsize = maxsize
+        self._idle = []
+        self._in_use = 0
+        self._closed = False
+        self._condition = threading.Condition()
+        self._stats = {"created": 0, "reused": 0, "freed": 0, "waits": 0}
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1")
+
+    def _acquire(self, timeout=None):
+        """Check out a handle, allocating one when none is idle.
+        """
+        with self._condition:
+            if self._closed:
+                raise ValueError("HandlePool is closed")
+            if not self._idle and self._in_use >= self._maxsize:
+                self._stats["waits"] += 1
+                available = lambda: self._idle or self._in_use < self._maxsize
+                if not self._condition.wait_for(available, timeout):
+                    raise RuntimeError("no libdiscid handle available")
+            self._in_use += 1
+            if self._idle:
+                self._stats["reused"] += 1
+                return self._idle.pop()
+            self._stats["created"] += 1
+        handle = None
+        try:
+            handle = c_void_p(_LIB.discid_new())
+        finally:
+            if handle is None:
+                # give the slot back, also on KeyboardInterrupt
+                with self._condition:
+                    self._in_use -= 1
+                    self._stats["created"] -= 1
+                    self._condition.notify()
+        assert handle.value is not None
+        return handle
+
+    def _release(self, handle):
+        """Check a handle back in, freeing it when the pool is closed.
+        """
+        with self._condition:
+            self._in_use -= 1
+            if not self._closed:
+                self._idle.append(handle)
+                handle = None
+            else:
+                self._stats["freed"] += 1
+            self._condition.notify()
+        if handle is not None:
+            _LIB.discid_free(handle)
+
+    def put(self, first, last, disc_sectors, track_offsets, timeout=None):
+        """Creates a TOC like :func:`put` using a handle from the pool
+        and returns a :class:`DiscSnapshot`.
+
+        All data is copied out of libdiscid
+        before the handle is given back to the pool.
+        A :exc:`RuntimeError` is raised when no handle is available
+        within `timeout` seconds.
+        """
+        handle = self._acquire(timeout)
+        disc = Disc._from_handle(handle)
+        try:
+            disc.put(first, last, disc_sectors, track_offsets)
+            return disc._snapshot()
+        finally:
+            disc._detach()
+            self._release(handle)
+
+    def stats(self):
+        """Statistics for the pool as a :obj:`dict`.
+
+        The values are the `maxsize`, the handles currently `idle`
+        and `in_use` and the counts of handles `created`, `reused`
+        and `freed` as well as the number of `waits` for a free handle.
+        """
+        with self._condition:
+            stats = dict(self._stats)
+            stats["maxsize"] = self._maxsize
+            stats["idle"] = len(self._idle)
+            stats["in_use"] = self._in_use
+        return stats
+
+    def close(self):
+        """Free all idle handles,
+        handles in use are freed when they are given back.
+        """
+        with self._condition:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._stats["freed"] += len(idle)
+        for handle in idle:
+            _LIB.discid_free(handle)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __del__(self):
+        self.close()
+
+
+# vim:set shiftwidth=4 smarttab expandtab:
@@ -0,0 +1,492 @@
+# Copyright (C) 2013  Johannes Dewender
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Please submit bug reports to GitHub:
+# https://github.com/JonnyJD/python-discid/issues
+"""TOCs from the files of rips: CUE sheets, EAC and XLD logs
+and cdrdao TOC files, and a walker for whole directories of rips
+"""
+
+import os
+import time
+import struct
+from collections import namedtuple
+
+from discid.disc import TOCError
+from discid.engine import _check_toc, _LEAD_IN, disc_id
+from discid.batch import _freedb_id
+from discid.util import _imap_bounded
+
+
+# the lead-out of the audio session is this far before a data track
+_DATA_TRACK_GAP = 11400
+_SAMPLES_PER_SECTOR = 588
+_RAW_SECTOR_SIZE = 2352
+# user data per sector of cdrdao data files, raw modes use 2352 bytes
+_SECTOR_SIZES = {"MODE1": 2048, "MODE2": 2336, "MODE2_FORM1": 2048,
+                 "MODE2_FORM2": 2324, "MODE2_FORM_MIX": 2336}
+_EXTENSIONS = (".cue", ".log", ".toc")
+# seconds between the writes of the checkpoint file while scanning
+_CHECKPOINT_INTERVAL = 5.0
+
+# regular expressions, compiled when they are used
+_CUE_WORDS = r'"([^"]*)"|(\S+)'
+_LOG_ROW = (r"\s*(\d+)\s*\|\s*[\d:.]+\s*\|\s*[\d:.]+\s*\|"
+            r"\s*(\d+)\s*\|\s*(\d+)")
+_TOC_TOKENS = r'"(?:[^"\\]|\\.)*"|//[^\n]*|[{}]|[^\s{}"]+'
+_TOC_TIME = r"\d+(:\d+:\d+)?$"
+
+RipResult = namedtuple("RipResult",
+                       ["path", "toc", "id", "freedb_id", "error"])
+
+
+def _msf(string):
+    """Sectors from a time in the form MM:SS:FF
+    """
+    minutes, seconds, frames = [int(part) for part in string.split(":")]
+    if seconds >= 60 or frames >= 75:
+        raise ValueError("invalid time: %s" % string)
+    return (minutes * 60 + seconds) * 75 + frames
+
+def _audio_toc(tracks, leadout):
+    """The TOC for :func:`put` from `(number, offset, audio, start)`
+    for every track and the lead-out of the last track.
+    `start` is where the area of the track begins, before its pregap.
+    All of them include the lead-in.
+
+    A data track before the audio tracks stays in the TOC,
+    like libdiscid reads a Mixed Mode CD.
+    Data tracks after the audio tracks are left out,
+    the audio tracks end where the first of them starts.
+    When its pregap holds the 11400 sectors between the sessions
+    of an Enhanced CD, they end 11400 sectors before its offset.
+    """
+    audio = [track for track in tracks if track[2]]
+    if not audio:
+        raise TOCError("no audio tracks")
+    last = audio[-1][0]
+    kept = [track for track in tracks if track[0] <= last]
+    if any(not track[2] for track in kept if track[0] > audio[0][0]):
+        raise TOCError("data track between audio tracks")
+    first = kept[0][0]
+    if last - first + 1 != len(kept):
+        raise TOCError("missing track numbers")
+    following = [(offset, start) for number, offset, _, start in tracks
+                 if number > last]
+    if following:
+        offset, start = following[0]
+        if offset - start >= _DATA_TRACK_GAP:
+            leadout = offset - _DATA_TRACK_GAP
+        else:
+            leadout = offset
+    offsets = [track[1] for track in kept]
+    error = _check_toc(first, last, leadout, offsets)
+    if error is not None:
+        raise TOCError(error)
+    return first, last, leadout, offsets
+
+def _read_text(path):
+    """The text of a file, EAC writes UTF-16 and older tools Latin-1
+    """
+    with open(path, "rb") as stream:
+        data = stream.read()
+    if data.startswith((b"\xff\xfe", b"\xfe\xff")):
+        return data.decode("utf-16")
+    try:
+        return data.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        return data.decode("latin-1")
+
+def _wav_sectors(stream):
+    """The length of a 44.1 kHz WAV file in sectors
+    """
+    stream.seek(12)
+    block_align = None
+    while True:
+        header = stream.read(8)
+        if len(header) < 8:
+            raise TOCError("no audio data in WAV file")
+        name, size = struct.unpack("<4sI", header)
+        if name == b"fmt ":
+            fmt = stream.read(size + size % 2)
+            rate, _, block_align = struct.unpack("<IIH", fmt[4:14])
+            if rate != 44100:
+                raise TOCError("sample rate %d is not 44100" % rate)
+        elif name == b"data":
+            if block_align is None:
+                raise TOCError("no format chunk before the WAV data")
+            return size // block_align // _SAMPLES_PER_SECTOR
+        else:
+            stream.seek(size + size % 2, 1)
+
+def _flac_sectors(stream):
+    """The length of a 44.1 kHz FLAC file in sectors
+    """
+    # STREAMINFO is the first metadata block, the sample rate
+    # and sample count are packed into bits 80 to 143 of it
+    info = stream.read(42)[8:]
+    packed = struct.unpack(">Q", info[10:18])[0]
+    rate = packed >> 44
+    if rate != 44100:
+        raise TOCError("sample rate %d is not 44100" % rate)
+    return (packed & (1 << 36) - 1) // _SAMPLES_PER_SECTOR
+
+def file_sectors(path, file_type="WAVE"):
+    """The length in sectors of a file referenced by a CUE sheet
+    or a cdrdao TOC file.
+
+    `WAVE` files have to be WAV or FLAC files with 44.1 kHz,
+    cdrdao `AUDIO` files can be raw samples as well.
+    For other types the size is divided by the sector size,
+    which is 2352 bytes for raw images like `BINARY` files.
+    """
+    file_type = file_type.upper()
+    if file_type not in ("WAVE", "AUDIO"):
+        sector_size = _SECTOR_SIZES.get(file_type, _RAW_SECTOR_SIZE)
+        return os.path.getsize(path) // sector_size
+    with open(path, "rb") as stream:
+        magic = stream.read(12)
+        if magic.startswith(b"RIFF") and magic[8:] == b"WAVE":
+            return _wav_sectors(stream)
+        elif magic.startswith(b"fLaC"):
+            stream.seek(0)
+            return _flac_sectors(stream)
+    if file_type == "AUDIO":
+        return os.path.getsize(path) // _RAW_SECTOR_SIZE
+    raise TOCError("unknown length of %s, only WAV and FLAC are supported"
+                   % path)
+
+def _file_length(lengths, name, file_type):
+    if lengths is None:
+        raise TOCError("the length of %s is needed" % name)
+    if callable(lengths):
+        return lengths(name, file_type)
+    try:
+        return lengths[name]
+    except KeyError:
+        raise TOCError("the length of %s is needed" % name)
+
+def parse_cue(text, lengths=None):
+    """The TOC of a CUE sheet as `(first, last, sectors, offsets)`,
+    the arguments for :func:`put`.
+
+    The tracks start at their `INDEX 01`,
+    the lead-out is the end of the last `FILE`.
+    `lengths` gives the length in sectors of the files:
+    either a dictionary by the file names in the sheet
+    or a function called with the name and type of a file.
+    The lengths of all but the last file are only needed
+    when the sheet has several files.
+
+    Trailing data tracks are left out, see :func:`put` for the lead-out.
+    A :exc:`TOCError` is raised for malformed sheets.
+    """
+    # imported here, since re is slow to import
+    import re
+    split_words = re.compile(_CUE_WORDS).findall
+    tracks = []
+    file_name = file_type = track = None
+    file_start = inserted = 0
+    # where the current track begins, known from INDEX 00, PREGAP or FILE
+    track_starts = []
+    for line_number, line in enumerate(text.splitlines(), 1):
+        words = [quoted or word for quoted, word in split_words(line)]
+        if not words:
+            continue
+        command = words[0].upper()
+        try:
+            if command == "FILE":
+                if file_name is not None:
+                    file_start += _file_length(lengths, file_name, file_type)
+                file_name = words[1]
+                file_type = words[2].upper() if len(words) > 2 else "WAVE"
+                track_starts.append(_LEAD_IN + file_start + inserted)
+            elif command == "TRACK":
+                track = (int(words[1]), words[2].upper() == "AUDIO")
+            elif command in ("PREGAP", "POSTGAP"):
+                # silence that isn't in the files
+                if command == "PREGAP":
+                    track_starts.append(_LEAD_IN + file_start + inserted)
+                inserted += _msf(words[1])
+            elif command == "INDEX":
+                if track is None or file_name is None:
+                    raise ValueError("INDEX before TRACK or FILE")
+                position = _LEAD_IN + file_start + inserted + _msf(words[2])
+                if int(words[1]) == 0:
+                    track_starts.append(position)
+                elif int(words[1]) == 1:
+                    tracks.append((track[0], position, track[1],
+                                   min(track_starts + [position])))
+                    track_starts = []
+        except (ValueError, IndexError):
+            raise TOCError("malformed line %d of the CUE sheet: %r"
+                           % (line_number, line))
+    if not tracks:
+        raise TOCError("no tracks in the CUE sheet")
+    leadout = (_LEAD_IN + file_start + inserted
+               + _file_length(lengths, file_name, file_type))
+    return _audio_toc(tracks, leadout)
+
+def parse_log(text):
+    """The TOC in an EAC or XLD log as `(first, last, sectors, offsets)`,
+    the arguments for :func:`put`.
+
+    The first TOC table in the log is used.
+    A data track is recognized by the gap of 11400 sectors before it
+    and left out, see :func:`put`.
+    A :exc:`TOCError` is raised when there is no TOC table.
+    """
+    import re
+    row_pattern = re.compile(_LOG_ROW)
+    rows = []
+    for line in text.splitlines():
+        match = row_pattern.match(line)
+        if match:
+            rows.append([int(group) for group in match.groups()])
+        elif rows:
+            break
+    if not rows:
+        raise TOCError("no TOC table in the log")
+    tracks = []
+    audio = True
+    previous_end = -1
+    for number, start, end in rows:
+        if start - previous_end - 1 >= _DATA_TRACK_GAP:
+            audio = False
+        tracks.append((number, _LEAD_IN + start, audio,
+                       _LEAD_IN + previous_end + 1))
+        previous_end = end
+    return _audio_toc(tracks, _LEAD_IN + rows[-1][2] + 1)
+
+def _toc_time(token):
+    """Sectors from a cdrdao time, MM:SS:FF or a number of samples
+    """
+    if ":" in token:
+        return _msf(token)
+    return int(token) // _SAMPLES_PER_SECTOR
+
+def parse_cdrdao_toc(text, lengths=None):
+    """The TOC in a cdrdao TOC file as `(first, last, sectors, offsets)`,
+    the arguments for :func:`put`.
+
+    The tracks start after their `PREGAP` or at `START`.
+    `lengths` is like for :func:`parse_cue`, it is only needed
+    for files without a length in the TOC file.
+    Trailing data tracks are left out, see :func:`put` for the lead-out.
+    A :exc:`TOCError` is raised for malformed TOC files.
+    """
+    import re
+    is_time = re.compile(_TOC_TIME).match
+    tokens = [token for token in re.findall(_TOC_TOKENS, text)
+              if not token.startswith("//")]
+    tracks = []
+    track = None
+    position = 0
+    index = 0
+    try:
+        while index < len(tokens):
+            token = tokens[index]
+            index += 1
+            word = token.upper()
+            if token == "{":
+                # skip CD-TEXT
+                depth = 1
+                while depth:
+                    depth += {"{": 1, "}": -1}.get(tokens[index], 0)
+                    index += 1
+            elif word == "TRACK":
+                if track is not None:
+                    tracks.append(tuple(track))
+                mode = tokens[index].upper()
+                index += 1
+                track = [len(tracks) + 1, _LEAD_IN + position,
+                         mode == "AUDIO", _LEAD_IN + position, mode]
+            elif track is None:
+                continue
+            elif word in ("FILE", "AUDIOFILE", "DATAFILE"):
+                name = tokens[index].strip('"')
+                index += 1
+                if tokens[index].startswith("#"):
+                    index += 1
+                start = 0
+                if word != "DATAFILE":
+                    start = _toc_time(tokens[index])
+                    index += 1
+                if index < len(tokens) and is_time(tokens[index]):
+                    position += _toc_time(tokens[index])
+                    index += 1
+                else:
+                    position += (_file_length(lengths, name, track[4])
+                                 - start)
+            elif word in ("SILENCE", "ZERO", "PREGAP"):
+                while not is_time(tokens[index]):
+                    # data mode and sub-channel mode of ZERO
+                    index += 1
+                length = _toc_time(tokens[index])
+                index += 1
+                if word == "PREGAP":
+                    track[1] += length
+                position += length
+            elif word == "START":
+                if index < len(tokens) and is_time(tokens[index]):
+                    track[1] += _toc_time(tokens[index])
+                    index += 1
+                else:
+                    track[1] = _LEAD_IN + position
+    except (ValueError, IndexError):
+        raise TOCError("malformed TOC file near token %d" % index)
+    if track is None:
+        raise TOCError("no tracks in the TOC file")
+    tracks.append(tuple(track))
+    return _audio_toc([track[:4] for track in tracks], _LEAD_IN + position)
+
+def read_rip(path):
+    """The TOC of a rip as `(first, last, sectors, offsets)`
+    from a CUE sheet (`.cue`), an EAC or XLD log (`.log`)
+    or a cdrdao TOC file (`.toc`), by the extension of the `path`.
+
+    Files referenced by CUE sheets and TOC files are looked up
+    relative to the directory of `path`, see :func:`file_sectors`.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    text = _read_text(path)
+    if extension == ".log":
+        return parse_log(text)
+    directory = os.path.dirname(path)
+    def lengths(name, file_type):
+        return file_sectors(os.path.join(directory, name), file_type)
+    if extension == ".cue":
+        return parse_cue(text, lengths)
+    elif extension == ".toc":
+        return parse_cdrdao_toc(text, lengths)
+    raise ValueError("unknown rip file type: %s" % path)
+
+
+def _walk(directory, parts, after, extensions):
+    """Yields the paths of the rip files below `directory`
+    as tuples of names in sorted order, starting after the tuple `after`
+    """
+    try:
+        entries = sorted(os.scandir(os.path.join(directory, *parts)),
+                         key=lambda entry: entry.name)
+    except OSError:
+        return
+    for entry in entries:
+        path = parts + (entry.name, )
+        below = None
+        if after is not None:
+            if path < after[:len(path)] or path == after:
+                continue
+            if path == after[:len(path)]:
+                # a directory containing the checkpoint
+                below = after
+        if entry.is_dir(follow_symlinks=False):
+            for result in _walk(directory, path, below, extensions):
+                yield result
+        elif os.path.splitext(entry.name)[1].lower() in extensions:
+            yield path
+
+def _chunks(directory, paths, chunksize):
+    chunk = []
+    for path in paths:
+        chunk.append(path)
+        if len(chunk) >= chunksize:
+            yield directory, chunk
+            chunk = []
+    if chunk:
+        yield directory, chunk
+
+def _scan_chunk(args):
+    """Read a chunk of rips, this runs in the worker processes
+    """
+    directory, paths = args
+    results = []
+    for parts in paths:
+        path = os.path.join(directory, *parts)
+        try:
+            toc = read_rip(path)
+        except (TOCError, ValueError, EnvironmentError) as exc:
+            result = RipResult(path, None, None, None,
+                               "%s: %s" % (type(exc).__name__, exc))
+        else:
+            result = RipResult(path, toc, disc_id(*toc), _freedb_id(*toc),
+                               None)
+        results.append((parts, result))
+    return results
+
+def _load_checkpoint(checkpoint):
+    import json
+    try:
+        with open(checkpoint) as stream:
+            return tuple(json.load(stream)["after"])
+    except (IOError, OSError):
+        return None
+    except (ValueError, KeyError, TypeError):
+        # a checkpoint cut short by a crash, start from the beginning
+        return None
+
+def _save_checkpoint(checkpoint, parts):
+    import json
+    temporary = checkpoint + ".tmp"
+    with open(temporary, "w") as stream:
+        json.dump({"after": list(parts)}, stream)
+    os.replace(temporary, checkpoint)
+
+def scan_rips(directory, workers=None, checkpoint=None,
+              extensions=_EXTENSIONS, chunksize=100):
+    """Yields a :class:`RipResult` for every rip file below `directory`,
+    see :func:`read_rip`, in the order of the sorted paths.
+
+    The files are read by `workers` processes,
+    which defaults to the number of CPUs.
+    Only a few chunks of `chunksize` files are in flight at a time,
+    so the memory needed doesn't grow with the number of files.
+
+    With a `checkpoint` file the path of the last result taken
+    is saved every few seconds and when the generator is closed.
+    A later scan with the same file continues after that path,
+    after a crash some results may be yielded again.
+    """
+    extensions = tuple(extension.lower() for extension in extensions)
+    after = _load_checkpoint(checkpoint) if checkpoint else None
+    tasks = _chunks(directory, _walk(directory, (), after, extensions),
+                    chunksize)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers == 1:
+        pool = None
+        chunks = map(_scan_chunk, tasks)
+    else:
+        import multiprocessing
+        pool = multiprocessing.Pool(workers)
+        chunks = _imap_bounded(pool, _scan_chunk, tasks, 2 * workers, True)
+    last = None
+    saved = time.time()
+    try:
+        for chunk in chunks:
+            for parts, result in chunk:
+                last = parts
+                yield result
+            if checkpoint and time.time() - saved >= _CHECKPOINT_INTERVAL:
+                _save_checkpoint(checkpoint, last)
+                saved = time.time()
+    finally:
+        if pool is not None:
+            pool.terminate()
+        if checkpoint and last is not None:
+            _save_checkpoint(checkpoint, last)
+
+
+# vim:set shiftwidth=4 smarttab expandtab:
@@ -0,0 +1,257 @@
+# Copyright (C) 2013  Johannes Dewender
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Please submit bug reports to GitHub:
+# https://github.com/JonnyJD/python-discid/issues
+"""Immutable snapshots of Disc and Track objects
+"""
+
+from discid.util import _sectors_to_seconds
+import discid.engine
+
+
+class _Frozen(object):
+    """Base class for objects that can't be changed after creation
+    """
+    __slots__ = ()
+
+    def __setattr__(self, name, value):
+        raise AttributeError("%s is immutable" % type(self).__name__)
+
+    def __delattr__(self, name):
+        raise AttributeError("%s is immutable" % type(self).__name__)
+
+
+class TrackSnapshot(_Frozen):
+    """An immutable copy of a :class:`Track`, part of :class:`DiscSnapshot`.
+    """
+    __slots__ = ("_number", "_offset", "_sectors", "_seconds", "_isrc")
+
+    def __init__(self, number, offset, sectors, isrc=None):
+        set_field = object.__setattr__
+        set_field(self, "_number", number)
+        set_field(self, "_offset", offset)
+        set_field(self, "_sectors", sectors)
+        set_field(self, "_seconds", _sectors_to_seconds(sectors))
+        set_field(self, "_isrc", isrc)
+
+    def __str__(self):
+        return str(self._number)
+
+    def __repr__(self):
+        return "<TrackSnapshot %d>" % self._number
+
+    def __reduce__(self):
+        return (TrackSnapshot, (self._number, self._offset, self._sectors,
+                                self._isrc))
+
+    def __eq__(self, other):
+        if not isinstance(other, TrackSnapshot):
+            return NotImplemented
+        return ((self._number, self._offset, self._sectors)
+                == (other._number, other._offset, other._sectors))
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    def __hash__(self):
+        return hash((self._number, self._offset, self._sectors))
+
+    @property
+    def number(self):
+        """The track number"""
+        return self._number
+
+    @property
+    def offset(self):
+        """The track offset"""
+        return self._offset
+
+    @property
+    def sectors(self):
+        """The track length in sectors"""
+        return self._sectors
+
+    length = sectors
+    """This is an alias for :attr:`sectors`"""
+
+    @property
+    def seconds(self):
+        """Track length in seconds"""
+        return self._seconds
+
+    @property
+    def isrc(self):
+        """The International Standard Recording Code or :obj:`None`"""
+        return self._isrc
+
+
+class DiscSnapshot(_Frozen):
+    """An immutable copy of a :class:`Disc`
+    as returned by :meth:`Disc.snapshot`.
+
+    All attributes of :class:`Disc` are available
+    and served from plain Python values,
+    without any calls into libdiscid.
+    """
+    __slots__ = ("_id", "_freedb_id", "_submission_url", "_toc_string",
+                 "_first", "_last", "_sectors", "_seconds", "_mcn",
+                 "_tracks", "_cddb_query_string", "_key", "_hash")
+
+    def __init__(self, first, last, sectors, offsets, id, freedb_id,
+                 submission_url=None, toc_string=None, mcn=None, isrcs=None):
+        set_field = object.__setattr__
+        set_field(self, "_id", id)
+        set_field(self, "_freedb_id", freedb_id)
+        set_field(self, "_submission_url", submission_url)
+        set_field(self, "_toc_string", toc_string)
+        set_field(self, "_first", first)
+        set_field(self, "_last", last)
+        set_field(self, "_sectors", sectors)
+        set_field(self, "_seconds", _sectors_to_seconds(sectors))
+        set_field(self, "_mcn", mcn)
+
+        if isrcs is None:
+            isrcs = [None] * len(offsets)
+        ends = list(offsets[1:]) + [sectors]
+        tracks = tuple([TrackSnapshot(number, offset, end - offset, isrc)
+                        for number, offset, end, isrc
+                        in zip(range(first, last + 1), offsets, ends, isrcs)])
+        set_field(self, "_tracks", tracks)
+        key = (first, last, sectors, tuple(offsets))
+        set_field(self, "_key", key)
+        set_field(self, "_hash", hash(key))
+        set_field(self, "_cddb_query_string", "%s %s %s %s" % (
+            freedb_id, last, " ".join(map(str, offsets)), self._seconds))
+
+    def __str__(self):
+        return self._id
+
+    def _toc_key(self):
+        """The TOC as `(first, last, sectors, offsets)`
+        used for comparisons and hashing
+        """
+        return self._key
+
+    def __eq__(self, other):
+        """Snapshots are equal when they have the same TOC,
+        which is also true compared to a :class:`Disc`.
+        """
+        if not isinstance(other, DiscSnapshot):
+            # a Disc compares itself to snapshots
+            return NotImplemented
+        return self._key == other._key
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    def __hash__(self):
+        return self._hash
+
+    def __reduce__(self):
+        return (DiscSnapshot, (
+            self._first, self._last, self._sectors,
+            [track._offset for track in self._tracks], self._id,
+            self._freedb_id, self._submission_url, self._toc_string,
+            self._mcn, [track._isrc for track in self._tracks]))
+
+    def __repr__(self):
+        return "<DiscSnapshot %s>" % self._id
+
+    @property
+    def id(self):
+        """This is the MusicBrainz :musicbrainz:`Disc ID`"""
+        return self._id
+
+    @property
+    def freedb_id(self):
+        """This is the :musicbrainz:`FreeDB` Disc ID (without category)"""
+        return self._freedb_id
+
+    @property
+    def submission_url(self):
+        """Disc ID / TOC Submission URL for MusicBrainz"""
+        return self._submission_url
+
+    @property
+    def toc_string(self):
+        """The TOC suitable as value of the `toc parameter`
+        when accessing the MusicBrainz Web Service.
+        """
+        return self._toc_string
+
+    @property
+    def first_track_num(self):
+        """Number of the first track"""
+        return self._first
+
+    @property
+    def last_track_num(self):
+        """Number of the last **audio** track"""
+        return self._last
+
+    @property
+    def sectors(self):
+        """Total length in sectors"""
+        return self._sectors
+
+    length = sectors
+    """This is an alias for :attr:`sectors`"""
+
+    @property
+    def seconds(self):
+        """Total length in seconds"""
+        return self._seconds
+
+    @property
+    def mcn(self):
+        """This is the Media Catalogue Number (MCN/UPC/EAN) or :obj:`None`"""
+        return self._mcn
+
+    @property
+    def tracks(self):
+        """A tuple of :class:`TrackSnapshot` objects for this disc.
+        """
+        return self._tracks
+
+    @property
+    def cddb_query_string(self):
+        """A CDDB query string suitable for querying CDDB servers."""
+        return self._cddb_query_string
+
+    @property
+    def accuraterip_id(self):
+        """The AccurateRip disc ID"""
+        return discid.engine.accuraterip_id(*self._key,
+                                            cddb_id=self._freedb_id)
+
+    @property
+    def accuraterip_url(self):
+        """The URL of the AccurateRip results for this disc"""
+        return discid.engine.accuraterip_url(*self._key)
+
+    @property
+    def ctdb_id(self):
+        """The TOC ID of the CUETools database (CTDB)"""
+        return discid.engine.ctdb_id(*self._key)
+
+
+# vim:set shiftwidth=4 smarttab expandtab:
@@ -0,0 +1,311 @@
+# Copyright (C) 2013  Johannes Dewender
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Please submit bug reports to GitHub:
+# https://github.com/JonnyJD/python-discid/issues
+"""A compact binary file format for TOCs
+
+The file starts with a magic string giving the byte order,
+followed by the records as 32 bit integers,
+an index with the position of every record
+and a trailer with the number of records and the position of the index.
+
+A record is a header with the first and last track number and flags,
+the disc sectors, the track offsets
+and optionally the 20 bytes of the SHA-1 digest the disc ID encodes.
+"""
+
+import os
+import sys
+import mmap
+import hashlib
+import binascii
+from array import array
+from collections import namedtuple
+
+from discid.disc import TOCError
+from discid.engine import _check_toc, _hash_input, _encode_digest
+
+TOCRecord = namedtuple("TOCRecord", ["first", "last", "sectors", "offsets",
+                                     "id"])
+
+_MAGIC = {"little": b"DISCIDSl", "big": b"DISCIDSb"}
+_TRAILER_SIZE = 16 + 8
+_HAS_ID = 1
+# integers for the digest
+_DIGEST_INTS = 5
+# records buffered by the writer before they are written
+_BUFFER_INTS = 1 << 16
+
+_B64_DECODE = bytes.maketrans(b"._-", b"+/=") \
+        if hasattr(bytes, "maketrans") else None
+
+
+def _decode_id(disc_id):
+    """The SHA-1 digest encoded in a disc ID
+    """
+    encoded = disc_id.encode("ascii")
+    if _B64_DECODE is not None:
+        encoded = encoded.translate(_B64_DECODE)
+    else:
+        encoded = encoded.replace(b".", b"+").replace(b"_", b"/")
+        encoded = encoded.replace(b"-", b"=")
+    digest = binascii.a2b_base64(encoded)
+    if len(digest) != 20:
+        raise ValueError("invalid disc ID: %s" % disc_id)
+    return digest
+
+def _read_trailer(head, tail, path):
+    """Get the record count and the index position
+    from the start and the last bytes of the file
+    """
+    size = len(_MAGIC["little"])
+    magic = bytes(head[:size])
+    if magic != _MAGIC[sys.byteorder]:
+        if magic in _MAGIC.values():
+            raise ValueError("%s was written with another byte order" % path)
+        raise ValueError("%s is not a TOC store" % path)
+    if len(tail) < _TRAILER_SIZE or bytes(tail[-size:]) != magic:
+        raise ValueError("%s is incomplete, the writer wasn't closed" % path)
+    trailer = array("q")
+    trailer.frombytes(bytes(tail[-_TRAILER_SIZE:-size]))
+    return trailer[0], trailer[1]
+
+
+class TOCWriter(object):
+    """Writes TOCs to a file in the format read by :class:`TOCReader`.
+
+    An existing file is appended to in a copy,
+    which replaces it when the writer is closed.
+    With `ids` the binary disc ID is stored with every TOC,
+    calculated with the `"python"` engine unless it is given.
+    The file can only be read once the writer is closed,
+    which is done at the end of a `with` block.
+    """
+
+    def __init__(self, path, ids=False):
+        self._path = path
+        self._ids = ids
+        self._buffer = array("i")
+        self._index = array("Q")
+        self._temp_path = None
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        if size:
+            with open(path, "rb") as store_file:
+                head = store_file.read(len(_MAGIC["little"]))
+                store_file.seek(max(size - _TRAILER_SIZE, 0))
+                tail = store_file.read()
+                count, index_position = _read_trailer(head, tail, path)
+                store_file.seek(index_position)
+                self._index.fromfile(store_file, count)
+            # the file is only replaced once the new index is written,
+            # until then the old records stay readable
+            self._temp_path = "%s.%d.tmp" % (path, os.getpid())
+            # imported here, since shutil is slow to import
+            import shutil
+            shutil.copyfile(path, self._temp_path)
+            self._file = open(self._temp_path, "r+b")
+            self._file.truncate(index_position)
+            self._file.seek(index_position)
+            self._position = (index_position - len(head)) // 4
+        else:
+            self._file = open(path, "wb")
+            self._file.write(_MAGIC[sys.byteorder])
+            self._position = 0
+
+    def __len__(self):
+        return len(self._index)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, first, last, disc_sectors, track_offsets, disc_id=None):
+        """Appends a TOC with the parameters of :func:`put`
+        and returns the number of the record.
+
+        A :exc:`TOCError` is raised for invalid TOCs.
+        """
+        track_offsets = list(track_offsets)
+        if len(track_offsets) != last - first + 1:
+            raise TOCError("Invalid number of track offsets")
+        error = _check_toc(first, last, disc_sectors, track_offsets)
+        if error is not None:
+            raise TOCError(error)
+        buffer = self._buffer
+        self._index.append(self._position + len(buffer))
+        flags = 0
+        if self._ids:
+            flags = _HAS_ID
+        buffer.append(first | last << 8 | flags << 16)
+        buffer.append(disc_sectors)
+        buffer.extend(track_offsets)
+        if self._ids:
+            if disc_id is None:
+                hash_input = _hash_input(first, last, disc_sectors,
+                                         track_offsets)
+                digest = hashlib.sha1(hash_input.encode("ascii")).digest()
+            else:
+                digest = _decode_id(disc_id)
+            buffer.frombytes(digest)
+        if len(buffer) >= _BUFFER_INTS:
+            self._flush()
+        return len(self._index) - 1
+
+    def write_disc(self, disc):
+        """Appends the TOC and disc ID of a :class:`Disc`
+        or :class:`DiscSnapshot`.
+        """
+        return self.write(disc.first_track_num, disc.last_track_num,
+                          disc.sectors,
+                          [track.offset for track in disc.tracks],
+                          disc.id)
+
+    def write_many(self, tocs):
+        """Appends many TOCs given as `(first, last, disc_sectors,
+        track_offsets)` tuples.
+        """
+        for first, last, disc_sectors, track_offsets in tocs:
+            self.write(first, last, disc_sectors, track_offsets)
+
+    def _flush(self):
+        self._buffer.tofile(self._file)
+        self._position += len(self._buffer)
+        self._buffer = array("i")
+
+    def close(self):
+        """Writes the index and closes the file.
+        """
+        if self._file is None:
+            return
+        self._flush()
+        if self._position % 2:
+            # align the index to 8 bytes
+            array("i", [0]).tofile(self._file)
+            self._position += 1
+        index_position = len(_MAGIC["little"]) + 4 * self._position
+        self._index.tofile(self._file)
+        array("q", [len(self._index), index_position]).tofile(self._file)
+        self._file.write(_MAGIC[sys.byteorder])
+        self._file.close()
+        self._file = None
+        if self._temp_path is not None:
+            os.replace(self._temp_path, self._path)
+
+
+class TOCReader(object):
+    """Reads a file written by :class:`TOCWriter`.
+
+    The file is memory-mapped, so opening it is instant
+    regardless of its size.
+    Records are accessed by number or iterated over,
+    both give a :class:`TOCRecord`.
+    The `offsets` of a record are a read-only :class:`memoryview`
+    into the file, so no data is copied until it is used.
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as store_file:
+            self._mmap = mmap.mmap(store_file.fileno(), 0,
+                                   access=mmap.ACCESS_READ)
+        try:
+            count, index_position = _read_trailer(
+                self._mmap[:len(_MAGIC["little"])],
+                self._mmap[-_TRAILER_SIZE:], path)
+            view = memoryview(self._mmap)
+            self._records = view[len(_MAGIC["little"]):
+                                 index_position].cast("i")
+            self._index = view[index_position:
+                               index_position + 8 * count].cast("Q")
+            view.release()
+        except:
+            self._mmap.close()
+            raise
+        self._count = count
+
+    def __len__(self):
+        return self._count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Unmaps the file.
+
+        When offsets of records are still in use,
+        the file is unmapped once they are gone.
+        """
+        self._index.release()
+        self._records.release()
+        try:
+            self._mmap.close()
+        except BufferError:
+            pass
+
+    def _record(self, position):
+        records = self._records
+        header = records[position]
+        first, last = header & 0xff, header >> 8 & 0xff
+        end = position + 2 + last - first + 1
+        disc_id = None
+        if header >> 16 & _HAS_ID:
+            digest = records[end:end + _DIGEST_INTS].tobytes()
+            disc_id = _encode_digest(digest)
+        return TOCRecord(first, last, records[position + 1],
+                         records[position + 2:end], disc_id)
+
+    def __getitem__(self, number):
+        if number < 0:
+            number += self._count
+        if not 0 <= number < self._count:
+            raise IndexError("record number out of range")
+        return self._record(self._index[number])
+
+    def __iter__(self):
+        for position in self._index:
+            yield self._record(position)
+
+    def columns(self, start=0, stop=None):
+        """The records from `start` to `stop` as the parameters
+        for :func:`put_many` with an index.
+
+        Use as `put_many(*reader.columns(start, stop))`.
+        """
+        if stop is None or stop > self._count:
+            stop = self._count
+        firsts = []
+        lasts = []
+        sectors = []
+        offsets = array("i")
+        index = []
+        records = self._records
+        for position in self._index[start:stop]:
+            header = records[position]
+            first, last = header & 0xff, header >> 8 & 0xff
+            firsts.append(first)
+            lasts.append(last)
+            sectors.append(records[position + 1])
+            index.append(len(offsets))
+            offsets.extend(records[position + 2:position + 3 + last - first])
+        index.append(len(offsets))
+        return firsts, lasts, sectors, offsets, index
+
+
+# vim:set shiftwidth=4 smarttab expandtab:
@@ -31,22 +31,52 @@ class Track(object):
     def __init__(self, disc, number):
         self._disc = disc
         self._number = number
-        assert self._disc._handle.value is not None
+        assert self._disc._success
 
     def __str__(self):
         assert self._disc._success
         return str(self.number)
 
+    def __reduce__(self):
+        return (Track, (self._disc, self._number))
+
+    def __eq__(self, other):
+        """Tracks are equal when they have the same number
+        on discs with the same TOC.
+        """
+        if not isinstance(other, Track):
+            return NotImplemented
+        return self._number == other._number and self._disc == other._disc
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    def __hash__(self):
+        return hash((hash(self._disc), self._number))
+
     _LIB.discid_get_track_offset.argtypes = (c_void_p, c_int)
     _LIB.discid_get_track_offset.restype = c_int
     def _get_track_offset(self):
         assert self._disc._success
+        if self._disc._handle is None:
+            first, last, disc_sectors, offsets = self._disc._toc
+            return offsets[self.number - first]
         return _LIB.discid_get_track_offset(self._disc._handle, self.number)
 
     _LIB.discid_get_track_length.argtypes = (c_void_p, c_int)
     _LIB.discid_get_track_length.restype = c_int
     def _get_track_length(self):
         assert self._disc._success
+        if self._disc._handle is None:
+            first, last, disc_sectors, offsets = self._disc._toc
+            if self.number == last:
+                end = disc_sectors
+            else:
+                end = offsets[self.number - first + 1]
+            return end - offsets[self.number - first]
         return _LIB.discid_get_track_length(self._disc._handle, self.number)
 
     try:
@@ -57,6 +87,11 @@ class Track(object):
     def _get_track_isrc(self):
         assert self._disc._success
         if "isrc" in self._disc._requested_features:
+            if self._disc._features_future is not None:
+                self._disc._features_future.result()
+                return self._disc._deferred_isrcs.get(self.number)
+            if self._disc._handle is None:
+                return self._disc._deferred_isrcs.get(self.number)
             try:
                 result = _LIB.discid_get_track_isrc(self._disc._handle,
                                                     self.number)
@@ -98,6 +133,8 @@ class Track(object):
         This will be `None` when the `"isrc"` feature was not requested
         or not supported, otherwise this is a :obj:`unicode` or
         :obj:`str <python:str>` object.
+
+        For a deferred read this waits until the ISRCs are read.
         """
         return self._get_track_isrc()
 
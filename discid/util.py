@@ -18,7 +18,8 @@
 """utility functions
 """
 
-import math
+import collections
+from array import array
 
 SECTORS_PER_SECOND = 75
 
@@ -48,10 +49,144 @@ def _sectors_to_seconds(sectors):
 
     The result is forced to :obj:int to make formatted output easier.
     """
-    # note that `round(2.5) == 2` on Python 3
-    # and math.floor doesn't return :obj:int on Python 2
-    # additionally always `int / int =^= int` in Python 2
-    return int(math.floor((sectors / float(SECTORS_PER_SECOND)) + 0.5))
+    # this is floor(sectors / 75 + 0.5) in integer arithmetic,
+    # which avoids float rounding and works with Python 2 and 3
+    return (2 * int(sectors) + SECTORS_PER_SECOND) // (2 * SECTORS_PER_SECOND)
+
+def _is_ndarray(value):
+    """Test for a NumPy array without importing NumPy
+    """
+    return hasattr(value, "dtype") and hasattr(value, "shape")
+
+def sectors_to_seconds(sectors):
+    """Round sectors to seconds like done on MusicBrainz Server.
+
+    `sectors` can be an integer, a NumPy array,
+    or any sequence or buffer of integers,
+    like a :class:`list`, an :class:`array.array` or a :class:`memoryview`.
+    The result is an integer, a NumPy array or an :class:`array.array`.
+    """
+    if _is_ndarray(sectors):
+        return (2 * sectors + SECTORS_PER_SECOND) // (2 * SECTORS_PER_SECOND)
+    if not hasattr(sectors, "__iter__"):
+        return _sectors_to_seconds(sectors)
+    double = 2 * SECTORS_PER_SECOND
+    return array("l", [(2 * value + SECTORS_PER_SECOND) // double
+                       for value in sectors])
+
+def sectors_to_msf(sectors):
+    """Split sectors into minutes, seconds and frames (sectors).
+
+    For an integer this is a `(minutes, seconds, frames)` tuple.
+    For a NumPy array, sequence or buffer of integers it is a tuple
+    of three NumPy arrays or three :class:`array.array` objects.
+    No lead-in is added, so this is a length, not a disc address.
+    """
+    per_minute = 60 * SECTORS_PER_SECOND
+    if _is_ndarray(sectors) or not hasattr(sectors, "__iter__"):
+        return (sectors // per_minute,
+                sectors // SECTORS_PER_SECOND % 60,
+                sectors % SECTORS_PER_SECOND)
+    minutes, seconds, frames = array("l"), array("l"), array("l")
+    for value in sectors:
+        minutes.append(value // per_minute)
+        seconds.append(value // SECTORS_PER_SECOND % 60)
+        frames.append(value % SECTORS_PER_SECOND)
+    return minutes, seconds, frames
+
+def format_msf(sectors):
+    """Format sectors as `MM:SS:FF`, as in CUE sheets.
+
+    For a sequence or buffer of integers this is a list of strings.
+    """
+    if not hasattr(sectors, "__iter__"):
+        return "%02d:%02d:%02d" % sectors_to_msf(sectors)
+    return ["%02d:%02d:%02d" % sectors_to_msf(int(value))
+            for value in sectors]
+
+def track_lengths(offsets, disc_sectors, index=None):
+    """The track lengths in sectors from the track offsets
+    and the lead-out given as `disc_sectors`.
+
+    Without `index`, `offsets` are the offsets of one disc.
+    With an `index` as for :func:`put_many`, `offsets` are the offsets
+    of many discs in one column and `disc_sectors` are their lead-outs.
+    The result then has the lengths of all tracks in one column.
+    NumPy arrays give a NumPy array,
+    anything else gives an :class:`array.array`.
+    """
+    if index is None:
+        if _is_ndarray(offsets):
+            lengths = offsets.copy()
+            lengths[:-1] = offsets[1:] - offsets[:-1]
+            lengths[-1:] = disc_sectors - offsets[-1:]
+            return lengths
+        lengths = array("l", offsets)
+        for number in range(len(lengths) - 1):
+            lengths[number] = lengths[number + 1] - lengths[number]
+        if lengths:
+            lengths[-1] = disc_sectors - lengths[-1]
+        return lengths
+    starts = index.tolist() if hasattr(index, "tolist") else list(index)
+    if len(starts) == len(disc_sectors) + 1:
+        starts.pop()
+    elif len(starts) != len(disc_sectors):
+        raise ValueError("%d index entries for %d TOCs"
+                         % (len(starts), len(disc_sectors)))
+    ends = starts[1:] + [len(offsets)]
+    if _is_ndarray(offsets):
+        lengths = offsets.copy()
+        lengths[:-1] = offsets[1:] - offsets[:-1]
+        # TOCs without offsets have no last track
+        kept = [i for i, end in enumerate(ends) if end > starts[i]]
+        lasts = [ends[i] - 1 for i in kept]
+        if len(kept) < len(ends):
+            disc_sectors = [disc_sectors[i] for i in kept]
+        lengths[lasts] = disc_sectors - offsets[lasts]
+        return lengths
+    lengths = array("l", offsets)
+    for start, end, leadout in zip(starts, ends, disc_sectors):
+        for number in range(start, end - 1):
+            lengths[number] = lengths[number + 1] - lengths[number]
+        if end > start:
+            lengths[end - 1] = leadout - lengths[end - 1]
+    return lengths
+
+
+def _imap_bounded(pool, function, iterable, window, ordered):
+    """Like :meth:`multiprocessing.pool.Pool.imap`,
+    but with at most `window` tasks queued at a time.
+
+    :meth:`~multiprocessing.pool.Pool.imap` consumes the whole input
+    up front, which would keep all of a large input in memory.
+    """
+    if ordered:
+        pending = collections.deque()
+        for item in iterable:
+            pending.append(pool.apply_async(function, (item,)))
+            if len(pending) >= window:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+    else:
+        # imported here, since it is only needed for unordered results
+        import queue
+        done = queue.Queue()
+        in_flight = 0
+        for item in iterable:
+            pool.apply_async(function, (item,), callback=done.put,
+                             error_callback=done.put)
+            in_flight += 1
+            if in_flight >= window:
+                in_flight -= 1
+                yield _result(done.get())
+        for _ in range(in_flight):
+            yield _result(done.get())
+
+def _result(result):
+    if isinstance(result, BaseException):
+        raise result
+    return result
 
 
 # vim:set shiftwidth=4 smarttab expandtab:
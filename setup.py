@@ -30,7 +30,29 @@ class Test(Command):
                 self.names = []
         else:
             self.names = ["test_discid.TestModulePrivate",
-                          "test_discid.TestModule"]
+                          "test_discid.TestModule",
+                          "test_discid.TestExceptions",
+                          "test_discid.TestLoading",
+                          "test_discid.TestEngine",
+                          "test_discid.TestDevices",
+                          "test_discid.TestAsyncio",
+                          "test_discid.TestHandlePool",
+                          "test_discid.TestSnapshot",
+                          "test_discid.TestBatch",
+                          "test_discid.TestParse",
+                          "test_discid.TestCLI",
+                          "test_discid.TestIndex",
+                          "test_discid.TestFreeDBIndex",
+                          "test_discid.TestInstrument",
+                          "test_discid.TestStore",
+                          "test_discid.TestPickle",
+                          "test_discid.TestDedupe",
+                          "test_discid.TestUtil",
+                          "test_discid.TestLookup",
+                          "test_discid.TestCache",
+                          "test_discid.TestCDDB",
+                          "test_discid.TestVerificationIDs",
+                          "test_discid.TestRips"]
 
     def run(self):
         suite = unittest.defaultTestLoader.loadTestsFromNames(self.names)
@@ -45,7 +67,7 @@ with open("README.rst") as readme:
     long_description = readme.read()
 
 setup(name="discid",
-        version="1.2.0",
+        version="1.3.0",
         description="Python binding of Libdiscid",
         long_description=long_description,
         author="Johannes Dewender",
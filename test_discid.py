@@ -2,9 +2,25 @@
 # Copyright (C) 2013  Johannes Dewender
 # This test is free. You can redistribute and/or modify it at will.
 
+import os
 import sys
+import json
 import math
+import time
+import array
+import pickle
+import hashlib
+import random
+import shutil
+import struct
+import tempfile
 import unittest
+import threading
+import subprocess
+
+if sys.version_info >= (3, 7):
+    # like the coroutines in discid, the tests skip older versions
+    import asyncio
 
 import discid
 
@@ -22,6 +38,21 @@ test_discs = [
         }
     ]
 
+def _random_tocs(count, seed=0):
+    """Generate plausible TOCs as (first, last, sectors, offsets)
+    """
+    rand = random.Random(seed)
+    tocs = []
+    for _ in range(count):
+        first = rand.choice([1, 1, 1, 2, 5])
+        last = rand.randint(first, 99)
+        offsets = [rand.randint(150, 200)]
+        for _ in range(last - first):
+            offsets.append(offsets[-1] + rand.randint(1, 3500))
+        sectors = offsets[-1] + rand.randint(1, 30000)
+        tocs.append((first, last, sectors, offsets))
+    return tocs
+
 class TestModulePrivate(unittest.TestCase):
 
     # lots of encoding tests
@@ -43,6 +74,20 @@ class TestModulePrivate(unittest.TestCase):
         self.assertEqual(discid.util._encode(discid.util._decode(bytestring)),
                          bytestring)
 
+    @unittest.skipIf(sys.version_info < (3, 7), "needs module __getattr__")
+    def test_lazy_modules(self):
+        code = ("import sys, discid; "
+                "print(sorted(name for name in sys.modules "
+                "if name in ('discid.rips', 'discid.store', 'sqlite3'))); "
+                "print(discid.parse_cue is discid.rips.parse_cue); "
+                "print(discid.TOCWriter.__module__); "
+                "print(callable(discid.instrument))")
+        directory = os.path.dirname(os.path.abspath(__file__))
+        output = subprocess.check_output([sys.executable, "-c", code],
+                                         cwd=directory)
+        self.assertEqual(output.decode().split(),
+                         ["[]", "True", "discid.store", "True"])
+
 
 class TestModule(unittest.TestCase):
 
@@ -66,6 +111,57 @@ class TestModule(unittest.TestCase):
         device = "non_existing_device"
         self.assertRaises(discid.DiscError, discid.read, device)
 
+    def test_invalid_device_deferred(self):
+        device = "non_existing_device"
+        self.assertRaises(discid.DiscError, discid.read, device,
+                          ["mcn", "isrc"], deferred=True)
+        self.assertRaises(ValueError, discid.read, device, deferred=True,
+                          snapshot=True)
+
+    def test_read_timeout(self):
+        from discid import disc as disc_module
+        release = threading.Event()
+        freed = []
+        class CountingLibrary(object):
+            def __init__(self, lib):
+                self._lib = lib
+            def discid_free(self, handle):
+                freed.append(handle.value)
+                self._lib.discid_free(handle)
+            def __getattr__(self, name):
+                return getattr(self._lib, name)
+        def blocking_read(handle, device, c_features):
+            release.wait(10)
+            return False
+        read_handle = disc_module.Disc._read_handle
+        lib = disc_module._LIB
+        disc_module.Disc._read_handle = staticmethod(blocking_read)
+        disc_module._LIB = CountingLibrary(lib)
+        try:
+            disc = discid.Disc()
+            old_handle = disc._handle.value
+            self.assertRaises(discid.DiscTimeoutError, disc.read,
+                              "non_existing_device", timeout=0.05)
+            self.assertEqual(list(disc.timings), ["read"])
+            new_handle = disc._handle.value
+            self.assertNotEqual(new_handle, old_handle)
+            self.assertTrue(old_handle in disc_module._quarantine)
+            self.assertEqual(freed, [])
+            release.set()
+            for _ in range(200):
+                if freed:
+                    break
+                time.sleep(0.01)
+            self.assertEqual(freed, [old_handle])
+            self.assertFalse(old_handle in disc_module._quarantine)
+            disc._free()
+            del disc
+            self.assertEqual(freed, [old_handle, new_handle])
+        finally:
+            release.set()
+            disc_module.Disc._read_handle = read_handle
+            disc_module._LIB = lib
+
     def test_device_encoding(self):
         device = b"non_existing_device".decode()
         self.assertRaises(discid.DiscError, discid.read, device)
@@ -80,6 +176,12 @@ class TestModule(unittest.TestCase):
                           discid.put, 1, 2, 1000, [150, 500, 750])
         # total sectors / offset mismatch
         self.assertRaises(discid.TOCError, discid.put, 1, 2, 150, [150, 500])
+        # track limits that can't size the offsets array for libdiscid
+        self.assertRaises(discid.TOCError, discid.put, -2, -2, 1000, [150],
+                          engine="libdiscid")
+        results = list(discid.parse_toc_strings(["-2 -2 1000 150"],
+                                                engine="libdiscid"))
+        self.assertTrue(isinstance(results[0].error, discid.TOCError))
 
     def test_put_success(self):
         test_disc = test_discs[0]
@@ -108,6 +210,1713 @@ class TestModule(unittest.TestCase):
         self.assertEqual(disc.cddb_query_string, cddb_query_string)
 
 
+class TestExceptions(unittest.TestCase):
+
+    def test_timeout_error(self):
+        error = discid.DiscTimeoutError("/dev/cdrom", 2.5)
+        self.assertTrue(isinstance(error, discid.DiscError))
+        self.assertEqual(error.device, "/dev/cdrom")
+        self.assertEqual(error.timeout, 2.5)
+        self.assertTrue("/dev/cdrom" in str(error))
+        copy = pickle.loads(pickle.dumps(error))
+        self.assertEqual((copy.device, copy.timeout), ("/dev/cdrom", 2.5))
+
+
+class TestLoading(unittest.TestCase):
+    """Test the lazy loading of libdiscid
+    """
+
+    def _run(self, code, **environ):
+        env = dict(os.environ)
+        env.update(environ)
+        return subprocess.call([sys.executable, "-c", code], env=env)
+
+    def test_lazy_import(self):
+        code = ("import discid; "
+                "assert discid.libdiscid._LIB._cdll is None; "
+                "discid.put(1, 1, 300, [150], engine='python').id; "
+                "assert discid.libdiscid._LIB._cdll is None")
+        self.assertEqual(self._run(code), 0)
+
+    def test_library_override(self):
+        code = ("import discid\n"
+                "try:\n"
+                "    discid.get_default_device()\n"
+                "except OSError as exc:\n"
+                "    assert 'non_existing' in str(exc)\n"
+                "else:\n"
+                "    raise AssertionError('no OSError')\n")
+        library = os.path.join("non_existing", "libdiscid.so.0")
+        self.assertEqual(self._run(code, DISCID_LIBRARY=library), 0)
+
+    def test_cache(self):
+        tempdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tempdir, "cache.json")
+            self.assertEqual(discid.libdiscid._read_cache(path, "key"), None)
+            cache = {"key": "key", "library": "libdiscid.so.0",
+                     "version_string": "libdiscid 0.6.2",
+                     "features": ["read"]}
+            discid.libdiscid._write_cache(path, cache)
+            self.assertEqual(discid.libdiscid._read_cache(path, "key"), cache)
+            self.assertEqual(discid.libdiscid._read_cache(path, "other"), None)
+        finally:
+            shutil.rmtree(tempdir)
+
+
+class TestEngine(unittest.TestCase):
+    """Test the pure Python engine and compare it to libdiscid
+    """
+
+    def test_engines(self):
+        self.assertEqual(discid.ENGINES, ["libdiscid", "python"])
+        self.assertRaises(ValueError, discid.put, 1, 1, 300, [150],
+                          engine="unknown")
+        self.assertRaises(ValueError, discid.set_engine, "unknown")
+
+    def test_set_engine(self):
+        default = discid.get_engine()
+        try:
+            discid.set_engine("python")
+            test_disc = test_discs[0]
+            disc = discid.put(test_disc["first"], test_disc["last"],
+                              test_disc["sectors"], test_disc["offsets"])
+            self.assertTrue(disc._handle is None)
+            self.assertEqual(disc.id, test_disc["id"])
+        finally:
+            discid.set_engine(default)
+
+    def test_put_python(self):
+        test_disc = test_discs[0]
+        disc = discid.put(test_disc["first"], test_disc["last"],
+                          test_disc["sectors"], test_disc["offsets"],
+                          engine="python")
+        self.assertEqual(disc.id, test_disc["id"])
+        self.assertEqual(disc.freedb_id, test_disc["freedb"])
+        self.assertEqual(disc.sectors, test_disc["sectors"])
+        track_offsets = [track.offset for track in disc.tracks]
+        self.assertEqual(track_offsets, test_disc["offsets"])
+        self.assertEqual(disc.sectors,
+                         disc.tracks[-1].offset + disc.tracks[-1].sectors)
+        self.assertTrue(disc.mcn is None)
+        self.assertTrue(disc.tracks[0].isrc is None)
+        self.assertTrue("toc=1+15+258725+150+17510+" in disc.submission_url)
+
+    def test_ids_cached(self):
+        test_disc = test_discs[0]
+        other = _random_tocs(1, seed=5)[0]
+        disc = discid.Disc(engine="python")
+        disc.put(test_disc["first"], test_disc["last"],
+                 test_disc["sectors"], test_disc["offsets"])
+        self.assertTrue(disc.id is disc.id)
+        self.assertTrue(disc.cddb_query_string is disc.cddb_query_string)
+        self.assertEqual(disc.freedb_id, test_disc["freedb"])
+        # a new put calculates them again
+        disc.put(*other)
+        expected = discid.put(*other, engine="python")
+        self.assertEqual(disc.id, discid.engine.disc_id(*other))
+        self.assertEqual(disc.freedb_id, discid.engine.freedb_id(*other))
+        self.assertEqual(disc.cddb_query_string, expected.cddb_query_string)
+        # beyond the table used for checked TOCs
+        self.assertEqual(discid.engine.freedb_id(1, 1, 600000, [599999]),
+                         "%08x" % (sum(map(int, "7999")) << 24 | 1 << 8 | 1))
+
+    def test_put_fail_python(self):
+        self.assertRaises(discid.TOCError, discid.put, 1, 2, 150, [150],
+                          engine="python")
+        self.assertRaises(discid.TOCError, discid.put, 1, 2, 150, [150, 500],
+                          engine="python")
+        self.assertRaises(discid.TOCError, discid.put, 2, 1, 1000, [],
+                          engine="python")
+        self.assertRaises(discid.TOCError, discid.put, 1, 2, 1000, [500, 150],
+                          engine="python")
+
+    def test_put_buffers(self):
+        test_disc = test_discs[0]
+        offsets = array.array("i", test_disc["offsets"])
+        for track_offsets in (offsets, memoryview(offsets),
+                              array.array("q", offsets),
+                              memoryview(offsets.tobytes()).cast("i")):
+            disc = discid.put(test_disc["first"], test_disc["last"],
+                              test_disc["sectors"], track_offsets,
+                              engine="python")
+            self.assertEqual(disc.id, test_disc["id"])
+            self.assertEqual(disc._toc[3], tuple(test_disc["offsets"]))
+        self.assertRaises(discid.TOCError, discid.put, 1, 15, 200000,
+                          offsets, engine="python")
+
+    def test_c_offsets(self):
+        test_disc = test_discs[0]
+        expected = [test_disc["sectors"]] + test_disc["offsets"]
+        offsets = array.array("i", test_disc["offsets"])
+        # copied as memory or converted
+        for track_offsets in (offsets, memoryview(offsets),
+                              array.array("q", offsets),
+                              test_disc["offsets"]):
+            c_offsets = discid.disc._c_offsets(1, test_disc["sectors"],
+                                               track_offsets)
+            self.assertEqual(list(c_offsets), expected)
+            # indexed by track number, like the python engine does
+            c_offsets = discid.disc._c_offsets(3, test_disc["sectors"],
+                                               track_offsets)
+            self.assertEqual(list(c_offsets),
+                             [test_disc["sectors"], 0, 0]
+                             + test_disc["offsets"])
+        # without memoryview.cast the offsets are converted
+        copy_buffers = discid.disc._CAN_COPY_BUFFERS
+        discid.disc._CAN_COPY_BUFFERS = False
+        try:
+            c_offsets = discid.disc._c_offsets(1, test_disc["sectors"],
+                                               offsets)
+        finally:
+            discid.disc._CAN_COPY_BUFFERS = copy_buffers
+        self.assertEqual(list(c_offsets), expected)
+        c_offsets = discid.disc._c_offsets(1, test_disc["sectors"],
+                                           memoryview(offsets)[::2])
+        self.assertEqual(list(c_offsets),
+                         [test_disc["sectors"]] + test_disc["offsets"][::2])
+
+    def test_cross_check(self):
+        for first, last, sectors, offsets in _random_tocs(200):
+            disc = discid.put(first, last, sectors, offsets,
+                              engine="libdiscid")
+            python_disc = discid.put(first, last, sectors, offsets,
+                                     engine="python")
+            self.assertEqual(python_disc.id, disc.id)
+            array_disc = discid.put(first, last, sectors,
+                                    array.array("i", offsets),
+                                    engine="libdiscid")
+            self.assertEqual(array_disc.id, disc.id)
+            self.assertEqual(array_disc, python_disc)
+            self.assertEqual(python_disc.freedb_id, disc.freedb_id)
+            self.assertEqual(python_disc.toc_string, disc.toc_string)
+            self.assertEqual(python_disc.accuraterip_id, disc.accuraterip_id)
+            self.assertEqual(python_disc.ctdb_id, disc.ctdb_id)
+            self.assertEqual(python_disc.cddb_query_string,
+                             disc.cddb_query_string)
+            self.assertEqual([t.sectors for t in python_disc.tracks],
+                             [t.sectors for t in disc.tracks])
+
+
+class TestDevices(unittest.TestCase):
+    """Test listing and reading several devices
+    """
+
+    def setUp(self):
+        self.proc_root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.proc_root)
+
+    def _write_info(self, content):
+        info_dir = os.path.join(self.proc_root, "sys", "dev", "cdrom")
+        os.makedirs(info_dir)
+        with open(os.path.join(info_dir, "info"), "w") as info_file:
+            info_file.write(content)
+
+    def test_get_devices(self):
+        self.assertEqual(discid.get_devices(self.proc_root), [])
+        self._write_info("CD-ROM information, Id: cdrom.c 3.20 2003/12/17\n"
+                         "\n"
+                         "drive name:\t\tsr1\tsr0\n"
+                         "drive speed:\t\t48\t48\n")
+        self.assertEqual(discid.get_devices(self.proc_root),
+                         ["/dev/sr0", "/dev/sr1"])
+
+    def test_read_all(self):
+        devices = ["non_existing_device_%d" % i for i in range(3)]
+        results = dict(discid.read_all(devices))
+        self.assertEqual(sorted(results), devices)
+        for result in results.values():
+            self.assertTrue(isinstance(result, discid.DiscError))
+
+
+class TestAsyncio(unittest.TestCase):
+    """Test the coroutines for asyncio
+    """
+
+    def setUp(self):
+        if sys.version_info < (3, 7):
+            self.skipTest("needs asyncio.run")
+
+    def test_aput(self):
+        test_disc = test_discs[0]
+        disc = asyncio.run(discid.aput(test_disc["first"], test_disc["last"],
+                                       test_disc["sectors"],
+                                       test_disc["offsets"], engine="python"))
+        self.assertEqual(disc.id, test_disc["id"])
+
+    def test_aread(self):
+        calls = []
+        def fake_read(device, features, **kwargs):
+            calls.append((device, features, kwargs))
+            return "disc"
+        read = discid.aio.read
+        discid.aio.read = fake_read
+        try:
+            disc = asyncio.run(discid.aread("/dev/cdrom", ["mcn"],
+                                            deferred=True, timeout=2.5))
+        finally:
+            discid.aio.read = read
+        self.assertEqual(disc, "disc")
+        self.assertEqual(calls, [("/dev/cdrom", ["mcn"],
+                                  {"snapshot": False, "deferred": True,
+                                   "callback": None, "timeout": 2.5})])
+
+    def test_aput_many(self):
+        tocs = _random_tocs(20, seed=3)
+        expected = [discid.put(*toc, engine="python").id for toc in tocs]
+        async def collect(tocs):
+            return [disc.id async for disc
+                    in discid.aput_many(tocs, chunksize=7, engine="python")]
+        async def generate():
+            for toc in tocs:
+                yield toc
+        self.assertEqual(asyncio.run(collect(tocs)), expected)
+        self.assertEqual(asyncio.run(collect(generate())), expected)
+
+    def test_device_serialized(self):
+        running = []
+        overlaps = []
+        def work():
+            running.append(1)
+            if len(running) > 1:
+                overlaps.append(1)
+            time.sleep(0.01)
+            running.pop()
+        async def main():
+            loop = asyncio.get_running_loop()
+            lock = discid.aio._device_lock(loop, "/dev/cdrom")
+            self.assertTrue(discid.aio._device_lock(loop, b"/dev/cdrom")
+                            is lock)
+            tasks = [discid.aio._run_locked(lock, work) for _ in range(4)]
+            await asyncio.gather(*tasks)
+            # cancel a running call, the lock stays held until it is done
+            task = asyncio.ensure_future(discid.aio._run_locked(lock, work))
+            await asyncio.sleep(0.001)
+            task.cancel()
+            await discid.aio._run_locked(lock, work)
+        asyncio.run(main())
+        self.assertEqual(overlaps, [])
+
+
+class TestHandlePool(unittest.TestCase):
+    """Test reusing libdiscid handles
+    """
+
+    def test_put(self):
+        test_disc = test_discs[0]
+        with discid.HandlePool(maxsize=2) as pool:
+            for _ in range(3):
+                disc = pool.put(test_disc["first"], test_disc["last"],
+                                test_disc["sectors"], test_disc["offsets"])
+                self.assertEqual(disc.id, test_disc["id"])
+                self.assertEqual(disc.freedb_id, test_disc["freedb"])
+            self.assertRaises(discid.TOCError, pool.put, 1, 2, 150, [150])
+            stats = pool.stats()
+            self.assertEqual(stats["created"], 1)
+            self.assertEqual(stats["reused"], 3)
+            self.assertEqual(stats["in_use"], 0)
+            self.assertEqual(stats["idle"], 1)
+        self.assertEqual(pool.stats()["freed"], 1)
+
+    def test_threads(self):
+        tocs = _random_tocs(100, seed=2)
+        expected = [discid.put(*toc, engine="python").id for toc in tocs]
+        pool = discid.HandlePool(maxsize=2)
+        results = {}
+        def work(start):
+            for i in range(start, len(tocs), 4):
+                results[i] = pool.put(*tocs[i]).id
+        threads = [threading.Thread(target=work, args=(i,)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([results[i] for i in range(len(tocs))], expected)
+        self.assertTrue(pool.stats()["created"] <= 2)
+        pool.close()
+
+
+class TestSnapshot(unittest.TestCase):
+    """Test immutable snapshots of discs
+    """
+
+    def test_snapshot(self):
+        test_disc = test_discs[0]
+        for engine in discid.ENGINES:
+            disc = discid.put(test_disc["first"], test_disc["last"],
+                              test_disc["sectors"], test_disc["offsets"],
+                              engine=engine)
+            expected_tracks = [(t.number, t.offset, t.sectors, t.seconds)
+                               for t in disc.tracks]
+            cddb_query_string = disc.cddb_query_string
+            snapshot = disc.snapshot()
+            self.assertTrue(disc._handle is None)
+            self.assertEqual(snapshot.id, test_disc["id"])
+            self.assertEqual(snapshot.freedb_id, test_disc["freedb"])
+            self.assertEqual(snapshot.sectors, test_disc["sectors"])
+            self.assertEqual(snapshot.last_track_num, test_disc["last"])
+            self.assertEqual(snapshot.cddb_query_string, cddb_query_string)
+            self.assertTrue(snapshot.toc_string.startswith("1 15 258725 "))
+            self.assertTrue(snapshot.mcn is None)
+            self.assertEqual([(t.number, t.offset, t.sectors, t.seconds)
+                              for t in snapshot.tracks], expected_tracks)
+            self.assertTrue(snapshot.tracks is snapshot.tracks)
+
+    def test_immutable(self):
+        test_disc = test_discs[0]
+        snapshot = discid.put(test_disc["first"], test_disc["last"],
+                              test_disc["sectors"], test_disc["offsets"],
+                              engine="python", snapshot=True)
+        self.assertTrue(isinstance(snapshot, discid.DiscSnapshot))
+        self.assertRaises(AttributeError, setattr, snapshot, "_id", "x")
+        self.assertRaises(AttributeError, setattr, snapshot, "other", 1)
+        self.assertRaises(AttributeError, setattr, snapshot.tracks[0],
+                          "_offset", 0)
+
+
+class TestBatch(unittest.TestCase):
+    """Test the calculation of many TOCs at once
+    """
+
+    def setUp(self):
+        self.tocs = _random_tocs(50, seed=1)
+        self.firsts = [toc[0] for toc in self.tocs]
+        self.lasts = [toc[1] for toc in self.tocs]
+        self.sectors = [toc[2] for toc in self.tocs]
+        self.expected = [discid.put(*toc, engine="python")
+                         for toc in self.tocs]
+
+    def assertExpected(self, result):
+        self.assertEqual(result.ids, [disc.id for disc in self.expected])
+        self.assertEqual(result.freedb_ids,
+                         [disc.freedb_id for disc in self.expected])
+        self.assertEqual(result.toc_strings,
+                         [disc.toc_string for disc in self.expected])
+
+    def test_padded(self):
+        padded = [toc[3] + [0] * (99 - len(toc[3])) for toc in self.tocs]
+        result = discid.put_many(self.firsts, self.lasts, self.sectors, padded)
+        self.assertExpected(result)
+
+    def test_ragged(self):
+        flat = []
+        index = []
+        for toc in self.tocs:
+            index.append(len(flat))
+            flat.extend(toc[3])
+        result = discid.put_many(self.firsts, self.lasts, self.sectors,
+                                 array.array("i", flat), index=index)
+        self.assertExpected(result)
+        result = discid.put_many(self.firsts, self.lasts, self.sectors,
+                                 flat, index=index + [len(flat)])
+        self.assertExpected(result)
+
+    def test_errors(self):
+        args = ([1, 1], [2, 1], [1000, 150], [[150, 500], [500]])
+        self.assertRaises(discid.TOCError, discid.put_many, *args)
+        result = discid.put_many(*args, errors="ignore")
+        self.assertEqual(result.ids[1], None)
+        self.assertEqual(result.freedb_ids[1], None)
+        self.assertEqual(result.toc_strings[0], "1 2 1000 150 500")
+        self.assertRaises(ValueError, discid.put_many, [1], [1, 2],
+                          [1000], [[150]])
+
+
+class TestParse(unittest.TestCase):
+    """Test parsing TOC strings and CDDB query strings
+    """
+
+    def setUp(self):
+        test_disc = test_discs[0]
+        self.disc = discid.put(test_disc["first"], test_disc["last"],
+                               test_disc["sectors"], test_disc["offsets"],
+                               engine="python")
+
+    def test_toc_string(self):
+        disc = discid.from_toc_string(self.disc.toc_string, engine="python")
+        self.assertEqual(disc.id, self.disc.id)
+        self.assertRaises(discid.TOCError, discid.from_toc_string, "1 2 3")
+        self.assertRaises(discid.TOCError, discid.from_toc_string,
+                          "1 1 x 150")
+        self.assertRaises(discid.TOCError, discid.from_toc_string,
+                          "1 2 1000 150", engine="python")
+        self.assertRaises(discid.TOCError, discid.from_toc_string,
+                          "-2 -2 1000 150", engine="python")
+
+    def test_cddb_query(self):
+        query = discid.from_cddb_query(self.disc.cddb_query_string)
+        self.assertEqual(query.freedb_id, self.disc.freedb_id)
+        self.assertEqual(query.track_count, self.disc.last_track_num)
+        self.assertEqual(query.offsets, test_discs[0]["offsets"])
+        self.assertEqual(query.seconds, self.disc.seconds)
+        command = "cddb query " + self.disc.cddb_query_string
+        self.assertEqual(discid.from_cddb_query(command), query)
+        self.assertRaises(discid.TOCError, discid.from_cddb_query,
+                          "b60d770f 2 150 3449")
+        self.assertRaises(discid.TOCError, discid.from_cddb_query,
+                          "xyz 1 150 3449")
+
+    def test_bulk(self):
+        lines = [self.disc.toc_string + "\n", "\n", "1 1 garbage\n",
+                 "1 1 1000 150"]
+        results = list(discid.parse_toc_strings(iter(lines),
+                                                engine="python"))
+        self.assertEqual([result.line_number for result in results],
+                         [1, 3, 4])
+        self.assertEqual(results[0].value.id, self.disc.id)
+        self.assertTrue(results[0].error is None)
+        self.assertTrue(results[1].value is None)
+        self.assertTrue(isinstance(results[1].error, discid.TOCError))
+        self.assertEqual(results[2].value.sectors, 1000)
+        results = list(discid.parse_cddb_queries(
+            [self.disc.cddb_query_string, "broken"]))
+        self.assertEqual(results[0].value.freedb_id, self.disc.freedb_id)
+        self.assertTrue(results[1].error is not None)
+
+
+class TestCLI(unittest.TestCase):
+    """Test the command line interface run with `python -m discid`
+    """
+
+    def setUp(self):
+        test_disc = test_discs[0]
+        self.disc = discid.put(test_disc["first"], test_disc["last"],
+                               test_disc["sectors"], test_disc["offsets"],
+                               engine="python")
+
+    def run_cli(self, args, stdin=""):
+        process = subprocess.Popen(
+            [sys.executable, "-m", "discid"] + args,
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE, universal_newlines=True)
+        stdout, stderr = process.communicate(stdin)
+        return process.returncode, stdout.splitlines(), stderr
+
+    def test_put(self):
+        status, lines, _ = self.run_cli(["put", self.disc.toc_string])
+        self.assertEqual(status, 0)
+        self.assertEqual(json.loads(lines[0])["id"], self.disc.id)
+        status, lines, _ = self.run_cli(["--output-format", "tsv", "put",
+                                         self.disc.toc_string, "1 2 3"])
+        self.assertEqual(status, 1)
+        self.assertEqual(lines[0].split("\t"),
+                         [self.disc.id, self.disc.freedb_id,
+                          self.disc.toc_string])
+        self.assertEqual(lines[1].split("\t")[0], "error")
+
+    def test_batch(self):
+        tocs = ["%d\t%s" % (i, toc_string) for i, toc_string
+                in enumerate(" ".join(map(str, [first, last, sectors]
+                                           + offsets))
+                             for first, last, sectors, offsets
+                             in _random_tocs(500, 11))]
+        tocs.insert(100, "broken\t1 2 3")
+        stdin = "\n".join(tocs) + "\n\n"
+        status, lines, stderr = self.run_cli(
+            ["--output-format", "tsv", "batch", "--workers", "2",
+             "--chunksize", "7", "--progress"], stdin)
+        self.assertEqual(status, 0)
+        self.assertEqual(len(lines), 501)
+        self.assertEqual([line.split("\t")[0] for line in lines],
+                         [toc.split("\t")[0] for toc in tocs])
+        self.assertEqual(lines[100].split("\t")[1], "error")
+        for toc, line in zip(tocs[:3], lines):
+            disc = discid.from_toc_string(toc.split("\t")[1],
+                                          engine="python")
+            self.assertEqual(line.split("\t")[1], disc.id)
+        self.assertTrue("501 TOCs, 1 errors" in stderr)
+        _, unordered, _ = self.run_cli(
+            ["--output-format", "tsv", "batch", "--workers", "2",
+             "--chunksize", "7", "--unordered"], stdin)
+        self.assertEqual(sorted(unordered), sorted(lines))
+
+    def test_invalid_counts(self):
+        for args in (["batch", "--workers", "0"],
+                     ["batch", "--chunksize", "-1"],
+                     ["scan", ".", "--workers", "-2"],
+                     ["scan", ".", "--workers", "x"]):
+            status, lines, stderr = self.run_cli(args)
+            self.assertEqual(status, 2)
+            self.assertEqual(lines, [])
+            self.assertTrue("Traceback" not in stderr)
+            self.assertTrue("--" in stderr)
+
+    def test_batch_jsonl(self):
+        stdin = "\n".join([
+            json.dumps({"first": 1, "last": self.disc.last_track_num,
+                        "sectors": self.disc.sectors,
+                        "offsets": test_discs[0]["offsets"], "key": "a"}),
+            json.dumps({"toc": self.disc.toc_string}),
+            "[1]", "{broken"])
+        status, lines, _ = self.run_cli(
+            ["batch", "--input-format", "jsonl", "--workers", "1"], stdin)
+        records = [json.loads(line) for line in lines]
+        self.assertEqual(records[0]["id"], self.disc.id)
+        self.assertEqual(records[0]["key"], "a")
+        self.assertEqual(records[1]["freedb_id"], self.disc.freedb_id)
+        self.assertTrue("error" in records[2])
+        self.assertTrue("error" in records[3])
+
+
+class TestIndex(unittest.TestCase):
+    """Test the fuzzy TOC index
+    """
+
+    def setUp(self):
+        self.tocs = list(_random_tocs(1980, 12))
+        rand = random.Random(12)
+        for first, last, sectors, offsets in self.tocs[:20]:
+            # other pressings of the same discs, the track lengths match
+            shift = rand.randint(-200, 200)
+            self.tocs.append((first, last, sectors + shift,
+                              [max(offset + shift, 0) for offset in offsets]))
+        self.index = discid.TOCIndex()
+        for toc in self.tocs:
+            self.index.add(*toc)
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def brute_force(self, first, last, sectors, offsets, tolerance):
+        numbers = []
+        for number, toc in enumerate(self.tocs):
+            if toc[:2] != (first, last) or len(toc[3]) != len(offsets):
+                continue
+            lengths = [b - a for a, b in zip(offsets, offsets[1:]
+                                             + [sectors])]
+            toc_lengths = [b - a for a, b in zip(toc[3], toc[3][1:]
+                                                 + [toc[2]])]
+            differences = [abs(sum(toc_lengths) - sum(lengths))]
+            differences += [abs(a - b) for a, b in zip(toc_lengths, lengths)]
+            if max(differences) <= tolerance:
+                numbers.append(number)
+        return sorted(numbers)
+
+    def test_exact(self):
+        for number in (0, 17, 1999):
+            first, last, sectors, offsets = self.tocs[number]
+            disc = discid.put(first, last, sectors, offsets, engine="python")
+            candidates = dict((candidate.number, candidate) for candidate
+                              in self.index.find(disc, tolerance=0))
+            self.assertEqual(candidates[number].distance, 0)
+            self.assertEqual(candidates[number].sectors, sectors)
+            self.assertEqual(list(candidates[number].offsets), list(offsets))
+        # the other pressing of the first disc has the same track lengths
+        candidates = self.index.find_toc(*self.tocs[0], tolerance=0)
+        self.assertEqual([candidate.number for candidate in candidates],
+                         [0, 1980])
+
+    def test_fuzzy(self):
+        first, last, sectors, offsets = self.tocs[5]
+        shifted = [offset + 40 for offset in offsets]
+        # the same track lengths with another offset of the first track
+        candidates = self.index.find_toc(first, last, sectors + 40, shifted,
+                                         tolerance=0)
+        self.assertEqual([(candidate.number, candidate.distance)
+                          for candidate in candidates], [(5, 0), (1985, 0)])
+        self.assertEqual(candidates[0].offsets, tuple(offsets))
+        # the last track is 20 sectors longer
+        candidates = self.index.find_toc(first, last, sectors + 60, shifted,
+                                         tolerance=50)
+        self.assertTrue(5 in [candidate.number for candidate in candidates])
+        self.assertEqual(candidates[0].distance, 20)
+        candidates = self.index.find_toc(first, last, sectors + 60, shifted,
+                                         tolerance=19)
+        self.assertFalse(5 in [candidate.number for candidate in candidates])
+        for tolerance in (0, 300, 3000):
+            for first, last, sectors, offsets in self.tocs[:20]:
+                candidates = self.index.find_toc(first, last, sectors,
+                                                 offsets, tolerance)
+                self.assertEqual(
+                    sorted(candidate.number for candidate in candidates),
+                    self.brute_force(first, last, sectors, offsets,
+                                     tolerance))
+                distances = [candidate.distance for candidate in candidates]
+                self.assertEqual(distances, sorted(distances))
+
+    def test_invalid(self):
+        self.assertRaises(discid.TOCError, self.index.add, 1, 2, 1000, [150])
+        self.assertRaises(discid.TOCError, self.index.add,
+                          1, 2, 1000, [150, 2000])
+        self.assertEqual(len(self.index), 2000)
+        self.assertEqual(self.index.find_toc(1, 99, 1000, [150] * 99), [])
+
+    def test_save_load(self):
+        path = os.path.join(self.tmpdir, "index")
+        self.index.save(path)
+        loaded = discid.TOCIndex.load(path)
+        self.assertEqual(len(loaded), len(self.index))
+        for toc in self.tocs[:50]:
+            self.assertEqual(loaded.find_toc(*toc), self.index.find_toc(*toc))
+        number = loaded.add(*self.tocs[0])
+        self.assertEqual(number, 2000)
+        self.assertEqual([c.number for c in loaded.find_toc(*self.tocs[0])
+                          if c.distance == 0], [0, 1980, 2000])
+        with open(path, "wb") as index_file:
+            index_file.write(b"garbage")
+        self.assertRaises(ValueError, discid.TOCIndex.load, path)
+
+
+class TestFreeDBIndex(unittest.TestCase):
+    """Test the memory-mapped index by FreeDB ID
+    """
+
+    def setUp(self):
+        self.tocs = list(_random_tocs(1000, 13))
+        # a different disc colliding on the FreeDB ID
+        first, last, sectors, offsets = self.tocs[0]
+        # move the last track within the same second
+        if offsets[-1] % 75:
+            moved = offsets[-1] - 1
+        else:
+            moved = offsets[-1] + 1
+        self.collision = (first, last, sectors, offsets[:-1] + [moved])
+        self.tocs.append(self.collision)
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "freedb")
+        self.index = discid.FreeDBIndex.build(self.path, self.tocs)
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_find(self):
+        self.assertEqual(len(self.index), 1001)
+        for number, toc in enumerate(self.tocs):
+            entries = self.index.find_toc(*toc)
+            self.assertEqual([entry.number for entry in entries], [number])
+            self.assertEqual(entries[0].sectors, toc[2])
+            self.assertEqual(list(entries[0].offsets), list(toc[3]))
+        disc = discid.put(*self.tocs[0], engine="python")
+        self.assertEqual([entry.number for entry in self.index.find(disc)],
+                         [0])
+        self.assertEqual(self.index.find_toc(1, 1, 1000, [150]), [])
+
+    def test_candidates(self):
+        disc = discid.put(*self.collision, engine="python")
+        candidates = self.index.candidates(disc.freedb_id)
+        self.assertEqual(sorted(entry.number for entry in candidates),
+                         [0, 1000])
+        self.assertEqual(candidates[0].freedb_id, disc.freedb_id)
+        self.assertEqual(self.index.candidates(int(disc.freedb_id, 16)),
+                         candidates)
+        self.assertEqual(self.index.candidates("00000000"), [])
+
+    def test_by_length(self):
+        entries = list(self.index.by_length(10, 300, 3000))
+        expected = []
+        for number, toc in enumerate(self.tocs):
+            freedb_id = int(discid.put(*toc, engine="python").freedb_id, 16)
+            seconds = freedb_id >> 8 & 0xffff
+            if freedb_id & 0xff == 10 and 300 <= seconds <= 3000:
+                expected.append(number)
+        self.assertEqual(sorted(entry.number for entry in entries),
+                         sorted(expected))
+        lengths = [int(entry.freedb_id, 16) >> 8 & 0xffff
+                   for entry in entries]
+        self.assertEqual(lengths, sorted(lengths))
+
+    def test_shared(self):
+        code = ("import discid; index = discid.FreeDBIndex(%r); "
+                "print(index.find_toc(*%r)[0].number)"
+                % (self.path, self.tocs[500]))
+        output = subprocess.check_output([sys.executable, "-c", code])
+        self.assertEqual(output.strip(), b"500")
+
+    def test_invalid(self):
+        self.assertRaises(discid.TOCError, discid.FreeDBIndex.build,
+                          self.path + "2", [(1, 2, 1000, [150])])
+        with open(self.path + "2", "wb") as index_file:
+            index_file.write(b"garbage" * 10)
+        self.assertRaises(ValueError, discid.FreeDBIndex, self.path + "2")
+
+    def test_truncated(self):
+        with open(self.path, "rb") as index_file:
+            data = index_file.read()
+        for cut in (6, 8, len(data) - 20):
+            with open(self.path + "2", "wb") as index_file:
+                index_file.write(data[:-cut])
+            self.assertRaises(ValueError, discid.FreeDBIndex,
+                              self.path + "2")
+
+
+@unittest.skipIf(sys.platform == "win32", "needs the C library by name None")
+class TestInstrument(unittest.TestCase):
+    """Test counting the calls into a library
+    """
+
+    def setUp(self):
+        import ctypes
+        from discid.libdiscid import _Library
+        # the C library stands in for libdiscid
+        self.library = _Library()
+        self.library._cdll = ctypes.CDLL(None)
+        self.library.abs.argtypes = (ctypes.c_int, )
+        self.library.abs(-1)
+        self.raw_abs = self.library.abs
+
+    def tearDown(self):
+        discid.instrument(False)
+        discid.set_stats_hook(None)
+
+    def test_off(self):
+        from discid.instrument import _stats
+        # no wrapper while not instrumented
+        self.assertTrue(self.library.abs is self.raw_abs)
+        self.assertEqual(_stats(self.library, False), {})
+        self.library._instrument(True)
+        self.library._instrument(False)
+        self.assertTrue(self.library.abs is self.raw_abs)
+
+    def test_counters(self):
+        from discid.instrument import _stats
+        self.library._instrument(True)
+        self.assertFalse(self.library.abs is self.raw_abs)
+        for number in range(-5, 5):
+            self.assertEqual(self.library.abs(number), abs(number))
+        self.assertRaises(Exception, self.library.abs, "string")
+        self.library.labs(3)
+        stats = _stats(self.library, True)
+        self.assertEqual(stats["abs"]["calls"], 11)
+        self.assertEqual(stats["abs"]["errors"], 1)
+        self.assertEqual(stats["labs"]["calls"], 1)
+        self.assertEqual(sum(count for _, count
+                             in stats["abs"]["histogram"]), 11)
+        self.assertTrue(stats["abs"]["min"] <= stats["abs"]["mean"]
+                        <= stats["abs"]["max"])
+        self.assertEqual(_stats(self.library, False)["abs"]["calls"], 0)
+
+    def test_public(self):
+        def called(stats):
+            # functions of an already loaded libdiscid have zero counters
+            return dict((name, counter) for name, counter in stats.items()
+                        if counter["calls"])
+        discid.instrument()
+        self.assertEqual(called(discid.stats()), {})
+        pushed = []
+        discid.set_stats_hook(pushed.append, interval=0.01)
+        for _ in range(100):
+            if pushed:
+                break
+            time.sleep(0.01)
+        discid.set_stats_hook(None)
+        self.assertEqual(called(pushed[0]), {})
+        discid.instrument(False)
+        self.assertEqual(discid.stats(), {})
+
+
+class TestStore(unittest.TestCase):
+    """Test the binary TOC file format
+    """
+
+    def setUp(self):
+        self.tocs = list(_random_tocs(500, 14))
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "tocs")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def assertRecord(self, record, toc):
+        self.assertEqual((record.first, record.last, record.sectors),
+                         toc[:3])
+        self.assertEqual(list(record.offsets), list(toc[3]))
+
+    def test_write_read(self):
+        with discid.TOCWriter(self.path) as writer:
+            writer.write_many(self.tocs)
+            self.assertEqual(len(writer), 500)
+        reader = discid.TOCReader(self.path)
+        self.assertEqual(len(reader), 500)
+        for record, toc in zip(reader, self.tocs):
+            self.assertRecord(record, toc)
+            self.assertTrue(record.id is None)
+        self.assertRecord(reader[-1], self.tocs[-1])
+        self.assertRaises(IndexError, reader.__getitem__, 500)
+        disc = discid.put(*reader[3][:4], engine="python")
+        self.assertEqual(disc.sectors, self.tocs[3][2])
+        reader.close()
+
+    def test_ids(self):
+        disc = discid.put(*self.tocs[0], engine="python")
+        with discid.TOCWriter(self.path, ids=True) as writer:
+            writer.write_disc(disc)
+            writer.write_many(self.tocs[1:])
+        with discid.TOCReader(self.path) as reader:
+            self.assertEqual(reader[0].id, disc.id)
+            for record in reader:
+                self.assertEqual(
+                    record.id, discid.put(*record[:4], engine="python").id)
+            columns = reader.columns(10, 60)
+            self.assertEqual(discid.put_many(*columns).ids,
+                             [reader[i].id for i in range(10, 60)])
+
+    def test_append(self):
+        with discid.TOCWriter(self.path) as writer:
+            writer.write_many(self.tocs[:101])
+        with discid.TOCWriter(self.path) as writer:
+            self.assertEqual(writer.write(*self.tocs[101]), 101)
+            writer.write_many(self.tocs[102:])
+        with discid.TOCReader(self.path) as reader:
+            self.assertEqual(len(reader), 500)
+            for record, toc in zip(reader, self.tocs):
+                self.assertRecord(record, toc)
+
+    def test_append_unclosed(self):
+        with discid.TOCWriter(self.path) as writer:
+            writer.write_many(self.tocs[:100])
+        # a writer that never gets closed, like after a crash
+        writer = discid.TOCWriter(self.path)
+        writer.write_many(self.tocs[100:])
+        writer._flush()
+        with discid.TOCReader(self.path) as reader:
+            self.assertEqual(len(reader), 100)
+            for record, toc in zip(reader, self.tocs):
+                self.assertRecord(record, toc)
+        writer.close()
+        self.assertEqual(os.listdir(self.tmpdir), ["tocs"])
+        with discid.TOCReader(self.path) as reader:
+            self.assertEqual(len(reader), 500)
+
+    def test_invalid(self):
+        writer = discid.TOCWriter(self.path)
+        self.assertRaises(discid.TOCError, writer.write, 1, 2, 1000, [150])
+        writer.write(*self.tocs[0])
+        # not closed yet
+        self.assertRaises(ValueError, discid.TOCReader, self.path)
+        writer.close()
+        with open(self.path, "wb") as store_file:
+            store_file.write(b"garbage" * 10)
+        self.assertRaises(ValueError, discid.TOCReader, self.path)
+        self.assertRaises(ValueError, discid.TOCWriter, self.path)
+
+
+class TestPickle(unittest.TestCase):
+    """Test pickling discs and tracks
+    """
+
+    def setUp(self):
+        test_disc = test_discs[0]
+        self.disc = discid.put(test_disc["first"], test_disc["last"],
+                               test_disc["sectors"], test_disc["offsets"],
+                               engine="python")
+
+    def assertSameDisc(self, disc, other):
+        for name in ["id", "freedb_id", "toc_string", "submission_url",
+                     "first_track_num", "last_track_num", "sectors", "mcn",
+                     "cddb_query_string"]:
+            self.assertEqual(getattr(disc, name), getattr(other, name))
+        self.assertEqual([(track.offset, track.sectors, track.isrc)
+                          for track in disc.tracks],
+                         [(track.offset, track.sectors, track.isrc)
+                          for track in other.tracks])
+
+    def test_pickle(self):
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            copy = pickle.loads(pickle.dumps(self.disc, protocol))
+            self.assertTrue(isinstance(copy, discid.Disc))
+            self.assertSameDisc(copy, self.disc)
+            track = pickle.loads(pickle.dumps(self.disc.tracks[3], protocol))
+            self.assertEqual(track.number, 4)
+            self.assertEqual(track.offset, self.disc.tracks[3].offset)
+        snapshot = self.disc.snapshot()
+        self.assertSameDisc(pickle.loads(pickle.dumps(snapshot)), snapshot)
+        self.assertEqual(pickle.loads(pickle.dumps(snapshot.tracks[0])).isrc,
+                         None)
+        self.assertRaises(ValueError, pickle.dumps, discid.Disc("python"))
+
+    def test_features(self):
+        import struct
+        data = self.disc.to_bytes()
+        self.assertEqual(len(data), 8 + 4 * 15)
+        isrcs = ["DEA%09d" % number if number % 2 else ""
+                 for number in range(1, 16)]
+        # the data of a read with the "mcn" and "isrc" features
+        data = (struct.pack("<BBBB", 1, 1, 15, 3) + data[4:]
+                + b"".join(struct.pack("<B", len(string)) + string.encode()
+                           for string in ["4006381333931"] + isrcs))
+        disc = discid.Disc.from_bytes(data)
+        self.assertEqual(disc.id, self.disc.id)
+        self.assertEqual(disc.mcn, "4006381333931")
+        self.assertEqual([track.isrc for track in disc.tracks], isrcs)
+        copy = pickle.loads(pickle.dumps(disc))
+        self.assertSameDisc(copy, disc)
+        self.assertEqual(copy.to_bytes(), data)
+        self.assertEqual(pickle.loads(pickle.dumps(disc.tracks[0])).isrc,
+                         isrcs[0])
+        self.assertRaises(ValueError, discid.Disc.from_bytes, data[:10])
+        self.assertRaises(ValueError, discid.Disc.from_bytes, data[:-3])
+        self.assertRaises(ValueError, discid.Disc.from_bytes,
+                          b"\x02" + data[1:])
+
+    def test_process_pool(self):
+        from concurrent.futures import ProcessPoolExecutor
+        discs = [discid.put(*toc, engine="python")
+                 for toc in _random_tocs(20, 15)]
+        with ProcessPoolExecutor(2) as executor:
+            self.assertEqual(list(executor.map(str, discs)),
+                             [disc.id for disc in discs])
+
+
+class TestDedupe(unittest.TestCase):
+    """Test comparing discs by TOC and removing duplicates
+    """
+
+    def setUp(self):
+        self.tocs = list(_random_tocs(300, 16))
+        rand = random.Random(16)
+        self.discs = [discid.put(*rand.choice(self.tocs), engine="python")
+                      for _ in range(1000)]
+
+    def test_equality(self):
+        disc = discid.put(*self.tocs[0], engine="python")
+        same = discid.put(*self.tocs[0], engine="python")
+        other = discid.put(*self.tocs[1], engine="python")
+        self.assertEqual(disc, same)
+        self.assertFalse(disc != same)
+        self.assertNotEqual(disc, other)
+        self.assertEqual(hash(disc), hash(same))
+        self.assertNotEqual(disc, self.tocs[0])
+        snapshot = same.snapshot()
+        self.assertEqual(disc, snapshot)
+        self.assertEqual(snapshot, disc)
+        self.assertEqual(hash(disc), hash(snapshot))
+        self.assertEqual(len(set([disc, same, other, snapshot])), 2)
+        self.assertEqual(disc.tracks[0], same.tracks[0])
+        self.assertNotEqual(disc.tracks[0], disc.tracks[1])
+        self.assertEqual(hash(disc.tracks[0]), hash(same.tracks[0]))
+        self.assertEqual(snapshot.tracks[0], disc.snapshot().tracks[0])
+        empty = discid.Disc("python")
+        self.assertEqual(empty, empty)
+        self.assertNotEqual(empty, discid.Disc("python"))
+
+    def test_dedupe(self):
+        expected = []
+        for disc in self.discs:
+            if disc not in expected:
+                expected.append(disc)
+        result = list(discid.dedupe(iter(self.discs)))
+        self.assertEqual(len(result), len(set(self.discs)))
+        self.assertEqual([id(disc) for disc in result],
+                         [id(disc) for disc in expected])
+
+    def test_spill(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            discs = self.discs + [disc.snapshot() for disc in self.discs]
+            result = list(discid.dedupe(discs, max_keys=50,
+                                        directory=tmpdir))
+            self.assertEqual(result, list(discid.dedupe(self.discs)))
+            self.assertEqual(os.listdir(tmpdir), [])
+            # closing the generator early removes the database too
+            generator = discid.dedupe(discs, max_keys=10, directory=tmpdir)
+            for _ in range(20):
+                next(generator)
+            self.assertEqual(len(os.listdir(tmpdir)), 1)
+            generator.close()
+            self.assertEqual(os.listdir(tmpdir), [])
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+class TestUtil(unittest.TestCase):
+    """Test the conversion of sectors and offsets
+    """
+
+    def test_seconds(self):
+        # the rounding of MusicBrainz Server
+        for sectors in range(0, 100000, 7):
+            self.assertEqual(discid.sectors_to_seconds(sectors),
+                             int(math.floor(sectors / 75.0 + 0.5)))
+        self.assertEqual(discid.sectors_to_seconds(112), 1)
+        self.assertEqual(discid.sectors_to_seconds(113), 2)
+        sectors = array.array("i", [0, 37, 38, 112, 113, 258725])
+        expected = [0, 0, 1, 1, 2, 3450]
+        self.assertEqual(list(discid.sectors_to_seconds(sectors)), expected)
+        self.assertEqual(list(discid.sectors_to_seconds(memoryview(sectors))),
+                         expected)
+        self.assertEqual(list(discid.sectors_to_seconds(list(sectors))),
+                         expected)
+
+    def test_msf(self):
+        self.assertEqual(discid.sectors_to_msf(258725), (57, 29, 50))
+        self.assertEqual(discid.format_msf(258725), "57:29:50")
+        minutes, seconds, frames = discid.sectors_to_msf(
+                array.array("i", [74, 75, 4500]))
+        self.assertEqual(list(minutes), [0, 0, 1])
+        self.assertEqual(list(seconds), [0, 1, 0])
+        self.assertEqual(list(frames), [74, 0, 0])
+        self.assertEqual(discid.format_msf([74, 4500]),
+                         ["00:00:74", "01:00:00"])
+
+    def test_track_lengths(self):
+        test_disc = test_discs[0]
+        disc = discid.put(test_disc["first"], test_disc["last"],
+                          test_disc["sectors"], test_disc["offsets"],
+                          engine="python")
+        lengths = discid.track_lengths(test_disc["offsets"],
+                                       test_disc["sectors"])
+        self.assertEqual(list(lengths),
+                         [track.sectors for track in disc.tracks])
+        self.assertEqual(list(discid.sectors_to_seconds(lengths)),
+                         [track.seconds for track in disc.tracks])
+
+    def test_track_lengths_index(self):
+        tocs = _random_tocs(20, 19)
+        offsets = array.array("i")
+        index = []
+        expected = []
+        for first, last, sectors, track_offsets in tocs:
+            index.append(len(offsets))
+            offsets.extend(track_offsets)
+            disc = discid.put(first, last, sectors, track_offsets,
+                              engine="python")
+            expected.extend(track.sectors for track in disc.tracks)
+        leadouts = [toc[2] for toc in tocs]
+        self.assertEqual(list(discid.track_lengths(offsets, leadouts, index)),
+                         expected)
+        index.append(len(offsets))
+        self.assertEqual(list(discid.track_lengths(offsets, leadouts, index)),
+                         expected)
+        self.assertRaises(ValueError, discid.track_lengths,
+                          offsets, leadouts, index[:5])
+        # a TOC without offsets in between
+        index.insert(3, index[3])
+        leadouts.insert(3, 1000)
+        self.assertEqual(list(discid.track_lengths(offsets, leadouts, index)),
+                         expected)
+        try:
+            import numpy
+        except ImportError:
+            return
+        self.assertEqual(list(discid.track_lengths(
+            numpy.array(offsets), numpy.array(leadouts), index)), expected)
+        self.assertEqual(list(discid.track_lengths(
+            numpy.array([], dtype=int), [1000], [0])), [])
+
+
+class TestLookup(unittest.TestCase):
+    """Test the web service client with the stub server
+    """
+
+    def setUp(self):
+        self.discs = [discid.put(*toc, engine="python")
+                      for toc in _random_tocs(6, 21)]
+        self.stub = discid.lookup.StubServer()
+        self.stub.add(self.discs[0], [{"id": "known"}])
+        self.stub._tocs[self.discs[1].toc_string] = [{"id": "similar"}]
+        self.stub.start()
+
+    def tearDown(self):
+        self.stub.stop()
+
+    def test_lookup(self):
+        with discid.LookupClient(self.stub.url, rate=None) as client:
+            result = client.lookup(self.discs[0])
+            self.assertEqual(result["id"], self.discs[0].id)
+            self.assertEqual(result["releases"], [{"id": "known"}])
+            # the TOC is used when the disc ID is unknown
+            result = client.lookup(self.discs[1])
+            self.assertEqual(result["releases"], [{"id": "similar"}])
+            self.assertTrue(client.lookup(self.discs[1], fuzzy=False) is None)
+            self.assertTrue(client.lookup(self.discs[2].id) is None)
+            result = client.lookup_toc(self.discs[1].toc_string)
+            self.assertEqual(result["release-count"], 1)
+        # one connection for all requests
+        self.assertEqual(self.stub.requests, 5)
+        self.assertEqual(self.stub.connections, 1)
+
+    def test_lookup_many(self):
+        discs = self.discs * 5
+        with discid.LookupClient(self.stub.url, rate=None,
+                                 connections=3) as client:
+            results = list(client.lookup_many(discs, fuzzy=False))
+        self.assertEqual(len(results), len(discs))
+        for disc, result in zip(discs, results):
+            if disc is self.discs[0]:
+                self.assertEqual(result["id"], disc.id)
+            else:
+                self.assertTrue(result is None)
+        self.assertTrue(self.stub.connections <= 3)
+
+    def test_errors(self):
+        with discid.LookupClient(self.stub.url + "/other",
+                                 rate=None) as client:
+            self.assertRaises(discid.WebServiceError, client.lookup,
+                              self.discs[0])
+            results = list(client.lookup_many(self.discs[:2],
+                                              return_exceptions=True))
+            self.assertEqual([result.status for result in results],
+                             [400, 400])
+        self.assertRaises(ValueError, discid.LookupClient, "ftp://localhost")
+
+    def test_rate_limit(self):
+        self.stub.rate = 20.0
+        with discid.LookupClient(self.stub.url, rate=20.0,
+                                 connections=2) as client:
+            start = time.time()
+            results = list(client.lookup_many(self.discs))
+            elapsed = time.time() - start
+        self.assertEqual(len(results), len(self.discs))
+        self.assertTrue(elapsed >= (len(self.discs) - 1) / 20.0 * 0.9)
+        # requests that are too fast are repeated
+        self.stub.rate = 5.0
+        with discid.LookupClient(self.stub.url, rate=None) as client:
+            results = list(client.lookup_many(self.discs[:3]))
+        self.assertEqual(results[0]["id"], self.discs[0].id)
+        self.assertTrue(self.stub.requests > len(self.discs) + 3)
+
+    def test_rate_limiter(self):
+        limiter = discid.RateLimiter(10.0)
+        delays = [limiter.reserve() for _ in range(3)]
+        self.assertTrue(delays[0] <= 0.01)
+        self.assertTrue(0.09 < delays[1] <= 0.1)
+        self.assertTrue(0.19 < delays[2] <= 0.2)
+        self.assertEqual(discid.RateLimiter(None).reserve(), 0.0)
+
+    def test_async(self):
+        if sys.version_info < (3, 7):
+            self.skipTest("needs asyncio.run")
+
+        async def lookup():
+            async with discid.AsyncLookupClient(self.stub.url,
+                                                rate=None) as client:
+                single = await client.lookup(self.discs[0])
+                results = [result async for result
+                           in client.lookup_many(self.discs, fuzzy=False)]
+            return single, results
+        single, results = asyncio.run(lookup())
+        self.assertEqual(single["id"], self.discs[0].id)
+        self.assertEqual(len(results), len(self.discs))
+        self.assertEqual(results[0]["id"], self.discs[0].id)
+        self.assertTrue(results[1] is None)
+
+
+class TestCache(unittest.TestCase):
+    """Test the persistent cache for lookup results
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "cache.sqlite")
+        self.discs = [discid.put(*toc, engine="python")
+                      for toc in _random_tocs(20, 22)]
+        self.calls = []
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _lookup(self, disc):
+        self.calls.append(disc)
+        return {"id": disc.id}
+
+    def _lookup_many(self, discs):
+        return [self._lookup(disc) for disc in discs]
+
+    def test_get_put(self):
+        with discid.LookupCache(self.path) as cache:
+            disc = self.discs[0]
+            self.assertFalse(disc in cache)
+            self.assertTrue(cache.get(disc) is None)
+            self.assertRaises(KeyError, lambda: cache[disc])
+            cache[disc] = {"releases": []}
+            self.assertEqual(cache[disc], {"releases": []})
+            self.assertEqual(cache[disc.id], {"releases": []})
+            # discs are found by their TOC as well
+            self.assertEqual(cache[disc.toc_string], {"releases": []})
+            self.assertEqual(cache[disc.toc_string.replace(" ", "+")],
+                             {"releases": []})
+            # the TOC is the fallback key
+            cache.put(self.discs[1].toc_string, {"toc": True})
+            self.assertEqual(cache[self.discs[1]], {"toc": True})
+            # nothing found is a result too
+            cache[self.discs[2]] = None
+            self.assertTrue(self.discs[2] in cache)
+            self.assertEqual(len(cache), 3)
+            del cache[disc]
+            self.assertFalse(disc in cache)
+            stats = cache.stats(reset=True)
+            self.assertEqual(stats["stores"], 3)
+            self.assertEqual(stats["entries"], 2)
+            self.assertEqual(cache.stats()["hits"], 0)
+        # another process or thread sees the entries
+        with discid.LookupCache(self.path) as cache:
+            self.assertEqual(cache[self.discs[1]], {"toc": True})
+
+    def test_expiry(self):
+        with discid.LookupCache(self.path, negative_ttl=0) as cache:
+            cache[self.discs[0]] = {"found": True}
+            cache[self.discs[1]] = None
+            self.assertTrue(self.discs[0] in cache)
+            self.assertFalse(self.discs[1] in cache)
+            cache[self.discs[2]] = None
+            self.assertEqual(cache.expire(), 1)
+            self.assertEqual(len(cache), 1)
+
+    def test_eviction(self):
+        touch_interval = discid.cache._TOUCH_INTERVAL
+        discid.cache._TOUCH_INTERVAL = -1.0
+        try:
+            with discid.LookupCache(self.path, max_entries=10) as cache:
+                for disc in self.discs[:10]:
+                    cache[disc] = {"id": disc.id}
+                # the first disc was used recently
+                self.assertTrue(self.discs[0] in cache)
+                for disc in self.discs[10:15]:
+                    cache[disc] = {"id": disc.id}
+                self.assertEqual(cache.evict(), 6)
+                self.assertTrue(self.discs[0] in cache)
+                self.assertFalse(self.discs[1] in cache)
+                self.assertTrue(self.discs[14] in cache)
+                self.assertEqual(len(cache), 9)
+                self.assertEqual(cache.stats()["evictions"], 6)
+        finally:
+            discid.cache._TOUCH_INTERVAL = touch_interval
+
+    def test_cached(self):
+        with discid.LookupCache(self.path) as cache:
+            lookup = cache.cached(self._lookup)
+            for disc in self.discs[:5] * 3:
+                self.assertEqual(lookup(disc), {"id": disc.id})
+            self.assertEqual(self.calls, self.discs[:5])
+            results = list(cache.lookup_many(self.discs * 2,
+                                             self._lookup_many, chunksize=7))
+            self.assertEqual(results,
+                             [{"id": disc.id} for disc in self.discs * 2])
+            self.assertEqual(self.calls, self.discs)
+            stats = cache.stats()
+            self.assertEqual(stats["misses"], len(self.discs))
+            self.assertEqual(stats["hits"], 10 + 5 + len(self.discs))
+
+    def test_threads(self):
+        with discid.LookupCache(self.path) as cache:
+            def store(discs):
+                for disc in discs:
+                    cache[disc] = {"id": disc.id}
+            threads = [threading.Thread(target=store,
+                                        args=(self.discs[number::4], ))
+                       for number in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(len(cache), len(self.discs))
+
+
+class TestCDDB(unittest.TestCase):
+    """Test the CDDB client with the fake server
+    """
+
+    def setUp(self):
+        self.discs = [discid.put(*toc, engine="python")
+                      for toc in _random_tocs(10, 23)]
+        self.server = discid.cddb.FakeCDDBServer()
+        self.server.add(self.discs[0], title="Artist / Title",
+                        tracks=["Track\\nOne"]
+                               + ["x"] * (len(self.discs[0].tracks) - 1))
+        self.server.add(self.discs[1], "rock")
+        self.server.add(self.discs[1], "jazz")
+        self.server.start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_parser(self):
+        data = (b"200 Hello\r\n"
+                b"210 Found exact matches\r\nrock 01 A / B\r\n"
+                b"jazz 01 C / D\r\n.\r\n"
+                b"210 misc 01 CD database entry follows\r\n"
+                b"..DTITLE\r\n.\r\n202 No match\r\n")
+        parser = discid.cddb._ResponseParser()
+        responses = []
+        # the responses are complete as soon as their last line is there
+        for position in range(len(data)):
+            responses.extend(parser.feed(data[position:position + 1]))
+        self.assertFalse(parser.pending())
+        self.assertEqual([response.code for response in responses],
+                         [200, 210, 210, 202])
+        self.assertEqual(responses[1].lines, ["rock 01 A / B",
+                                              "jazz 01 C / D"])
+        self.assertEqual(responses[2].lines, [".DTITLE"])
+        self.assertTrue(responses[3].lines is None)
+        self.assertRaises(discid.CDDBError, parser.feed, b"garbage\n")
+
+    def _check_client(self, url):
+        with discid.CDDBClient(url) as client:
+            matches = client.query(self.discs[0])
+            self.assertEqual(matches, [discid.CDDBMatch(
+                "misc", self.discs[0].freedb_id, "Artist / Title", True)])
+            matches = client.query(self.discs[1].cddb_query_string)
+            self.assertEqual([match.category for match in matches],
+                             ["jazz", "rock"])
+            self.assertEqual(client.query(self.discs[2]), [])
+            entry = client.read(matches[0])
+            self.assertEqual(entry.category, "jazz")
+            self.assertEqual(entry.freedb_id, self.discs[1].freedb_id)
+            self.assertEqual(len(entry.tracks), len(self.discs[1].tracks))
+            entry = client.read("misc", self.discs[0].freedb_id)
+            self.assertEqual(entry.title, "Artist / Title")
+            self.assertEqual(entry.tracks[0], "Track\nOne")
+            self.assertTrue(client.read("rock", "00000000") is None)
+            results = list(client.query_many(self.discs * 3))
+            self.assertEqual([len(matches) for matches in results],
+                             [1, 2] + [0] * 8 + [1, 2] + [0] * 8
+                             + [1, 2] + [0] * 8)
+            entries = list(client.read_many(
+                match for matches in results for match in matches))
+            self.assertEqual(len(entries), 9)
+            self.assertEqual(entries[1].category, "jazz")
+            query = discid.from_cddb_query(self.discs[0].cddb_query_string)
+            self.assertEqual(len(client.query(query)), 1)
+
+    def test_cddbp(self):
+        self._check_client(self.server.cddbp_url)
+        self.assertEqual(self.server.connections, 1)
+
+    def test_http(self):
+        self._check_client(self.server.http_url)
+        self.assertEqual(self.server.connections, 1)
+
+    def test_pipeline(self):
+        with discid.CDDBClient(self.server.cddbp_url,
+                               pipeline=8) as client:
+            results = list(client.query_many(self.discs * 10))
+            self.assertEqual(len(results), 100)
+            # a closed connection is opened again
+            client._connection._socket.close()
+            self.assertEqual(len(client.query(self.discs[1])), 2)
+        self.assertEqual(self.server.connections, 2)
+
+    def test_errors(self):
+        self.assertRaises(ValueError, discid.CDDBClient, "ftp://localhost")
+        with discid.CDDBClient(self.server.cddbp_url) as client:
+            self.assertRaises(discid.CDDBError, client.query,
+                              "0000000a 2 150 x 100")
+            try:
+                client.query("0000000a 2 150 x 100")
+            except discid.CDDBError as exc:
+                self.assertEqual(exc.code, 500)
+
+
+class TestVerificationIDs(unittest.TestCase):
+    """Test the AccurateRip and CTDB IDs
+    """
+
+    def test_accuraterip(self):
+        disc = discid.put(1, 2, 1000, [150, 500], engine="python")
+        # 0 + 350 + 850 and 1 * 1 + 350 * 2 + 850 * 3
+        self.assertEqual(disc.accuraterip_id,
+                         "002-000004b0-00000cb3-%s" % disc.freedb_id)
+        self.assertEqual(disc.accuraterip_url,
+                         "http://www.accuraterip.com/accuraterip/0/b/4/"
+                         "dBAR-002-000004b0-00000cb3-%s.bin" % disc.freedb_id)
+        test_disc = test_discs[0]
+        disc = discid.put(test_disc["first"], test_disc["last"],
+                          test_disc["sectors"], test_disc["offsets"],
+                          engine="python")
+        self.assertTrue(disc.accuraterip_id.startswith("015-"))
+        self.assertTrue(disc.accuraterip_id.endswith(test_disc["freedb"]))
+        self.assertTrue(discid.Disc("python").accuraterip_id is None)
+
+    def test_ctdb(self):
+        disc = discid.put(1, 2, 1000, [150, 500], engine="python")
+        hash_input = "%08X%08X" % (350, 850) + "0" * 98 * 8
+        self.assertEqual(discid.engine._ctdb_hash_input(1000, [150, 500]),
+                         hash_input)
+        digest = hashlib.sha1(hash_input.encode("ascii")).digest()
+        self.assertEqual(disc.ctdb_id, discid.engine._encode_digest(digest))
+        # only the relative offsets count
+        shifted = discid.put(1, 2, 1100, [250, 600], engine="python")
+        self.assertEqual(shifted.ctdb_id, disc.ctdb_id)
+        self.assertNotEqual(shifted.id, disc.id)
+        self.assertTrue(discid.Disc("python").ctdb_id is None)
+
+    def test_snapshot(self):
+        for toc in _random_tocs(20, 24):
+            disc = discid.put(*toc, engine="python")
+            snapshot = disc.snapshot()
+            self.assertEqual(snapshot.accuraterip_id, disc.accuraterip_id)
+            self.assertEqual(snapshot.accuraterip_url, disc.accuraterip_url)
+            self.assertEqual(snapshot.ctdb_id, disc.ctdb_id)
+
+    def test_disc_ids_many(self):
+        tocs = _random_tocs(50, 24)
+        tocs.append((1, 2, 100, [150, 500]))
+        result = discid.disc_ids_many(*zip(*tocs), errors="ignore")
+        self.assertTrue(isinstance(result, discid.DiscIDs))
+        for number, toc in enumerate(tocs[:-1]):
+            disc = discid.put(*toc, engine="python")
+            self.assertEqual(result.ids[number], disc.id)
+            self.assertEqual(result.freedb_ids[number], disc.freedb_id)
+            self.assertEqual(result.accuraterip_ids[number],
+                             disc.accuraterip_id)
+            self.assertEqual(result.ctdb_ids[number], disc.ctdb_id)
+        self.assertTrue(result.ctdb_ids[-1] is None)
+        self.assertRaises(discid.TOCError, discid.disc_ids_many,
+                          *zip(*tocs))
+
+
+class TestRips(unittest.TestCase):
+    """Test reading TOCs from CUE sheets, logs and cdrdao TOC files
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        test_disc = test_discs[0]
+        self.toc = (test_disc["first"], test_disc["last"],
+                    test_disc["sectors"], test_disc["offsets"])
+        # the data track of the Enhanced CD follows the audio session
+        self.data_start = test_disc["sectors"] - 150 + 11400
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, name, data):
+        path = os.path.join(self.tmpdir, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        mode = "wb" if isinstance(data, bytes) else "w"
+        with open(path, mode) as stream:
+            stream.write(data)
+        return path
+
+    def write_wav(self, name, sectors):
+        import wave
+        writer = wave.open(os.path.join(self.tmpdir, name), "wb")
+        writer.setnchannels(2)
+        writer.setsampwidth(2)
+        writer.setframerate(44100)
+        writer.writeframes(b"\0" * 2352 * sectors)
+        writer.close()
+
+    def log_text(self, xld=False):
+        _, _, sectors, offsets = self.toc
+        starts = [offset - 150 for offset in offsets] + [self.data_start]
+        ends = [start - 1 for start in starts[1:-1]] + [sectors - 151,
+                                                        self.data_start
+                                                        + 4499]
+        lines = ["Exact Audio Copy V1.0 beta 3", "",
+                 "TOC of the extracted CD", "",
+                 "     Track |   Start  |  Length  | Start sector "
+                 "| End sector ",
+                 "    " + "-" * 57]
+        for number, (start, end) in enumerate(zip(starts, ends), 1):
+            if xld:
+                times = discid.format_msf([start, end - start + 1])
+            else:
+                times = ["%d:%02d.%02d" % (value // 4500, value // 75 % 60,
+                                           value % 75)
+                         for value in (start, end - start + 1)]
+            lines.append("       %2d  | %s | %s |    %6d    |   %6d   "
+                         % (number, times[0], times[1], start, end))
+        lines += ["", "Range status and errors", "     Track | 1 | 2 | 3 | 4"]
+        return "\n".join(lines) + "\n"
+
+    def test_log(self):
+        self.assertEqual(discid.parse_log(self.log_text()), self.toc)
+        self.assertEqual(discid.parse_log(self.log_text(xld=True)),
+                         self.toc)
+        # EAC writes UTF-16
+        path = self.write("eac.log", self.log_text().encode("utf-16"))
+        self.assertEqual(discid.read_rip(path), self.toc)
+        self.assertRaises(discid.TOCError, discid.parse_log, "no TOC")
+
+    def test_cue(self):
+        first, last, sectors, offsets = self.toc
+        lines = ['PERFORMER "Guano Apes"', 'FILE "disc image.wav" WAVE']
+        for number, offset in enumerate(offsets, 1):
+            lines += ["  TRACK %02d AUDIO" % number,
+                      "    INDEX 01 %s" % discid.format_msf(offset - 150)]
+        cue = "\n".join(lines)
+        self.assertEqual(
+            discid.parse_cue(cue, {"disc image.wav": sectors - 150}),
+            self.toc)
+        self.assertEqual(discid.parse_cue(cue, lambda name, file_type:
+                                          sectors - 150), self.toc)
+        self.assertRaises(discid.TOCError, discid.parse_cue, cue)
+        # the lead-out of an Enhanced CD is before the data track
+        data = cue + '\nFILE "data.bin" BINARY\n  TRACK 16 MODE1/2352\n' \
+            "    INDEX 01 02:32:00\n"
+        self.assertEqual(discid.parse_cue(data, {"disc image.wav":
+                                                 sectors - 150,
+                                                 "data.bin": 1}),
+                         self.toc)
+        # without the gap the data track starts where the audio ends
+        self.assertEqual(discid.parse_cue(
+            'FILE "audio.wav" WAVE\n  TRACK 01 AUDIO\n'
+            "    INDEX 01 00:00:00\n  TRACK 02 AUDIO\n"
+            '    INDEX 01 03:00:00\nFILE "data.bin" BINARY\n'
+            "  TRACK 03 MODE1/2352\n    INDEX 01 00:00:00\n",
+            {"audio.wav": 40000, "data.bin": 1}),
+            (1, 2, 40150, [150, 13650]))
+        # the data track of a Mixed Mode CD comes first and stays
+        self.assertEqual(discid.parse_cue(
+            'FILE "image.bin" BINARY\n  TRACK 01 MODE1/2352\n'
+            "    INDEX 01 00:00:00\n  TRACK 02 AUDIO\n"
+            "    INDEX 01 10:00:00\n  TRACK 03 AUDIO\n"
+            "    INDEX 01 20:00:00\n", {"image.bin": 100000}),
+            (1, 3, 100150, [150, 45150, 90150]))
+        self.assertRaises(discid.TOCError, discid.parse_cue,
+                          'FILE "image.bin" BINARY\n  TRACK 01 AUDIO\n'
+                          "    INDEX 01 00:00:00\n  TRACK 02 MODE1/2352\n"
+                          "    INDEX 01 10:00:00\n  TRACK 03 AUDIO\n"
+                          "    INDEX 01 20:00:00\n", {"image.bin": 100000})
+        self.assertRaises(discid.TOCError, discid.parse_cue,
+                          'FILE "a.wav" WAVE\n  TRACK 01 AUDIO\n'
+                          "    INDEX 01 00:61:00", {"a.wav": 100})
+
+    def test_cue_files(self):
+        self.write_wav("01.wav", 300)
+        self.write_wav("02.wav", 400)
+        streaminfo = (b"\0" * 10
+                      + struct.pack(">Q", 44100 << 44 | 1 << 41 | 15 << 36
+                                    | 500 * 588)
+                      + b"\0" * 16)
+        self.write("03.flac", b"fLaC\x80\x00\x00\x22" + streaminfo)
+        path = self.write("rip.cue", "\n".join([
+            'FILE "01.wav" WAVE', "  TRACK 01 AUDIO", "    INDEX 01 00:00:00",
+            'FILE "02.wav" WAVE', "  TRACK 02 AUDIO", "    INDEX 00 00:00:00",
+            "    INDEX 01 00:02:00",
+            "  TRACK 03 AUDIO", "    PREGAP 00:01:00",
+            "    INDEX 01 00:04:00",
+            'FILE "03.flac" WAVE', "  TRACK 04 AUDIO",
+            "    INDEX 01 00:00:00"]))
+        self.assertEqual(discid.read_rip(path),
+                         (1, 4, 150 + 300 + 400 + 75 + 500,
+                          [150, 450 + 150, 450 + 75 + 300, 150 + 775]))
+        self.assertEqual(discid.rips.file_sectors(
+            os.path.join(self.tmpdir, "01.wav")), 300)
+        path = self.write("raw.bin", b"\0" * 2352 * 3)
+        self.assertEqual(discid.rips.file_sectors(path, "AUDIO"), 3)
+        self.assertRaises(discid.TOCError, discid.rips.file_sectors, path)
+
+    def test_cdrdao_toc(self):
+        toc = "\n".join([
+            "CD_DA", 'CATALOG "0000000000000"',
+            'CD_TEXT { LANGUAGE_MAP { 0 : EN }',
+            '  LANGUAGE 0 { TITLE "a } b" } }',
+            "// the first track",
+            "TRACK AUDIO", "NO COPY", 'FILE "disc.wav" 0 00:10:00',
+            "TRACK AUDIO", 'ISRC "DEXXX0000001"',
+            'FILE "disc.wav" 00:10:00 00:20:00', "START 00:02:00",
+            "TRACK AUDIO", "PREGAP 00:01:00",
+            'AUDIOFILE "disc.wav" #44 00:30:00 %d' % (30 * 588),
+            "SILENCE 00:00:10",
+            "TRACK MODE1", "ZERO MODE1 02:32:00", "START",
+            'DATAFILE "data.iso" 01:00:00'])
+        # 750 + 1500 sectors, 75 of pregap and 30 + 10 sectors
+        self.assertEqual(discid.parse_cdrdao_toc(toc),
+                         (1, 3, 150 + 2365, [150, 150 + 900, 150 + 2325]))
+        # the file length is needed without a length in the TOC file
+        self.assertRaises(discid.TOCError, discid.parse_cdrdao_toc,
+                          'TRACK AUDIO\nFILE "disc.wav" 0')
+        self.assertEqual(discid.parse_cdrdao_toc(
+            'TRACK AUDIO\nFILE "disc.wav" 0', {"disc.wav": 1000}),
+            (1, 1, 1150, [150]))
+        # a data track without the gap between the sessions
+        self.assertEqual(discid.parse_cdrdao_toc(
+            'TRACK AUDIO\nFILE "a.wav" 0 00:10:00\nTRACK MODE1\n'
+            'DATAFILE "data.iso" 01:00:00'),
+            (1, 1, 900, [150]))
+        self.assertRaises(discid.TOCError, discid.parse_cdrdao_toc, "CD_DA")
+        self.assertRaises(discid.TOCError, discid.parse_cdrdao_toc,
+                          "TRACK AUDIO\nSILENCE")
+
+    def make_archive(self):
+        """Write TOC files and logs for random TOCs into directories
+        """
+        expected = {}
+        for number, toc in enumerate(_random_tocs(30, 25)):
+            first, last, sectors, offsets = toc
+            if first == 1:
+                lines = ["CD_DA", "TRACK AUDIO",
+                         "PREGAP %s" % discid.format_msf(offsets[0] - 150)]
+                for index, length in enumerate(discid.track_lengths(
+                        offsets, sectors)):
+                    if index:
+                        lines.append("TRACK AUDIO")
+                    lines.append('FILE "image.wav" 0 %d' % (length * 588))
+                name = "%s/%02d/rip.toc" % ("ab"[number % 2], number)
+            else:
+                lines = ["TOC of the extracted CD", ""]
+                ends = offsets[1:] + [sectors]
+                for track, (offset, end) in enumerate(zip(offsets, ends),
+                                                      first):
+                    lines.append(" %d | 0:00.00 | 0:00.00 | %d | %d"
+                                 % (track, offset - 150, end - 151))
+                name = "%s/%02d/rip.log" % ("ab"[number % 2], number)
+            path = self.write(name, "\n".join(lines) + "\n")
+            expected[path] = toc
+        broken = self.write("b/broken.log", "not a log")
+        self.write("b/cover.jpg", b"\xff\xd8")
+        return expected, broken
+
+    def test_scan(self):
+        expected, broken = self.make_archive()
+        results = list(discid.scan_rips(self.tmpdir, workers=1))
+        self.assertEqual([result.path for result in results],
+                         sorted(list(expected) + [broken]))
+        for result in results:
+            if result.path == broken:
+                self.assertTrue(result.error.startswith("TOCError"))
+                continue
+            self.assertEqual(result.error, None)
+            self.assertEqual(result.toc, expected[result.path])
+            disc = discid.put(*result.toc, engine="python")
+            self.assertEqual(result.id, disc.id)
+            self.assertEqual(result.freedb_id, disc.freedb_id)
+        parallel = list(discid.scan_rips(self.tmpdir, workers=2,
+                                         chunksize=3))
+        self.assertEqual(parallel, results)
+        only_logs = list(discid.scan_rips(self.tmpdir, workers=1,
+                                          extensions=[".LOG"]))
+        self.assertEqual(only_logs, [result for result in results
+                                     if result.path.endswith(".log")])
+
+    def test_scan_checkpoint(self):
+        self.make_archive()
+        checkpoint = os.path.join(self.tmpdir, "checkpoint.json")
+        complete = list(discid.scan_rips(self.tmpdir, workers=1))
+        results = discid.scan_rips(self.tmpdir, workers=2, chunksize=4,
+                                   checkpoint=checkpoint)
+        taken = [next(results) for _ in range(10)]
+        results.close()
+        self.assertTrue(os.path.exists(checkpoint))
+        rest = list(discid.scan_rips(self.tmpdir, workers=1,
+                                     checkpoint=checkpoint))
+        self.assertEqual(taken + rest, complete)
+        self.assertEqual(list(discid.scan_rips(self.tmpdir, workers=1,
+                                               checkpoint=checkpoint)), [])
+        # a checkpoint cut short starts the scan again
+        for broken in ('{"after": ["a', '[]', '{"after": 3}'):
+            self.write("checkpoint.json", broken)
+            self.assertEqual(list(discid.scan_rips(
+                self.tmpdir, workers=1, checkpoint=checkpoint)), complete)
+
+    def test_cli(self):
+        expected, broken = self.make_archive()
+        process = subprocess.Popen(
+            [sys.executable, "-m", "discid", "--output-format", "tsv",
+             "scan", self.tmpdir, "--workers", "2", "--progress"],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            universal_newlines=True)
+        stdout, stderr = process.communicate()
+        self.assertEqual(process.returncode, 0)
+        lines = [line.split("\t") for line in stdout.splitlines()]
+        self.assertEqual([line[0] for line in lines],
+                         sorted(list(expected) + [broken]))
+        for line in lines:
+            if line[0] == broken:
+                self.assertEqual(line[1], "error")
+            else:
+                disc = discid.put(*expected[line[0]], engine="python")
+                self.assertEqual(line[1:], [disc.id, disc.freedb_id,
+                                            disc.toc_string])
+        self.assertTrue("1 errors" in stderr)
+
 class TestDisc(unittest.TestCase):
     """Test reading the disc currently in the drive
     """
@@ -197,6 +2006,23 @@ class TestDisc(unittest.TestCase):
             else:
                 self.assertTrue(track.isrc is None)
 
+    def test_read_deferred(self):
+        disc = discid.read(features=["mcn", "isrc"])
+        isrcs = {}
+        def callback(number, isrc):
+            isrcs[number] = isrc
+        deferred_disc = discid.read(features=["mcn", "isrc"], deferred=True,
+                                    callback=callback)
+        self.assertEqual(deferred_disc.id, disc.id)
+        if set(["mcn", "isrc"]) & set(discid.FEATURES):
+            future = deferred_disc.features_future
+            self.assertTrue(future.result() is deferred_disc)
+            self.assertEqual(sorted(isrcs),
+                             [track.number for track in disc.tracks])
+        self.assertEqual(deferred_disc.mcn, disc.mcn)
+        self.assertEqual([track.isrc for track in deferred_disc.tracks],
+                         [track.isrc for track in disc.tracks])
+
     def test_read_put(self):
         # a read followed with a put, which should clear the features
         disc = discid.read(features=["mcn", "isrc"]) # read from default drive